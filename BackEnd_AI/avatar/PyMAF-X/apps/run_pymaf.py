@@ -10,8 +10,10 @@ import time
 import json
 import torch
 import joblib
+import pickle
 import argparse
 import numpy as np
+from PIL import Image
 from tqdm import tqdm
 from torch.utils.data import DataLoader
 import os.path as osp
@@ -20,153 +22,265 @@ from core.cfgs import cfg, parse_args
 from models import pymaf_net
 from core import path_config
 from datasets.inference import Inference
+from datasets.inference_loader import InferenceBatchLoader
 from utils.demo_utils import convert_crop_cam_to_orig_img
 from utils.geometry import convert_to_full_img_cam
 
+from openpifpaf import datasets as ppdatasets
 from openpifpaf import decoder as ppdecoder
 from openpifpaf import network as ppnetwork
+from openpifpaf import transforms as pptransforms
 from openpifpaf.predictor import Predictor
 from openpifpaf.stream import Stream  # not used but imported by Predictor.configure
 
 MIN_NUM_FRAMES = 1
 
 
-def run_demo(args):
-    device = torch.device('cuda') if torch.cuda.is_available() else torch.device('cpu')
-
-    # ---- Input: image_folder only ----
-    if args.image_folder is None:
-        raise ValueError("--image_folder 만 지원합니다.")
-
-    image_folder = args.image_folder
-    image_names = sorted(
-        x for x in os.listdir(image_folder)
-        if x.lower().endswith(('.png', '.jpg', '.jpeg'))
-    )
-    if not image_names:
-        raise FileNotFoundError(f"No images found in {image_folder}")
-
-    num_frames = len(image_names)
-    img0 = cv2.imread(osp.join(image_folder, image_names[0]))
-    if img0 is None:
-        raise RuntimeError(f"Failed to read first image: {image_names[0]}")
-    img_shape = img0.shape
-
-    output_path = args.output_folder
-    os.makedirs(output_path, exist_ok=True)
-
-    print(f'Input images: {num_frames}  |  First image shape: {img_shape}')
-
-    total_time = time.time()
-    args.device = device
-    args.pin_memory = True if torch.cuda.is_available() else False
-
-    # ---- OpenPifPaf person detection (images only) ----
-    pp_det_file_path = osp.join(output_path, 'pp_det_results.pkl')
-    pp_args = copy.deepcopy(args)
-    pp_args.force_complete_pose = True
-    ppdecoder.configure(pp_args)
-    ppnetwork.Factory.configure(pp_args)
-    ppnetwork.Factory.checkpoint = pp_args.detector_checkpoint
-    Predictor.configure(pp_args)
-    Stream.configure(pp_args)
-
-    Predictor.batch_size = pp_args.detector_batch_size
-    Predictor.long_edge = int(pp_args.input_long_edge)  # key: resize big inputs safely
-    Predictor.loader_workers = 1
-
-    predictor = Predictor()
-    image_file_names = [osp.join(image_folder, n) for n in image_names]
-    capture = predictor.images(image_file_names)
-
-    tracking_results = {}
-    print('Running openpifpaf for person detection...')
-    # Avoid division by zero in tqdm total
-    total_batches = max(1, num_frames // max(1, args.detector_batch_size))
-    for preds, _, meta in tqdm(capture, total=total_batches):
+class PyMAFRunner:
+    """
+    OpenPifPaf predictor + PyMAF-X 네트워크를 한 번만 로드해 두고
+    여러 이미지 폴더를 처리하는 상주(resident) 러너.
+    run_demo()와 avatar worker가 모두 이 클래스를 사용한다.
+    OpenPifPaf 는 검출이 처음 필요할 때 로드 (모든 이미지에 sidecar JSON 이 있으면 로드하지 않음).
+    """
+
+    def __init__(self, args):
+        self.args = args
+        self.device = torch.device('cuda') if torch.cuda.is_available() else torch.device('cpu')
+        args.device = self.device
+        args.pin_memory = True if torch.cuda.is_available() else False
+
+        self._predictor = None
+        self.model = self._load_model(args)
+
+    @property
+    def predictor(self):
+        if self._predictor is None:
+            if self.args.no_detector:
+                raise RuntimeError('person detection is needed but --no_detector is set (missing sidecar JSON?)')
+            self._predictor = self._build_predictor(self.args)
+        return self._predictor
+
+    @staticmethod
+    def _build_predictor(args):
+        pp_args = copy.deepcopy(args)
+        pp_args.force_complete_pose = True
+        ppdecoder.configure(pp_args)
+        ppnetwork.Factory.configure(pp_args)
+        ppnetwork.Factory.checkpoint = pp_args.detector_checkpoint
+        Predictor.configure(pp_args)
+        Stream.configure(pp_args)
+
+        Predictor.batch_size = pp_args.detector_batch_size
+        Predictor.long_edge = int(pp_args.input_long_edge)  # key: resize big inputs safely
+        Predictor.loader_workers = pp_args.detector_workers
+        # CIF/CAF decoding of a batch in a process pool (only pays off with more than one image per batch)
+        if pp_args.detector_batch_size > 1 and pp_args.detector_workers > 1:
+            ppdecoder.Decoder.default_worker_pool = pp_args.detector_workers
+
+        return Predictor()
+
+    def _load_model(self, args):
+        device = self.device
+        model = pymaf_net(path_config.SMPL_MEAN_PARAMS, is_train=False).to(device)
+
+        checkpoint_paths = {'body': args.pretrained_body, 'hand': args.pretrained_hand, 'face': args.pretrained_face}
+        if args.pretrained_model is not None:
+            print(f'Loading pretrained weights from "{args.pretrained_model}"')
+            checkpoint = torch.load(args.pretrained_model, map_location=device)
+
+            # remove the state_dict override by hand/face sub-models
+            for part in ['hand', 'face']:
+                if checkpoint_paths[part] is not None:
+                    key_start_list = model.part_module_names[part].keys()
+                    for key in list(checkpoint['model'].keys()):
+                        for key_start in key_start_list:
+                            if key.startswith(key_start):
+                                checkpoint['model'].pop(key)
+
+            # safe load
+            missing, unexpected = model.load_state_dict(checkpoint['model'], strict=False)
+            if missing or unexpected:
+                print("[warn] state_dict mismatch:",
+                      "\n  missing:", missing,
+                      "\n  unexpected:", unexpected)
+            print(f'Loaded checkpoint: {args.pretrained_model}')
+
+        if not all([args.pretrained_body is None, args.pretrained_hand is None, args.pretrained_face is None]):
+            for part in ['body', 'hand', 'face']:
+                checkpoint_path = checkpoint_paths[part]
+                if checkpoint_path is not None:
+                    print(f'Loading checkpoint for the {part} part.')
+                    ckpt = torch.load(checkpoint_path, map_location=device)['model']
+                    checkpoint_filtered = {}
+                    key_start_list = model.part_module_names[part].keys()
+                    for key in list(ckpt.keys()):
+                        for key_start in key_start_list:
+                            if key.startswith(key_start):
+                                checkpoint_filtered[key] = ckpt[key]
+                    model.load_state_dict(checkpoint_filtered, strict=False)
+                    print(f'Loaded checkpoint for the {part} part.')
+
+        model.eval()
+        return model
+
+    def run(self, image_folder, output_folder, sidecar_dir=None, known_detections=None):
+        """
+        image_folder의 모든 이미지를 처리해 <output_folder>/output.pkl 을 쓴다.
+        sidecar_dir/<stem>.json 이 있는 이미지는 검출 대신 클라이언트가 준 bbox/keypoints 를 사용.
+        known_detections ({image_name: records} pkl) 에 있는 이미지도 검출하지 않음 (avatar.py 검출 캐시).
+        """
+        args = self.args
+        device = self.device
+
+        # ---- Input: image_folder only ----
+        if image_folder is None:
+            raise ValueError("--image_folder 만 지원합니다.")
+
+        image_names = sorted(
+            x for x in os.listdir(image_folder)
+            if x.lower().endswith(('.png', '.jpg', '.jpeg'))
+        )
+        if not image_names:
+            raise FileNotFoundError(f"No images found in {image_folder}")
+
+        num_frames = len(image_names)
+        img0 = cv2.imread(osp.join(image_folder, image_names[0]))
+        if img0 is None:
+            raise RuntimeError(f"Failed to read first image: {image_names[0]}")
+        img_shape = img0.shape
+
+        output_path = output_folder
+        os.makedirs(output_path, exist_ok=True)
+
+        print(f'Input images: {num_frames}  |  First image shape: {img_shape}')
+
+        # ---- OpenPifPaf person detection (images only) ----
+        known = cached_detections(known_detections or args.known_detections, image_names)
+        if known:
+            print(f'Cached detections: {len(known)}/{num_frames} images')
+        client = client_detections(sidecar_dir or args.sidecar_dir, image_names, args.single_person)
+        if client:
+            print(f'Client detections (sidecar JSON): {len(client)}/{num_frames} images')
+        known.update(client)
+        tracking_results = self.detect(image_folder, image_names, osp.join(output_path, 'pp_det_results.pkl'),
+                                       known=known)
+
+        # ---- Run prediction on each person ----
+        if args.recon_result_file:
+            pred_results = joblib.load(args.recon_result_file)
+            print('Loaded results from ' + args.recon_result_file)
+        else:
+            pred_results, timing = self.predict(image_folder, tracking_results, body_only=args.body_only)
+            print(format_timing(timing))
+
+            compare = None
+            if args.compare_full_body:
+                # same detections, the other mode → latency saved and how far the body outputs move
+                ref_results, ref_timing = self.predict(image_folder, tracking_results, body_only=not args.body_only)
+                print(format_timing(ref_timing))
+                body_only_timing, full_timing = (timing, ref_timing) if args.body_only else (ref_timing, timing)
+                compare = compare_body_outputs(pred_results, ref_results)
+                compare.update(latency_saved(full_timing, body_only_timing))
+                print(' | '.join(f'{k}: {v:.4g}' for k, v in compare.items()))
+
+            # meta (optional but useful)
+            meta = {
+                "torch": torch.__version__,
+                "cuda": torch.version.cuda if torch.cuda.is_available() else None,
+                "device": str(device),
+                "args": {k: (str(v) if not isinstance(v, (int, float, str, bool)) else v) for k, v in vars(args).items()},
+                "time": time.strftime("%Y-%m-%d %H:%M:%S"),
+                "timing": timing,
+            }
+            if compare is not None:
+                meta["compare_full_body"] = compare
+            with open(osp.join(output_path, "meta.json"), "w") as f:
+                json.dump(meta, f, indent=2)
+
+            print(f'Saving output results to "{osp.join(output_path, "output.pkl")}"')
+            joblib.dump(pred_results, osp.join(output_path, "output.pkl"))
+
+        return osp.join(output_path, "output.pkl")
+
+    def detect(self, image_folder, image_names, pp_det_file_path, known=None):
+        """
+        OpenPifPaf 전신 keypoint 검출 → tracking_results ({person_id: ...}).
+        known: {image_name: records} 이미 결과가 있는 이미지 (sidecar, 검출 캐시) → 검출하지 않음
+        - input_long_edge 로 줄인 뒤 비슷한 종횡비끼리 같은 크기로 패딩해 배치 (정사각형 패딩 낭비 없음)
+        - 이미지 로딩은 DataLoader worker, CIF/CAF 디코딩은 decoder worker pool
+        - 이미지마다 결과를 <pp_det_file_path>.partial 에 바로 append → 중단되면 다음 실행이 이어서 처리
+        """
+        args = self.args
+        partial_path = pp_det_file_path + '.partial'
+        signature = detection_signature(args)
+
+        done = load_partial_detections(partial_path, signature)
+        # 이어 쓰기 여부는 partial 파일 기준 (known 결과는 파일에 없으므로 헤더를 새로 써야 함)
+        resume = bool(done)
+        if resume:
+            print(f'Resuming detection: {len(done)} images already done')
+        done.update(known or {})
+        todo = [n for n in image_names if n not in done]
+
+        frame_index = {n: i for i, n in enumerate(image_names)}
+        print('Running openpifpaf for person detection...')
+        with open(partial_path, 'ab' if resume else 'wb') as f:
+            if not resume:
+                pickle.dump(('__signature__', signature), f)
+                f.flush()
+            if todo:
+                batches, data = aspect_ratio_batches([osp.join(image_folder, n) for n in todo],
+                                                     args.input_long_edge, args.detector_batch_size)
+                loader = torch.utils.data.DataLoader(
+                    data, batch_sampler=batches, num_workers=args.detector_workers,
+                    pin_memory=self.device.type != 'cpu', collate_fn=ppdatasets.collate_images_anns_meta)
+                for preds, _, meta in tqdm(self.predictor.dataloader(loader), total=len(todo)):
+                    name = osp.basename(meta['file_name'])
+                    records = self._person_records(preds, frame_index[name], meta['file_name'])
+                    pickle.dump((name, records), f)
+                    f.flush()
+                    done[name] = records
+
+        # 이미지 순서대로 합쳐 최종 파일 (원자적 교체) 후 partial 정리
+        tracking_results = {}
+        for n in image_names:
+            tracking_results.update(done.get(n, {}))
+        tmp_path = pp_det_file_path + '.tmp'
+        joblib.dump(tracking_results, tmp_path)
+        os.replace(tmp_path, pp_det_file_path)
+        os.remove(partial_path)
+        return tracking_results
+
+    def _person_records(self, preds, frame_i, file_name):
+        args = self.args
         if args.single_person and preds:
             preds = [preds[0]]
+        records = {}
         for pid, ann in enumerate(preds or []):
             if ann.score > args.detection_threshold:
-                frame_i = meta.get('frame_i', None)
-                if frame_i is None:
-                    frame_i = meta.get('dataset_index', 0)
-                else:
-                    frame_i = frame_i - 1  # align with original code
-
-                file_name = meta.get('file_name', image_folder)
                 person_id = file_name.split('/')[-1].split('.')[0] + f'_f{frame_i}_p{pid}'
+                records[person_id] = wholebody_record(ann.data, frame_i)
+        return records
+
+    def predict(self, image_folder, tracking_results, body_only=False):
+        """
+        검출 결과(tracking_results)로 PyMAF-X 를 돌려 (pred_results, timing) 반환.
+        body_only=True 면 손/얼굴 crop·encoder·regressor 를 건너뛴다 (손/얼굴 파라미터는 평균값).
+        """
+        args = self.args
+        device = self.device
+        model = self.model
 
-                det_wb_kps = ann.data
-                det_face_kps = det_wb_kps[23:91]
-                tracking_results[person_id] = {
-                    'frames': [frame_i],
-                    'joints2d': [det_wb_kps[:17]],
-                    'joints2d_lhand': [det_wb_kps[91:112]],
-                    'joints2d_rhand': [det_wb_kps[112:133]],
-                    'joints2d_face': [np.concatenate([det_face_kps[17:], det_face_kps[:17]])],
-                    'vis_face': [np.mean(det_face_kps[17:, -1])],
-                    'vis_lhand': [np.mean(det_wb_kps[91:112, -1])],
-                    'vis_rhand': [np.mean(det_wb_kps[112:133, -1])],
-                }
-
-    joblib.dump(tracking_results, pp_det_file_path)
-
-    bbox_scale = 1.0
-
-    # ---- Define & load model ----
-    model = pymaf_net(path_config.SMPL_MEAN_PARAMS, is_train=False).to(device)
-
-    checkpoint_paths = {'body': args.pretrained_body, 'hand': args.pretrained_hand, 'face': args.pretrained_face}
-    if args.pretrained_model is not None:
-        print(f'Loading pretrained weights from "{args.pretrained_model}"')
-        checkpoint = torch.load(args.pretrained_model, map_location=device)
-
-        # remove the state_dict override by hand/face sub-models
-        for part in ['hand', 'face']:
-            if checkpoint_paths[part] is not None:
-                key_start_list = model.part_module_names[part].keys()
-                for key in list(checkpoint['model'].keys()):
-                    for key_start in key_start_list:
-                        if key.startswith(key_start):
-                            checkpoint['model'].pop(key)
-
-        # safe load
-        missing, unexpected = model.load_state_dict(checkpoint['model'], strict=False)
-        if missing or unexpected:
-            print("[warn] state_dict mismatch:",
-                  "\n  missing:", missing,
-                  "\n  unexpected:", unexpected)
-        print(f'Loaded checkpoint: {args.pretrained_model}')
-
-    if not all([args.pretrained_body is None, args.pretrained_hand is None, args.pretrained_face is None]):
-        for part in ['body', 'hand', 'face']:
-            checkpoint_path = checkpoint_paths[part]
-            if checkpoint_path is not None:
-                print(f'Loading checkpoint for the {part} part.')
-                ckpt = torch.load(checkpoint_path, map_location=device)['model']
-                checkpoint_filtered = {}
-                key_start_list = model.part_module_names[part].keys()
-                for key in list(ckpt.keys()):
-                    for key_start in key_start_list:
-                        if key.startswith(key_start):
-                            checkpoint_filtered[key] = ckpt[key]
-                model.load_state_dict(checkpoint_filtered, strict=False)
-                print(f'Loaded checkpoint for the {part} part.')
-
-    model.eval()
-
-    # ---- Run prediction on each person ----
-    if args.recon_result_file:
-        pred_results = joblib.load(args.recon_result_file)
-        print('Loaded results from ' + args.recon_result_file)
-    else:
         # Build dataset from detections
         if args.tracking_method != 'pose':
             raise NotImplementedError("Only pose-based tracking is supported in headless demo.")
 
+        bbox_scale = 1.0
         bboxes = []
+        person_boxes = []
         joints2d = []
+        wholebody = []
         frames = []
         wb_kps = {
             'joints2d_lhand': [],
@@ -180,6 +294,7 @@ def run_demo(args):
         person_id_list = list(tracking_results.keys())
         for person_id in person_id_list:
             joints2d.extend(tracking_results[person_id]['joints2d'])
+            wholebody.extend(wholebody_keypoints(tracking_results[person_id]))
             wb_kps['joints2d_lhand'].extend(tracking_results[person_id]['joints2d_lhand'])
             wb_kps['joints2d_rhand'].extend(tracking_results[person_id]['joints2d_rhand'])
             wb_kps['joints2d_face'].extend(tracking_results[person_id]['joints2d_face'])
@@ -187,6 +302,7 @@ def run_demo(args):
             wb_kps['vis_rhand'].extend(tracking_results[person_id]['vis_rhand'])
             wb_kps['vis_face'].extend(tracking_results[person_id]['vis_face'])
             frames.extend(tracking_results[person_id]['frames'])
+            person_boxes.extend(tracking_results[person_id].get('bbox', [None] * len(tracking_results[person_id]['frames'])))
 
         dataset = Inference(
             image_folder=image_folder,
@@ -197,14 +313,24 @@ def run_demo(args):
             full_body=True,
             person_ids=person_id_list,
             wb_kps=wb_kps,
+            person_boxes=person_boxes,
+            body_only=body_only,
+            normalize=args.plain_loader,
         )
 
         bboxes = dataset.bboxes
         scales = dataset.scales
         frames = dataset.frames
 
-        dataloader = DataLoader(dataset, batch_size=args.model_batch_size, num_workers=2)
+        start = time.perf_counter()
+        if args.plain_loader:
+            dataloader = DataLoader(dataset, batch_size=args.model_batch_size, num_workers=2)
+        else:
+            # crops written in place into shared (pinned) batch buffers, normalized per batch on the device
+            dataloader = InferenceBatchLoader(dataset, batch_size=args.model_batch_size, num_workers=2,
+                                              device=device, pin_memory=args.pin_memory)
 
+        data_time, forward_time = 0., 0.
         with torch.no_grad():
             pred_cam, pred_verts, pred_smplx_verts = [], [], []
             pred_pose, pred_betas, pred_joints3d = [], [], []
@@ -212,15 +338,18 @@ def run_demo(args):
             person_ids = []
             smplx_params = []
 
+            t0 = time.perf_counter()
             for batch in tqdm(dataloader):
-                # Move tensors to device
-                batch = {k: v.to(device) if isinstance(v, torch.Tensor) else v for k, v in batch.items()}
+                if args.plain_loader:
+                    # Move tensors to device
+                    batch = {k: v.to(device) if isinstance(v, torch.Tensor) else v for k, v in batch.items()}
+                t1 = time.perf_counter()
 
                 person_ids.extend(batch['person_id'])
                 orig_height.append(batch['orig_height'])
                 orig_width.append(batch['orig_width'])
 
-                preds_dict, _ = model(batch)
+                preds_dict, _ = model(batch, body_only=body_only)
                 output = preds_dict['mesh_out'][-1]
 
                 pred_cam.append(output['theta'][:, :3])
@@ -241,6 +370,13 @@ def run_demo(args):
                     'expression': output['pred_exp'],
                 })
 
+                if device.type == 'cuda':
+                    torch.cuda.synchronize(device)
+                t2 = time.perf_counter()
+                data_time += t1 - t0
+                forward_time += t2 - t1
+                t0 = t2
+
             # concat
             pred_cam = torch.cat(pred_cam, dim=0)
             pred_verts = torch.cat(pred_verts, dim=0)
@@ -251,6 +387,9 @@ def run_demo(args):
             orig_height = torch.cat(orig_height, dim=0)
             orig_width = torch.cat(orig_width, dim=0)
 
+        if not args.plain_loader:
+            dataloader.close()
+
         # Save results
         pred_cam = pred_cam.cpu().numpy()
         pred_verts = pred_verts.cpu().numpy()
@@ -287,25 +426,209 @@ def run_demo(args):
             'betas': pred_betas,
             'joints3d': pred_joints3d,
             'joints2d': joints2d,
+            # SMPLify-X 가 COCO-WholeBody → OpenPose BODY_25(+손/얼굴) 로 매핑해서 사용
+            'keypoints2d_wholebody': np.stack(wholebody).astype(np.float32),
             'bboxes': bboxes,
             'frame_ids': frames,
             'person_ids': person_ids,
             'smplx_params': smplx_params,
         }
 
-        # meta (optional but useful)
-        meta = {
-            "torch": torch.__version__,
-            "cuda": torch.version.cuda if torch.cuda.is_available() else None,
-            "device": str(device),
-            "args": {k: (str(v) if not isinstance(v, (int, float, str, bool)) else v) for k, v in vars(args).items()},
-            "time": time.strftime("%Y-%m-%d %H:%M:%S"),
+        n_persons = len(person_ids)
+        total_time = time.perf_counter() - start
+        timing = {
+            'mode': 'body_only' if body_only else 'full_body',
+            'n_persons': n_persons,
+            'data_s': data_time,
+            'forward_s': forward_time,
+            'total_s': total_time,
+            'ms_per_person': 1000. * total_time / max(1, n_persons),
         }
-        with open(osp.join(output_path, "meta.json"), "w") as f:
-            json.dump(meta, f, indent=2)
+        return pred_results, timing
+
+
+def wholebody_record(det_wb_kps, frame_i):
+    """COCO-WholeBody 133 keypoints (x, y, conf) → tracking_results 항목"""
+    det_face_kps = det_wb_kps[23:91]
+    return {
+        'frames': [frame_i],
+        'joints2d': [det_wb_kps[:17]],
+        'joints2d_feet': [det_wb_kps[17:23]],
+        'joints2d_lhand': [det_wb_kps[91:112]],
+        'joints2d_rhand': [det_wb_kps[112:133]],
+        'joints2d_face': [np.concatenate([det_face_kps[17:], det_face_kps[:17]])],
+        'vis_face': [np.mean(det_face_kps[17:, -1])],
+        'vis_lhand': [np.mean(det_wb_kps[91:112, -1])],
+        'vis_rhand': [np.mean(det_wb_kps[112:133, -1])],
+    }
+
+
+def wholebody_keypoints(record):
+    """tracking_results 항목 → 프레임별 COCO-WholeBody 133 keypoints (wholebody_record 의 역변환)"""
+    out = []
+    for i in range(len(record['frames'])):
+        wb = np.zeros((133, 3), dtype=np.float32)
+        wb[:17] = record['joints2d'][i]
+        if 'joints2d_feet' in record:  # 발 keypoints 를 저장하기 전의 검출 결과에는 없음
+            wb[17:23] = record['joints2d_feet'][i]
+        face = np.asarray(record['joints2d_face'][i])
+        wb[23:91] = np.concatenate([face[51:], face[:51]])
+        wb[91:112] = record['joints2d_lhand'][i]
+        wb[112:133] = record['joints2d_rhand'][i]
+        out.append(wb)
+    return out
+
+
+def client_detections(sidecar_dir, image_names, single_person=False):
+    """
+    업로드 API 가 준 sidecar JSON (<sidecar_dir>/<stem>.json) → {image_name: records}.
+    형식 (좌표는 EXIF 방향을 적용한 이미지 기준 픽셀):
+      {"bbox": [x1, y1, x2, y2]}                      한 사람
+      {"keypoints": [[x, y, conf], ...]}               COCO 17 또는 COCO-WholeBody 133 개 ([x, y] 면 conf=1)
+      {"persons": [{"bbox": ..., "keypoints": ...}, ...]}
+    bbox 가 있으면 body crop 은 bbox 로, 없으면 keypoints 범위로 잡는다.
+    bbox 만 있으면 keypoints 는 confidence 0 (손/얼굴 crop 은 invalid 처리).
+    """
+    out = {}
+    if not sidecar_dir:
+        return out
+    for frame_i, name in enumerate(image_names):
+        path = osp.join(sidecar_dir, osp.splitext(name)[0] + '.json')
+        if not osp.exists(path):
+            continue
+        with open(path) as f:
+            data = json.load(f)
+        persons = data.get('persons', [data]) if isinstance(data, dict) else list(data)
+        if single_person:
+            persons = persons[:1]
+
+        records = {}
+        for pid, person in enumerate(persons):
+            wb = np.zeros((133, 3), dtype=np.float32)
+            if person.get('keypoints') is not None:
+                kps = np.asarray(person['keypoints'], dtype=np.float32)
+                if kps.ndim != 2 or kps.shape[0] not in (17, 133) or kps.shape[1] not in (2, 3):
+                    raise ValueError(f'{path}: keypoints must be 17 or 133 rows of [x, y(, conf)]')
+                wb[:kps.shape[0], :2] = kps[:, :2]
+                wb[:kps.shape[0], 2] = kps[:, 2] if kps.shape[1] == 3 else 1.
+            bbox = person.get('bbox')
+            if bbox is None and not (wb[:, 2] > 0).any():
+                raise ValueError(f'{path}: person {pid} has neither a bbox nor visible keypoints')
+
+            record = wholebody_record(wb, frame_i)
+            if bbox is not None:
+                x1, y1, x2, y2 = [float(v) for v in bbox]
+                record['bbox'] = [[x1, y1, x2, y2]]
+            records[name.split('.')[0] + f'_f{frame_i}_p{pid}'] = record
+        out[name] = records
+    return out
+
+
+def cached_detections(path, image_names):
+    """
+    다른 폴더에서 나온 검출 결과 pkl ({image_name: records}) → 이 폴더 기준 {image_name: records}.
+    person_id('<stem>_f<frame>_p<pid>') 와 frames 를 이 폴더의 frame 번호로 바꿈.
+    """
+    if not path:
+        return {}
+    with open(path, 'rb') as f:
+        saved = pickle.load(f)
+    out = {}
+    for frame_i, name in enumerate(image_names):
+        if name not in saved:
+            continue
+        stem = name.split('.')[0]
+        out[name] = {f'{stem}_f{frame_i}_p{person_id.rsplit("_p", 1)[1]}':
+                     dict(record, frames=[frame_i] * len(record['frames']))
+                     for person_id, record in saved[name].items()}
+    return out
+
+
+def detection_signature(args):
+    """partial 검출 결과를 이어 써도 되는지 판단하는 검출 설정"""
+    keys = ['detector_checkpoint', 'detection_threshold', 'single_person', 'input_long_edge']
+    return json.dumps({k: getattr(args, k, None) for k in keys}, sort_keys=True)
+
+
+def load_partial_detections(partial_path, signature):
+    """중단된 실행이 남긴 (image_name, records) 기록. 설정이 다르면 버림, 마지막 깨진 기록은 무시."""
+    done = {}
+    if not osp.exists(partial_path):
+        return done
+    with open(partial_path, 'rb') as f:
+        try:
+            header = pickle.load(f)
+        except Exception:
+            return done
+        if header != ('__signature__', signature):
+            return done
+        while True:
+            try:
+                name, records = pickle.load(f)
+            except Exception:
+                break
+            done[name] = records
+    return done
+
+
+def aspect_ratio_batches(file_names, long_edge, batch_size, multiple=32):
+    """
+    long_edge 로 줄였을 때의 크기를 multiple 단위로 올린 (w, h) 로 이미지를 묶는다.
+    같은 묶음은 같은 크기로 CenterPad → 한 배치로 쌓을 수 있고 패딩은 multiple 미만.
+    반환: (batch_sampler 용 index 목록, ConcatDataset)
+    """
+    groups = {}
+    for i, fn in enumerate(file_names):
+        with Image.open(fn) as im:
+            w, h = im.size  # header only
+        s = long_edge / max(w, h)
+        pad_w = int(np.ceil(w * s / multiple)) * multiple
+        pad_h = int(np.ceil(h * s / multiple)) * multiple
+        groups.setdefault((pad_w, pad_h), []).append(i)
+
+    datasets, batches, offset = [], [], 0
+    for (pad_w, pad_h), idxs in groups.items():
+        preprocess = pptransforms.Compose([
+            pptransforms.NormalizeAnnotations(),
+            pptransforms.RescaleAbsolute(long_edge),
+            pptransforms.CenterPad((pad_w, pad_h)),
+            pptransforms.EVAL_TRANSFORM,
+        ])
+        datasets.append(ppdatasets.ImageList([file_names[i] for i in idxs], preprocess=preprocess))
+        for b in range(0, len(idxs), batch_size):
+            batches.append(list(range(offset + b, offset + min(b + batch_size, len(idxs)))))
+        offset += len(idxs)
+    return batches, torch.utils.data.ConcatDataset(datasets)
+
+
+def format_timing(timing):
+    return (f"[{timing['mode']}] {timing['n_persons']} persons | data {timing['data_s']:.2f}s | "
+            f"forward {timing['forward_s']:.2f}s | total {timing['total_s']:.2f}s "
+            f"({timing['ms_per_person']:.1f} ms/person)")
+
+
+def latency_saved(full_timing, body_only_timing):
+    """full_body 대비 body_only 로 줄어든 시간 (사람당 ms 와 비율)"""
+    saved = full_timing['ms_per_person'] - body_only_timing['ms_per_person']
+    return {
+        'saved_ms_per_person': saved,
+        'saved_ratio': saved / full_timing['ms_per_person'] if full_timing['ms_per_person'] > 0 else 0.,
+        'saved_forward_s': full_timing['forward_s'] - body_only_timing['forward_s'],
+        'saved_data_s': full_timing['data_s'] - body_only_timing['data_s'],
+    }
+
+
+def compare_body_outputs(results, ref_results):
+    """두 모드의 body 출력 차이 (max abs). full_body 는 손목/얼굴 보정이 body 에도 들어가므로 0 이 아닐 수 있음"""
+    return {f'max_abs_diff_{k}': float(np.abs(results[k] - ref_results[k]).max()) if len(results[k]) else 0.
+            for k in ['betas', 'pose', 'pred_cam', 'verts']}
+
+
+def run_demo(args):
+    total_time = time.time()
 
-        print(f'Saving output results to "{osp.join(output_path, "output.pkl")}"')
-        joblib.dump(pred_results, osp.join(output_path, "output.pkl"))
+    runner = PyMAFRunner(args)
+    runner.run(args.image_folder, args.output_folder)
 
     total_time = time.time() - total_time
     print(f'Total time spent for reconstruction: {total_time:.2f} seconds (including model loading time).')
@@ -317,7 +640,7 @@ class CustomFormatter(argparse.ArgumentDefaultsHelpFormatter,
     pass
 
 
-if __name__ == '__main__':
+def build_parser():
     parser = argparse.ArgumentParser(formatter_class=CustomFormatter)
 
     print('initializing openpifpaf')
@@ -334,8 +657,16 @@ if __name__ == '__main__':
                         help='tracking method (pose only in this headless demo)')
     parser.add_argument('--detector_checkpoint', type=str, default='shufflenetv2k30-wholebody',
                         help='detector checkpoint for openpifpaf')
-    parser.add_argument('--detector_batch_size', type=int, default=1,
-                        help='batch size for person detection')
+    parser.add_argument('--detector_batch_size', type=int, default=4,
+                        help='batch size for person detection (images of similar aspect ratio are batched together)')
+    parser.add_argument('--detector_workers', type=int, default=min(4, os.cpu_count() or 1),
+                        help='image loading workers and pose decoding processes for person detection')
+    parser.add_argument('--sidecar_dir', type=str, default=None,
+                        help='folder with <image stem>.json client detections (bbox and/or keypoints); those images skip detection')
+    parser.add_argument('--known_detections', type=str, default=None,
+                        help='pickle of {image name: detection records} from an earlier run; those images skip detection')
+    parser.add_argument('--no_detector', action='store_true',
+                        help='never load OpenPifPaf (every image needs a sidecar JSON)')
     parser.add_argument('--detection_threshold', type=float, default=0.55,
                         help='pifpaf detection score threshold.')
     parser.add_argument('--single_person', action='store_true',
@@ -360,6 +691,18 @@ if __name__ == '__main__':
                         help='Resize input for detector to this long-edge (e.g., 1024).')
     parser.add_argument('--recon_result_file', type=str, default='',
                         help='path to reconstruction result file (optional)')
+    parser.add_argument('--body_only', action='store_true',
+                        help='skip hand/face crops, encoders and regressors (hand/face outputs stay at the mean pose)')
+    parser.add_argument('--plain_loader', action='store_true',
+                        help='use a plain DataLoader with per-crop normalization instead of the shared batch buffers')
+    parser.add_argument('--compare_full_body', action='store_true',
+                        help='also run the other BHF path on the same detections and report latency saved / body output diff')
+
+    return parser
+
+
+if __name__ == '__main__':
+    parser = build_parser()
 
     args = parser.parse_args()
     parse_args(args)
@@ -0,0 +1,59 @@
+"""
+벡터화한 2D keypoint 변환(affine_transform_pts, transform_pts) 이
+예전의 keypoint 별 np.dot 루프와 같은 결과를 내는지 확인.
+
+PyMAF-X 폴더에서 실행:  python check_affine_transform.py
+"""
+import numpy as np
+
+from utils.imutils import affine_transform_pts, get_transform, transform, transform_pts
+
+# ===== 설정 =====
+N_KP = 133          # COCO-WholeBody keypoint 수
+BATCH = 8
+RES = [224, 224]
+
+rng = np.random.default_rng(0)
+
+
+def loop_transform(kp, t):
+    """예전 j2d_processing 의 keypoint 별 루프"""
+    kp = kp.copy()
+    for i in range(kp.shape[0]):
+        pt = kp[i, 0:2]
+        new_pt = np.dot(t, np.array([pt[0], pt[1], 1.]).T)
+        kp[i, 0:2] = new_pt[:2]
+    return kp[:, 0:2]
+
+
+def random_transform():
+    center = rng.uniform(100, 900, size=2)
+    scale = rng.uniform(0.5, 4.0)
+    rot = rng.uniform(-30, 30)
+    return get_transform(center, scale, RES, rot=rot)
+
+
+# 1) (N, 2) 점 + 한 개의 3x3 변환 (confidence 열은 무시)
+kp = np.concatenate([rng.uniform(0, 1000, size=(N_KP, 2)), rng.uniform(size=(N_KP, 1))], axis=1)
+t = random_transform()
+err_single = np.abs(affine_transform_pts(kp, t) - loop_transform(kp, t)).max()
+
+# 2) (B, N, 2) 점 + 배치 항목마다 다른 (B, 3, 3) 변환
+kps = rng.uniform(0, 1000, size=(BATCH, N_KP, 3))
+ts = np.stack([random_transform() for _ in range(BATCH)])
+expected = np.stack([loop_transform(k, tb) for k, tb in zip(kps, ts)])
+err_batch = np.abs(affine_transform_pts(kps, ts) - expected).max()
+
+# 3) transform_pts 는 점마다 transform() 을 부른 결과(정수 절사 포함)와 완전히 같아야 함
+center, scale = rng.uniform(100, 900, size=2), rng.uniform(0.5, 4.0)
+coords = rng.uniform(0, 224, size=(N_KP, 2))
+for invert in (0, 1):
+    expected = np.stack([transform(c, center, scale, RES, invert=invert, rot=15) for c in coords])
+    result = transform_pts(coords, center, scale, RES, invert=invert, rot=15)
+    assert np.array_equal(result, expected), invert
+
+print(f"max |affine_transform_pts - loop| (N, 2)    = {err_single:.2e}")
+print(f"max |affine_transform_pts - loop| (B, N, 2) = {err_batch:.2e}")
+print("transform_pts == transform (invert=0, 1)")
+assert err_single < 1e-9 and err_batch < 1e-9
+print("OK")
@@ -0,0 +1,42 @@
+"""
+MeasurementEngine 의 closed-form 경로(template + betas·dirs) 가 SMPL-X full forward 와
+같은 T/A-pose 정점·관절, 같은 치수를 내는지 확인.
+
+PyMAF-X 폴더에서 실행:  python check_measure_closed_form.py [SMPL-X 모델 폴더] [gender]
+"""
+import sys
+
+import numpy as np
+
+from core.measure_body import MeasurementEngine
+
+# ===== 설정 =====
+smplx_model_path = sys.argv[1] if len(sys.argv) > 1 else "data/smpl"
+gender = sys.argv[2] if len(sys.argv) > 2 else "male"
+N_USERS = 16
+TOL_M = 1e-5        # 정점/관절 허용 오차 (m)
+TOL_CM = 1e-2       # 치수 허용 오차 (cm)
+
+rng = np.random.default_rng(0)
+betas = rng.normal(0.0, 1.5, size=(N_USERS, 10)).astype(np.float32)
+
+closed = MeasurementEngine(smplx_model_path, closed_form=True)
+full = MeasurementEngine(smplx_model_path, closed_form=False)
+
+# ===== T/A-pose 정점·관절 =====
+names = ("vertices_t", "joints_t", "vertices_a", "joints_a")
+for name, a, b in zip(names, closed.pose_meshes_closed_form(betas, gender), full.pose_meshes(betas, gender)):
+    err = np.abs(a - b).max()
+    print(f"{name:10s} max |closed form - forward| = {err:.2e} m")
+    assert a.shape == b.shape and err < TOL_M, name
+
+# ===== 치수 =====
+heights = rng.uniform(150, 190, size=N_USERS).tolist()
+worst = 0.0
+for m_closed, m_full in zip(closed.measure_batch(betas, gender, heights), full.measure_batch(betas, gender, heights)):
+    assert m_closed.keys() == m_full.keys()
+    for key in m_full:
+        worst = max(worst, abs(m_closed[key] - m_full[key]))
+print(f"measurements max |closed form - forward| = {worst:.2e} cm")
+assert worst < TOL_CM
+print("OK")
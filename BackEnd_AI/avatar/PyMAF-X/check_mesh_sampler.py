@@ -0,0 +1,86 @@
+"""
+Mesh_Sampler 의 공유 gather 테이블 down/upsample 이 GraphCMR 의 dense Dmap / Umap 행렬곱과
+같은 결과를 내는지 확인.
+
+PyMAF-X 폴더에서 실행:  python check_mesh_sampler.py
+data/smpl_downsampling.npz 가 없으면 같은 모양(6890 → 1723 → 431)의 합성 연산자로 확인한다.
+"""
+import os
+import tempfile
+
+import numpy as np
+import scipy.sparse
+import torch
+
+from models import maf_extractor
+from models.maf_extractor import Mesh_Sampler
+
+# ===== 설정 =====
+SIZES = [6890, 1723, 431]
+BATCH = 4
+
+
+def selection(n_out, n_in, rng):
+    """downsampling: 행마다 입력 정점 하나를 고름"""
+    cols = np.sort(rng.choice(n_in, size=n_out, replace=False))
+    return scipy.sparse.csr_matrix((np.ones(n_out), (np.arange(n_out), cols)), shape=(n_out, n_in))
+
+
+def barycentric(n_out, n_in, rng):
+    """upsampling: 행마다 입력 정점 3개를 barycentric 가중치로 섞음"""
+    rows = np.repeat(np.arange(n_out), 3)
+    cols = np.concatenate([rng.choice(n_in, size=3, replace=False) for _ in range(n_out)])
+    vals = rng.dirichlet(np.ones(3), size=n_out).ravel()
+    return scipy.sparse.csr_matrix((vals, (rows, cols)), shape=(n_out, n_in))
+
+
+def write_synthetic(path):
+    rng = np.random.default_rng(0)
+    D = [selection(SIZES[1], SIZES[0], rng), selection(SIZES[2], SIZES[1], rng)]
+    U = [barycentric(SIZES[0], SIZES[1], rng), barycentric(SIZES[1], SIZES[2], rng)]
+    def as_objects(ms):
+        arr = np.empty(len(ms), dtype=object)
+        arr[:] = ms
+        return arr
+    np.savez(path, D=as_objects(D), U=as_objects(U))
+
+
+cwd = os.getcwd()
+if not os.path.exists("data/smpl_downsampling.npz"):
+    # get_sampling_tables 는 현재 폴더의 data/ 를 읽으므로 임시 폴더로 이동
+    tmp_dir = tempfile.mkdtemp()
+    os.makedirs(os.path.join(tmp_dir, "data"))
+    write_synthetic(os.path.join(tmp_dir, "data", "smpl_downsampling.npz"))
+    os.chdir(tmp_dir)
+    print("data/smpl_downsampling.npz 없음 → 합성 연산자 사용")
+
+try:
+    mesh_graph = np.load("data/smpl_downsampling.npz", allow_pickle=True, encoding="latin1")
+    D = [scipy.sparse.csr_matrix(d) for d in mesh_graph["D"]]
+    U = [scipy.sparse.csr_matrix(u) for u in mesh_graph["U"]]
+    Dmap = torch.tensor((D[1] @ D[0]).toarray(), dtype=torch.float32)
+    Umap = torch.tensor((U[0] @ U[1]).toarray(), dtype=torch.float32)
+
+    sampler = Mesh_Sampler(type="smpl", level=2, device=torch.device("cpu"))
+    other = Mesh_Sampler(type="smpl", level=2, device=torch.device("cpu"))
+finally:
+    os.chdir(cwd)
+
+# 같은 (type, level) 은 테이블을 한 번만 만들어 모든 인스턴스가 공유
+assert other.D_idx.data_ptr() == sampler.D_idx.data_ptr()
+assert len(maf_extractor._SAMPLING_TABLES) == 1
+
+torch.manual_seed(0)
+x = torch.randn(BATCH, Dmap.shape[1], 3)
+down = sampler.downsample(x)
+err_down = (down - torch.matmul(Dmap, x)).abs().max().item()
+
+y = torch.randn(BATCH, Umap.shape[1], 3)
+err_up = (sampler.upsample(y) - torch.matmul(Umap, y)).abs().max().item()
+
+print(f"ds_len={sampler.ds_len}  K_down={sampler.D_idx.shape[1]}  K_up={sampler.U_idx.shape[1]}")
+print(f"max |downsample - Dmap @ x| = {err_down:.2e}")
+print(f"max |upsample - Umap @ y|   = {err_up:.2e}")
+assert down.shape == (BATCH, Dmap.shape[0], 3)
+assert err_down < 1e-5 and err_up < 1e-5
+print("OK")
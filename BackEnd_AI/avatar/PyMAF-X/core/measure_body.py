@@ -1,8 +1,9 @@
 import numpy as np
 import torch
 from smplx import SMPLX
-from typing import Dict
-from .utils_geometry import slice_circumference, slice_width_x, slice_width_z
+from typing import Dict, List, Optional, Tuple
+from .utils_geometry import (SliceIndex, section_width_x, section_width_z,
+                             slice_circumference, slice_width_x, slice_width_z)
 from .uma_converter import uma_from_measurements
 
 def load_pkl_safe(path):
@@ -36,67 +37,55 @@ def a_pose_body_pose() -> torch.Tensor:
 
     return torch.tensor(pose).unsqueeze(0)
 
-def measure_full_body_from_params(params: Dict, smplx_model_path: str, gender: str = 'neutral', target_height_cm: float = None) -> Dict[str, float]:
+def landmark_heights_t(joints_t: np.ndarray) -> Dict[str, float]:
+    """T-pose 측정 높이 (chest / waist / hip)"""
+    return {
+        "chest": (joints_t[1, 1] + joints_t[2, 1]) / 2,
+        "waist": joints_t[3, 1],
+        "hip": joints_t[1, 1] - 0.02,
+    }
+
+def landmark_heights_a(joints_a: np.ndarray) -> Dict[str, float]:
+    """A-pose 측정 높이 (shoulder)"""
+    return {"shoulder": (joints_a[16, 1] + joints_a[17, 1]) / 2}
+
+def _slice_width(axis: str, vertices: np.ndarray, name: str, y: float, tol: float,
+                 index: Optional[SliceIndex] = None, exact: bool = False) -> float:
     """
-    SMPL-X 파라미터 기반으로 T-pose와 A-pose 조합으로 신체 치수 측정 (cm 단위)
+    index 가 있으면 캐시된 후보 정점만 슬라이스, exact=True 면 후보 edge 와 평면의 정확한 교차로 폭 계산.
+    index 가 없거나 높이가 캐시 구간 밖이면 기존 전체 정점 y-band 방식.
     """
-    betas = torch.tensor(params.get("shape", params.get("betas", np.zeros(10)))).float()
-    if betas.ndim == 1:
-        betas = betas.unsqueeze(0)
-
-    zero_hand = torch.zeros((1, 45))
-    zero_expr = torch.zeros((1, 10))
-    zero_3 = torch.zeros((1, 3))
-
-    model = SMPLX(model_path=smplx_model_path, gender=gender)
-    model.use_pca = False
-
-    # ====== T-POSE for circumference, height, arm/leg length ======
-    output_t = model(
-        betas=betas,
-        body_pose=t_pose_body_pose(),
-        left_hand_pose=zero_hand,
-        right_hand_pose=zero_hand,
-        jaw_pose=zero_3,
-        leye_pose=zero_3,
-        reye_pose=zero_3,
-        expression=zero_expr,
-        global_orient=zero_3,
-        transl=zero_3
-    )
-    vertices_t = output_t.vertices.detach().cpu().numpy()[0]
-    joints_t = output_t.joints.detach().cpu().numpy()[0]
-
-    # ====== A-POSE for shoulder width (convex hull based) ======
-    output_a = model(
-        betas=betas,
-        body_pose=a_pose_body_pose(),
-        left_hand_pose=zero_hand,
-        right_hand_pose=zero_hand,
-        jaw_pose=zero_3,
-        leye_pose=zero_3,
-        reye_pose=zero_3,
-        expression=zero_expr,
-        global_orient=zero_3,
-        transl=zero_3
-    )
-    vertices_a = output_a.vertices.detach().cpu().numpy()[0]
-    joints_a = output_a.joints.detach().cpu().numpy()[0]
+    idx = None
+    if index is not None:
+        if exact:
+            edges = index.edges(name, y)
+            if edges is not None:
+                return section_width_x(vertices, edges, y) if axis == "x" else section_width_z(vertices, edges, y)
+        idx = index.candidates(name, y, tol)
+    if axis == "x":
+        return slice_width_x(vertices, y, tol=tol, idx=idx)
+    return slice_width_z(vertices, y, tol=tol, idx=idx)
 
+def _measure_from_mesh(vertices_t: np.ndarray, joints_t: np.ndarray,
+                       vertices_a: np.ndarray, joints_a: np.ndarray,
+                       target_height_cm: float = None,
+                       index_t: Optional[SliceIndex] = None,
+                       index_a: Optional[SliceIndex] = None,
+                       exact: bool = False) -> Dict[str, float]:
+    """T-pose/A-pose 정점·관절(한 사람분)로 신체 치수 계산 (cm 단위)"""
     height_cm = (vertices_t[:, 1].max() - vertices_t[:, 1].min()) * 100
 
     # 어깨 너비는 A-포즈 기준 convex hull 기반으로 계산
-    shoulder_y = (joints_a[16, 1] + joints_a[17, 1]) / 2
-    shoulder_width_cm = slice_width_x(vertices_a, shoulder_y, tol=0.01)
+    shoulder_y = landmark_heights_a(joints_a)["shoulder"]
+    shoulder_width_cm = _slice_width("x", vertices_a, "shoulder", shoulder_y, 0.01, index_a, exact)
 
     # Circumference (T-pose 기준)
-    chest_y = (joints_t[1, 1] + joints_t[2, 1]) / 2
-    waist_y = joints_t[3, 1]
-    hip_y = joints_t[1, 1] - 0.02
+    heights_t = landmark_heights_t(joints_t)
+    waist_y = heights_t["waist"]
     tol = 0.01
 
-    waist_FB_cm = slice_width_z(vertices_t, waist_y, tol=tol)
-    waist_LR_cm = slice_width_x(vertices_t, waist_y, tol=tol)
+    waist_FB_cm = _slice_width("z", vertices_t, "waist", waist_y, tol, index_t, exact)
+    waist_LR_cm = _slice_width("x", vertices_t, "waist", waist_y, tol, index_t, exact)
 
     # Arm Length
     left_arm_len = (
@@ -144,3 +133,163 @@ def measure_full_body_from_params(params: Dict, smplx_model_path: str, gender: s
         measurements = {k: v * scale for k, v in measurements.items()}
 
     return measurements
+
+def betas_from_params(params: Dict) -> torch.Tensor:
+    """params 의 shape/betas → (1, n_betas) float tensor"""
+    betas = torch.tensor(params.get("shape", params.get("betas", np.zeros(10)))).float()
+    if betas.ndim == 1:
+        betas = betas.unsqueeze(0)
+    return betas
+
+class MeasurementEngine:
+    """
+    측정용 SMPL-X 엔진.
+    - 성별별 SMPLX 모델을 한 번만 로드해 캐시
+    - 고정 T-pose / A-pose body_pose 를 미리 만들어 둠
+    - N명의 betas 를 T/A-pose 두 벌로 쌓아 한 번의 (2N) forward 로 처리
+    - closed_form=True: 포즈가 고정이면 LBS 결과(정점·관절)는 betas 에 대해 정확히 affine
+      (회전은 고정, 관절 위치·shape blend 는 betas 에 선형) 이므로, 성별별로
+      template + dirs 를 한 번 계산해 두고 이후엔 행렬곱 한 번으로 평가
+    - use_slice_index=True: 성별·포즈별로 chest/waist/hip/shoulder 높이 주변 정점·edge 를 캐시해
+      슬라이스가 전체 정점 대신 그 부분집합만 읽음. exact_slices=True 면 tolerance band 대신
+      캐시된 edge 와 평면의 정확한 교차로 폭을 계산
+    """
+
+    def __init__(self, smplx_model_path: str, device: str = "cpu", closed_form: bool = True,
+                 use_slice_index: bool = True, exact_slices: bool = False):
+        self.smplx_model_path = smplx_model_path
+        self.device = torch.device(device)
+        self.closed_form = closed_form
+        self.use_slice_index = use_slice_index
+        self.exact_slices = exact_slices
+        self._slice_indices: Dict[str, Tuple[SliceIndex, SliceIndex]] = {}
+        self._models: Dict[str, SMPLX] = {}
+        self._bases: Dict[str, Dict[str, Tuple[torch.Tensor, torch.Tensor, tuple]]] = {}
+        self._t_pose = t_pose_body_pose().to(self.device)
+        self._a_pose = a_pose_body_pose().to(self.device)
+
+    def model(self, gender: str = "neutral") -> SMPLX:
+        if gender not in self._models:
+            model = SMPLX(model_path=self.smplx_model_path, gender=gender)
+            model.use_pca = False
+            self._models[gender] = model.to(self.device).eval()
+        return self._models[gender]
+
+    @torch.no_grad()
+    def pose_meshes(self, betas: torch.Tensor, gender: str = "neutral") -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        """
+        betas (N, n_betas) → T-pose/A-pose 정점·관절.
+        반환: vertices_t (N,V,3), joints_t (N,J,3), vertices_a (N,V,3), joints_a (N,J,3)
+        """
+        betas = torch.as_tensor(betas, dtype=torch.float32, device=self.device)
+        if betas.ndim == 1:
+            betas = betas.unsqueeze(0)
+        n = betas.shape[0]
+
+        # 앞 N개는 T-pose, 뒤 N개는 A-pose
+        body_pose = torch.cat([self._t_pose.expand(n, -1), self._a_pose.expand(n, -1)], dim=0)
+        zeros = lambda dim: torch.zeros((2 * n, dim), device=self.device)
+        output = self.model(gender)(
+            betas=betas.repeat(2, 1),
+            body_pose=body_pose,
+            left_hand_pose=zeros(45),
+            right_hand_pose=zeros(45),
+            jaw_pose=zeros(3),
+            leye_pose=zeros(3),
+            reye_pose=zeros(3),
+            expression=zeros(10),
+            global_orient=zeros(3),
+            transl=zeros(3)
+        )
+        vertices = output.vertices.detach().cpu().numpy()
+        joints = output.joints.detach().cpu().numpy()
+        return vertices[:n], joints[:n], vertices[n:], joints[n:]
+
+    def shape_basis(self, gender: str = "neutral") -> Dict[str, Tuple[torch.Tensor, torch.Tensor, tuple]]:
+        """
+        T/A-pose 정점·관절의 affine basis (성별별 1회 계산).
+        betas=0 과 단위 betas(e_i) 를 한 번의 forward 로 평가해
+        template (1, K) 와 dirs (n_betas, K) 를 얻음 (K = 정점/관절 좌표를 펼친 길이).
+        """
+        if gender not in self._bases:
+            num_betas = self.model(gender).num_betas
+            unit_betas = torch.cat([torch.zeros(1, num_betas), torch.eye(num_betas)], dim=0)
+            vertices_t, joints_t, vertices_a, joints_a = self.pose_meshes(unit_betas, gender)
+            basis = {}
+            for name, arr in (("vertices_t", vertices_t), ("joints_t", joints_t),
+                              ("vertices_a", vertices_a), ("joints_a", joints_a)):
+                flat = torch.from_numpy(arr.reshape(num_betas + 1, -1)).double()
+                basis[name] = (flat[:1], flat[1:] - flat[:1], arr.shape[1:])
+            self._bases[gender] = basis
+        return self._bases[gender]
+
+    def pose_meshes_closed_form(self, betas, gender: str = "neutral") -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        """pose_meshes 와 같은 결과를 template + betas·dirs 로 계산 (LBS 생략)"""
+        betas = torch.as_tensor(np.asarray(betas), dtype=torch.float64)
+        if betas.ndim == 1:
+            betas = betas.unsqueeze(0)
+        basis = self.shape_basis(gender)
+        n, k = betas.shape
+        outputs = []
+        for name in ("vertices_t", "joints_t", "vertices_a", "joints_a"):
+            template, dirs, shape = basis[name]
+            if k > dirs.shape[0]:
+                raise ValueError(f"Got {k} betas but the model has {dirs.shape[0]} shape components")
+            flat = template + betas @ dirs[:k]
+            outputs.append(flat.float().numpy().reshape((n,) + tuple(shape)))
+        return tuple(outputs)
+
+    def slice_indices(self, gender: str = "neutral") -> Tuple[SliceIndex, SliceIndex]:
+        """betas=0 템플릿의 T-pose / A-pose 메쉬로 만든 (T, A) SliceIndex (성별별 1회)"""
+        if gender not in self._slice_indices:
+            num_betas = self.model(gender).num_betas
+            zero_betas = np.zeros((1, num_betas), dtype=np.float32)
+            if self.closed_form:
+                vertices_t, joints_t, vertices_a, joints_a = self.pose_meshes_closed_form(zero_betas, gender)
+            else:
+                vertices_t, joints_t, vertices_a, joints_a = self.pose_meshes(zero_betas, gender)
+            faces = self.model(gender).faces
+            self._slice_indices[gender] = (
+                SliceIndex(vertices_t[0], faces, landmark_heights_t(joints_t[0])),
+                SliceIndex(vertices_a[0], faces, landmark_heights_a(joints_a[0])),
+            )
+        return self._slice_indices[gender]
+
+    def measure_batch(self, betas, gender: str = "neutral",
+                      target_height_cm=None) -> List[Dict[str, float]]:
+        """
+        betas (N, n_betas) 를 한 번에 측정. target_height_cm 은 스칼라 또는 길이 N 의 시퀀스.
+        """
+        if self.closed_form:
+            vertices_t, joints_t, vertices_a, joints_a = self.pose_meshes_closed_form(betas, gender)
+        else:
+            vertices_t, joints_t, vertices_a, joints_a = self.pose_meshes(betas, gender)
+        n = vertices_t.shape[0]
+        if target_height_cm is None or np.isscalar(target_height_cm):
+            target_height_cm = [target_height_cm] * n
+        index_t, index_a = self.slice_indices(gender) if self.use_slice_index else (None, None)
+        return [
+            _measure_from_mesh(vertices_t[i], joints_t[i], vertices_a[i], joints_a[i], target_height_cm[i],
+                               index_t=index_t, index_a=index_a, exact=self.exact_slices)
+            for i in range(n)
+        ]
+
+    def measure(self, params: Dict, gender: str = "neutral",
+                target_height_cm: float = None) -> Dict[str, float]:
+        return self.measure_batch(betas_from_params(params), gender, target_height_cm)[0]
+
+_ENGINES: Dict[str, MeasurementEngine] = {}
+
+def get_measurement_engine(smplx_model_path: str) -> MeasurementEngine:
+    """모델 경로별로 프로세스 당 하나의 MeasurementEngine 을 재사용"""
+    key = str(smplx_model_path)
+    if key not in _ENGINES:
+        _ENGINES[key] = MeasurementEngine(key)
+    return _ENGINES[key]
+
+def measure_full_body_from_params(params: Dict, smplx_model_path: str, gender: str = 'neutral', target_height_cm: float = None) -> Dict[str, float]:
+    """
+    SMPL-X 파라미터 기반으로 T-pose와 A-pose 조합으로 신체 치수 측정 (cm 단위)
+    (캐시된 MeasurementEngine 사용 → 모델은 프로세스 당 성별별로 한 번만 로드)
+    """
+    return get_measurement_engine(smplx_model_path).measure(params, gender, target_height_cm)
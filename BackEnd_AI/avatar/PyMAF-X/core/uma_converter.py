@@ -1,28 +1,48 @@
 # uma_converter.py
 import math
+from typing import Any, Dict, List, Sequence
+
+import numpy as np
+
+# 선형 보정 계수 (스칼라/벡터 API 공용)
+#   uma_height = clip01(ALPHA_H + BETA_H * H)
+#   그 외      = clip01((x - LB(H)) / (UB(H) - LB(H))),  LB/UB(H) = a + b * H
+ALPHA_H = -0.4880958200928868
+BETA_H = 0.0048887802493277925
+BELLY_LB = (-0.03068993277927312, 0.09893534588120266)
+BELLY_UB = (-0.8471845942312441, 0.1450915424101687)
+WAIST_LB = (-13.161103579809335, 0.2125703984355903)
+WAIST_UB = (-18.519136735516987, 0.3070783427034955)
+WIDTH_LB = (2.617092292837949, 0.21974016132974816)
+WIDTH_UB = (2.6361913725250545, 0.2639707895380103)
+
+# 아직 측정 기반이 아닌 고정값 컬럼
+UMA_CONSTANTS = {"uma_fore_arm": 0.5, "uma_arm": 0.5, "uma_legs": 0.5}
+UMA_INPUT_COLUMNS = ("height_cm", "waist_FB_cm", "waist_LR_cm", "shoulder_width_cm")
 
 def clip01(x: float) -> float:
     x = float(x)
     return 0.0 if x <= 0.0 else (1.0 if x >= 1.0 else x)
 
+def _linear(coef, H):
+    return coef[0] + coef[1] * H
+
 def uma_height_from_H(H: float) -> float:
-    alpha_h = -0.4880958200928868
-    beta_h  =  0.0048887802493277925
-    return clip01(alpha_h + beta_h * H)
+    return clip01(ALPHA_H + BETA_H * H)
 
 def uma_belly_from_FB_H(FB: float, H: float) -> float:
-    LB = -0.03068993277927312 + 0.09893534588120266 * H
-    UB = -0.8471845942312441  + 0.1450915424101687  * H
+    LB = _linear(BELLY_LB, H)
+    UB = _linear(BELLY_UB, H)
     return clip01((FB - LB) / (UB - LB))
 
 def uma_waist_from_LR_H(LR: float, H: float) -> float:
-    LB = -13.161103579809335 + 0.2125703984355903 * H
-    UB = -18.519136735516987 + 0.3070783427034955 * H
+    LB = _linear(WAIST_LB, H)
+    UB = _linear(WAIST_UB, H)
     return clip01((LR - LB) / (UB - LB))
 
 def uma_width_from_SW_H(SW: float, H: float) -> float:
-    LB =  2.617092292837949  + 0.21974016132974816 * H
-    UB =  2.6361913725250545 + 0.2639707895380103  * H
+    LB = _linear(WIDTH_LB, H)
+    UB = _linear(WIDTH_UB, H)
     return clip01((SW - LB) / (UB - LB))
 
 def uma_from_measurements(meas: dict) -> dict:
@@ -43,7 +63,51 @@ def uma_from_measurements(meas: dict) -> dict:
         "uma_belly":  uma_belly_from_FB_H(FB, H),
         "uma_waist":  uma_waist_from_LR_H(LR, H),
         "uma_width":  uma_width_from_SW_H(SW, H),
-        "uma_fore_arm": 0.5,
-        "uma_arm": 0.5,
-        "uma_legs": 0.5,
+        **UMA_CONSTANTS,
     }
+
+# =========================
+# Vectorized (columnar) API
+# =========================
+
+def _ratio01(x: np.ndarray, H: np.ndarray, lb_coef, ub_coef) -> np.ndarray:
+    LB = _linear(lb_coef, H)
+    UB = _linear(ub_coef, H)
+    return np.clip((x - LB) / (UB - LB), 0.0, 1.0)
+
+def uma_from_arrays(height_cm, waist_FB_cm, waist_LR_cm, shoulder_width_cm) -> Dict[str, np.ndarray]:
+    """
+    측정값 배열(길이 N, 브로드캐스트 가능)을 한 번에 UMA 로 변환.
+    반환: UMA 컬럼명 → float64 배열 (N,). 스칼라 API 와 같은 값.
+    """
+    H = np.asarray(height_cm, dtype=np.float64)
+    FB = np.asarray(waist_FB_cm, dtype=np.float64)
+    LR = np.asarray(waist_LR_cm, dtype=np.float64)
+    SW = np.asarray(shoulder_width_cm, dtype=np.float64)
+    H, FB, LR, SW = np.broadcast_arrays(H, FB, LR, SW)
+
+    out = {
+        "uma_height": np.clip(ALPHA_H + BETA_H * H, 0.0, 1.0),
+        "uma_belly": _ratio01(FB, H, BELLY_LB, BELLY_UB),
+        "uma_waist": _ratio01(LR, H, WAIST_LB, WAIST_UB),
+        "uma_width": _ratio01(SW, H, WIDTH_LB, WIDTH_UB),
+    }
+    for k, v in UMA_CONSTANTS.items():
+        out[k] = np.full(H.shape, v, dtype=np.float64)
+    return out
+
+def uma_from_table(table: Any) -> Dict[str, np.ndarray]:
+    """
+    컬럼 접근(table["height_cm"])이 되는 모든 테이블을 받음:
+    dict of arrays, NumPy structured array, pandas.DataFrame 등.
+    DataFrame 을 넘기면 pd.DataFrame(uma_from_table(df), index=df.index) 로 붙이면 됨.
+    """
+    return uma_from_arrays(*(np.asarray(table[c]) for c in UMA_INPUT_COLUMNS))
+
+def uma_from_records(records: Sequence[Dict[str, Any]]) -> List[Dict[str, float]]:
+    """측정 dict 목록(배치 측정 결과) → UMA dict 목록 (한 번의 벡터 연산)"""
+    if not records:
+        return []
+    columns = {c: np.array([float(r[c]) for r in records]) for c in UMA_INPUT_COLUMNS}
+    uma = uma_from_table(columns)
+    return [{k: float(v[i]) for k, v in uma.items()} for i in range(len(records))]
@@ -1,5 +1,5 @@
 import numpy as np
-from typing import Optional
+from typing import Dict, Optional, Tuple
 from scipy.spatial import ConvexHull, QhullError
 
 def compute_circumference(points_2d: np.ndarray) -> float:
@@ -14,34 +14,42 @@ def compute_circumference(points_2d: np.ndarray) -> float:
     perimeter = np.sum(np.linalg.norm(np.roll(hull_points, -1, axis=0) - hull_points, axis=1))
     return float(perimeter)
 
-def slice_circumference(vertices: np.ndarray, y_height: float, tol: float = 0.003) -> float:
-    """XZ 평면에서 특정 y 높이 단면의 둘레 측정"""
+def _band(vertices: np.ndarray, y_height: float, tol: float,
+          idx: Optional[np.ndarray] = None) -> np.ndarray:
+    """y 높이 ±tol 안의 정점 (idx 가 주어지면 그 후보 정점만 검사), NaN 제거"""
+    if idx is not None:
+        vertices = vertices[idx]
     band = vertices[np.abs(vertices[:, 1] - y_height) < tol]
-    band = band[~np.isnan(band).any(axis=1)]
+    return band[~np.isnan(band).any(axis=1)]
+
+def slice_circumference(vertices: np.ndarray, y_height: float, tol: float = 0.003,
+                        idx: Optional[np.ndarray] = None) -> float:
+    """XZ 평면에서 특정 y 높이 단면의 둘레 측정"""
+    band = _band(vertices, y_height, tol, idx)
     if band.shape[0] < 3:
         return 0.0
     points_2d = band[:, [0, 2]]  # X-Z 평면
     return compute_circumference(points_2d) * 100.0  # cm
 
 def _span_safe(points_2d: np.ndarray, axis_idx: int) -> float:
-    """ConvexHull 기반 span, 실패 시 min–max로 폴백"""
+    """
+    축 방향 span. 축 방향 극값은 항상 Convex Hull 꼭짓점이므로 hull 을 만들지 않고
+    min–max 로 바로 계산 (ConvexHull 기반 결과와 동일).
+    """
     if points_2d.shape[0] < 3:
         return 0.0
-    try:
-        hull = ConvexHull(points_2d)
-        vals = points_2d[hull.vertices][:, axis_idx]
-    except QhullError:
-        vals = points_2d[:, axis_idx]
+    vals = points_2d[:, axis_idx]
     return float(np.nanmax(vals) - np.nanmin(vals))
 
 def slice_width_x(vertices: np.ndarray, y_height: float, tol: float = 0.01,
-                  z_threshold: Optional[float] = None) -> float:
+                  z_threshold: Optional[float] = None,
+                  idx: Optional[np.ndarray] = None) -> float:
     """
     y 슬라이스에서 좌우(x) 폭.
     NOTE: z_threshold는 하위호환을 위해 받지만 더 이상 사용하지 않습니다.
+    idx: 후보 정점 인덱스 (SliceIndex.candidates). None 이면 전체 정점 검사.
     """
-    band = vertices[np.abs(vertices[:, 1] - y_height) < tol]
-    band = band[~np.isnan(band).any(axis=1)]
+    band = _band(vertices, y_height, tol, idx)
     if band.shape[0] < 3:
         return 0.0
     points_2d = band[:, [0, 2]]               # XZ 투영
@@ -49,13 +57,14 @@ def slice_width_x(vertices: np.ndarray, y_height: float, tol: float = 0.01,
     return span_x * 100.0  # cm
 
 def slice_width_z(vertices: np.ndarray, y_height: float, tol: float = 0.01,
-                  x_threshold: Optional[float] = None) -> float:
+                  x_threshold: Optional[float] = None,
+                  idx: Optional[np.ndarray] = None) -> float:
     """
     y 슬라이스에서 앞뒤(z) 폭.
     NOTE: x_threshold는 하위호환을 위해 받지만 더 이상 사용하지 않습니다.
+    idx: 후보 정점 인덱스 (SliceIndex.candidates). None 이면 전체 정점 검사.
     """
-    band = vertices[np.abs(vertices[:, 1] - y_height) < tol]
-    band = band[~np.isnan(band).any(axis=1)]
+    band = _band(vertices, y_height, tol, idx)
     if band.shape[0] < 3:
         return 0.0
     points_2d = band[:, [0, 2]]
@@ -88,3 +97,75 @@ def slice_width_convex_x(vertices: np.ndarray, y_height: float, tol: float = 0.0
             continue
         max_dist2 = max(max_dist2, np.max(np.sum(diffs**2, axis=1)))
     return float(np.sqrt(max_dist2) * 100.0)
+
+
+# =========================
+# Fixed-topology slice index (SMPL-X)
+# =========================
+
+def mesh_edges(faces: np.ndarray) -> np.ndarray:
+    """삼각형 faces (F,3) → 중복 없는 무방향 edge (E,2)"""
+    faces = np.asarray(faces, dtype=np.int64)
+    edges = np.concatenate([faces[:, [0, 1]], faces[:, [1, 2]], faces[:, [2, 0]]], axis=0)
+    edges = np.sort(edges, axis=1)
+    return np.unique(edges, axis=0)
+
+def plane_section_points(vertices: np.ndarray, edges: np.ndarray, y_height: float) -> np.ndarray:
+    """
+    메쉬와 평면 y = y_height 의 정확한 교차점 (XZ 좌표, (M,2)).
+    edges 는 전체 edge 또는 SliceIndex 가 캐시한 후보 edge.
+    """
+    y0 = vertices[edges[:, 0], 1] - y_height
+    y1 = vertices[edges[:, 1], 1] - y_height
+    crossing = (y0 * y1 <= 0) & (y0 != y1)
+    if not np.any(crossing):
+        return np.zeros((0, 2), dtype=vertices.dtype)
+    e = edges[crossing]
+    t = (y0[crossing] / (y0[crossing] - y1[crossing]))[:, None]
+    points = vertices[e[:, 0]] + t * (vertices[e[:, 1]] - vertices[e[:, 0]])
+    points = points[~np.isnan(points).any(axis=1)]
+    return points[:, [0, 2]]
+
+def section_width_x(vertices: np.ndarray, edges: np.ndarray, y_height: float) -> float:
+    """정확한 평면 단면의 좌우(x) 폭 (cm)"""
+    return _span_safe(plane_section_points(vertices, edges, y_height), axis_idx=0) * 100.0
+
+def section_width_z(vertices: np.ndarray, edges: np.ndarray, y_height: float) -> float:
+    """정확한 평면 단면의 앞뒤(z) 폭 (cm)"""
+    return _span_safe(plane_section_points(vertices, edges, y_height), axis_idx=1) * 100.0
+
+class SliceIndex:
+    """
+    고정 토폴로지 메쉬(SMPL-X)의 측정 높이별 후보 정점/edge 캐시.
+    기준 메쉬(예: betas=0 템플릿)에서 랜드마크 높이 ±margin 안의 정점과,
+    그 구간에 걸친 edge 를 한 번 골라 두고, 이후 슬라이스는 그 부분집합만 읽는다.
+    요청된 높이가 캐시 구간을 벗어나면 None 을 돌려 전체 검사로 폴백하게 한다.
+    (betas 에 의한 정점 높이 변화가 margin 보다 작다는 가정 — 토르소 랜드마크는 골반 기준 수 cm 수준)
+    """
+
+    def __init__(self, vertices: np.ndarray, faces: np.ndarray,
+                 heights: Dict[str, float], margin: float = 0.15):
+        edges = mesh_edges(faces)
+        edge_y = vertices[edges, 1]
+        self.bands: Dict[str, Tuple[float, float, np.ndarray, np.ndarray]] = {}
+        for name, y in heights.items():
+            lo, hi = float(y) - margin, float(y) + margin
+            vidx = np.nonzero((vertices[:, 1] > lo) & (vertices[:, 1] < hi))[0]
+            eidx = edges[(edge_y.max(axis=1) > lo) & (edge_y.min(axis=1) < hi)]
+            self.bands[name] = (lo, hi, vidx, eidx)
+
+    def _band(self, name: str, y_lo: float, y_hi: float):
+        band = self.bands.get(name)
+        if band is None or not (band[0] <= y_lo and y_hi <= band[1]):
+            return None
+        return band
+
+    def candidates(self, name: str, y_height: float, tol: float) -> Optional[np.ndarray]:
+        """랜드마크 name 의 y_height ±tol 슬라이스 후보 정점 인덱스 (구간 밖이면 None)"""
+        band = self._band(name, y_height - tol, y_height + tol)
+        return None if band is None else band[2]
+
+    def edges(self, name: str, y_height: float) -> Optional[np.ndarray]:
+        """랜드마크 name 의 y_height 평면과 교차할 수 있는 후보 edge (구간 밖이면 None)"""
+        band = self._band(name, y_height, y_height)
+        return None if band is None else band[3]
@@ -18,7 +18,7 @@ import joblib
 
 from core import path_config, constants
 from core.cfgs import cfg
-from utils.imutils import crop, flip_img, flip_pose, flip_aa, flip_kp, transform, get_transform, get_rot_transf, rot_aa
+from utils.imutils import crop, affine_transform_pts, flip_img, flip_pose, flip_aa, flip_kp, transform, get_transform, get_rot_transf, rot_aa
 from models.smpl import SMPL, get_part_joints
 from utils.geometry import projection, perspective_projection, estimate_translation
 from utils.cam_params import f_pix2vfov, vfov2f_pix
@@ -425,15 +425,9 @@ class BaseDataset(Dataset):
     def j2d_processing(self, kp, t, f, is_smpl=False, is_hand=False, is_face=False, is_feet=False):
         """Process gt 2D keypoints and apply all augmentation transforms."""
         kp = kp.copy()
-        nparts = kp.shape[0]
         # res = [constants.IMG_RES, constants.IMG_RES]
         # t = get_transform(center, scale, res, rot=rot)
-        for i in range(nparts):
-            pt = kp[i,0:2]
-            new_pt = np.array([pt[0], pt[1], 1.]).T
-            new_pt = np.dot(t, new_pt)
-            kp[i,0:2] = new_pt[:2]
-            # kp[i,0:2] = new_pt[:2].astype(int) + 1
+        kp[:, 0:2] = affine_transform_pts(kp[:, 0:2], t)
         # convert to normalized coordinates
         kp[:,:-1] = 2.*kp[:,:-1] / constants.IMG_RES - 1.
         # flip the x coordinates
@@ -18,6 +18,7 @@ import os
 import cv2
 import numpy as np
 import os.path as osp
+from collections import OrderedDict
 from sklearn.random_projection import johnson_lindenstrauss_min_dim
 import torch
 from torch.utils.data import Dataset
@@ -32,11 +33,51 @@ from utils.cam_params import read_cam_params, homo_vector
 
 from core import path_config, constants
 from core.cfgs import cfg
-from utils.imutils import crop, flip_img, flip_pose, flip_aa, flip_kp, transform, get_transform, get_rot_transf, rot_aa
+from utils.imutils import crop, crop_affine, affine_transform_pts, flip_img, flip_pose, flip_aa, flip_kp, transform, get_transform, get_rot_transf, rot_aa
+
+
+class CropEngine:
+    """ Decodes each frame once and serves affine crops of it to all the persons in that frame.
+    Persons of one frame are consecutive in Inference, so a small per-worker cache is enough.
+    Large downscales go through a Gaussian pyramid (cv2.pyrDown) so that the single bilinear warp does not alias.
+    """
+
+    def __init__(self, max_frames=1, max_level=5):
+        self.max_frames = max_frames
+        self.max_level = max_level
+        self._frames = OrderedDict()
+
+    def frame(self, path):
+        """ RGB uint8 image pyramid of the frame; level 0 is the full image. """
+        pyramid = self._frames.get(path)
+        if pyramid is None:
+            img = cv2.imread(path)
+            if img is None:
+                raise FileNotFoundError(path)
+            pyramid = [cv2.cvtColor(img, cv2.COLOR_BGR2RGB)]
+            self._frames[path] = pyramid
+            while len(self._frames) > self.max_frames:
+                self._frames.popitem(last=False)
+        else:
+            self._frames.move_to_end(path)
+        return pyramid
+
+    def crop(self, path, center, scale, res, rot=0):
+        """ Returns the (3, res[0], res[1]) float32 crop in [0, 1]. """
+        pyramid = self.frame(path)
+        # source pixels per output pixel
+        ratio = 200. * scale / max(res)
+        level = min(int(np.floor(np.log2(ratio))), self.max_level) if ratio >= 2. else 0
+        while len(pyramid) <= level:
+            pyramid.append(cv2.pyrDown(pyramid[-1]))
+        # pixel i of level k is pixel i * 2^k of the full image
+        s = 0.5 ** level
+        crop_img = crop_affine(pyramid[level], [center[0] * s, center[1] * s], scale * s, res, rot=rot)
+        return np.transpose(crop_img, (2, 0, 1)).astype(np.float32) / 255.
 
 
 class Inference(Dataset):
-    def __init__(self, image_folder, frames, bboxes=None, joints2d=None, scale=1.0, crop_size=224, pre_load_imgs=None, full_body=False, person_ids=[], wb_kps={}):
+    def __init__(self, image_folder, frames, bboxes=None, joints2d=None, scale=1.0, crop_size=224, pre_load_imgs=None, full_body=False, person_ids=[], wb_kps={}, person_boxes=None, body_only=False, normalize=True):
         self.pre_load_imgs = pre_load_imgs
         if pre_load_imgs is None:
             self.image_file_names = [
@@ -53,9 +94,16 @@ class Inference(Dataset):
         self.frames = frames
         self.has_keypoints = True if joints2d is not None else False
         self.full_body = full_body
+        # optional client-provided [x1, y1, x2, y2] per person (None: from the keypoints)
+        self.person_boxes = person_boxes
+        # body_only: only 'img_body' is produced (no hand/face crops), for PyMAF.forward(body_only=True)
+        self.body_only = body_only
+        # normalize=False: 'img_*' are the raw [0, 1] crops and the batch loader normalizes whole batches
+        self.normalize = normalize
         self.person_ids = person_ids
 
         self.normalize_img = Normalize(mean=constants.IMG_NORM_MEAN, std=constants.IMG_NORM_STD)
+        self.crops = CropEngine()
 
         self.norm_joints2d = np.zeros_like(self.joints2d)
 
@@ -71,10 +119,8 @@ class Inference(Dataset):
             else:
                 bboxes = []
                 scales = []
-                for j2d in joints2d:
-                    kp2d_valid = j2d[j2d[:, 2]>0.]
-                    bbox = [min(kp2d_valid[:, 0]), min(kp2d_valid[:, 1]),
-                            max(kp2d_valid[:, 0]), max(kp2d_valid[:, 1])]
+                for i in range(len(joints2d)):
+                    bbox = self.body_box(i)
                     center = [(bbox[2] + bbox[0]) / 2., (bbox[3] + bbox[1]) / 2.]
                     scale = self.scale_factor * 1.2 * max(bbox[2] - bbox[0], bbox[3] - bbox[1]) / 200.
 
@@ -98,7 +144,7 @@ class Inference(Dataset):
                 self.joints2d = joints2d
                 self.frames = frames
 
-        if self.full_body:
+        if self.full_body and not self.body_only:
             joints2d_face = wb_kps['joints2d_face']
             joints2d_lhand = wb_kps['joints2d_lhand']
             joints2d_rhand = wb_kps['joints2d_rhand']
@@ -118,6 +164,18 @@ class Inference(Dataset):
         # return len(self.image_file_names)
         return len(self.bboxes)
 
+    def body_box(self, idx):
+        """ [x1, y1, x2, y2] of the person: the client-provided box, or the extent of the visible keypoints. """
+        if self.person_boxes is not None and self.person_boxes[idx] is not None:
+            return list(self.person_boxes[idx])
+        j2d = self.joints2d[idx]
+        kp2d_valid = j2d[j2d[:, 2]>0.]
+        return [min(kp2d_valid[:, 0]), min(kp2d_valid[:, 1]),
+                max(kp2d_valid[:, 0]), max(kp2d_valid[:, 1])]
+
+    def input_img(self, img):
+        return self.normalize_img(img) if self.normalize else img
+
     def rgb_processing(self, rgb_img, center, scale, res, rot=0., flip=0):
         """Process rgb image and do augmentation."""
         # crop
@@ -135,15 +193,9 @@ class Inference(Dataset):
     def j2d_processing(self, kp, t, f, is_smpl=False, is_hand=False, is_face=False, is_feet=False):
         """Process gt 2D keypoints and apply all augmentation transforms."""
         kp = kp.copy()
-        nparts = kp.shape[0]
         # res = [constants.IMG_RES, constants.IMG_RES]
         # t = get_transform(center, scale, res, rot=rot)
-        for i in range(nparts):
-            pt = kp[i,0:2]
-            new_pt = np.array([pt[0], pt[1], 1.]).T
-            new_pt = np.dot(t, new_pt)
-            kp[i,0:2] = new_pt[:2]
-            # kp[i,0:2] = new_pt[:2].astype(int) + 1
+        kp[:, 0:2] = affine_transform_pts(kp[:, 0:2], t)
         # convert to normalized coordinates
         kp[:,:-1] = 2.*kp[:,:-1] / constants.IMG_RES - 1.
         # flip the x coordinates
@@ -162,11 +214,6 @@ class Inference(Dataset):
     def __getitem__(self, idx):
         if self.pre_load_imgs is not None:
             img = self.pre_load_imgs
-        else:
-            # img = cv2.cvtColor(cv2.imread(self.image_file_names[idx]), cv2.COLOR_BGR2RGB)
-            img_orig = cv2.imread(self.image_file_names[idx])[:,:,::-1].copy().astype(np.float32)
-            # img_orig = img.copy()
-            orig_height, orig_width = img_orig.shape[:2]
 
         if not self.full_body:
             bbox = self.bboxes[idx]
@@ -186,36 +233,39 @@ class Inference(Dataset):
         else:
             item = {}
 
+            # decoded once per frame and shared by all the persons in it
+            img_path = self.image_file_names[idx]
+            orig_height, orig_width = self.crops.frame(img_path)[0].shape[:2]
+
             scale = self.scale_factor
             rot = 0.
             flip = 0
 
-            j2d = self.joints2d[idx]
-
-            kp2d_valid = j2d[j2d[:, 2]>0.]
-            bbox = [min(kp2d_valid[:, 0]), min(kp2d_valid[:, 1]),
-                    max(kp2d_valid[:, 0]), max(kp2d_valid[:, 1])]
+            bbox = self.body_box(idx)
             center = [(bbox[2] + bbox[0]) / 2., (bbox[3] + bbox[1]) / 2.]
             sc = 1.2 * max(bbox[2] - bbox[0], bbox[3] - bbox[1]) / 200.
 
             sc *= cfg.DATA.RESCALE_B
 
-            img, _, crop_shape = self.rgb_processing(img_orig, center, sc*scale, [constants.IMG_RES, constants.IMG_RES])
+            img = self.crops.crop(img_path, center, sc*scale, [constants.IMG_RES, constants.IMG_RES])
 
             # Store image before normalization to use it in visualization
-            item['img_body'] = self.normalize_img(torch.from_numpy(img).float())
+            item['img_body'] = self.input_img(torch.from_numpy(img).float())
             item['orig_height'] = orig_height
             item['orig_width'] = orig_width
 
             item['person_id'] = self.person_ids[idx]
 
-            img_hr, img_crop, _ = self.rgb_processing(img_orig, center, sc*scale, [constants.IMG_RES * 8, constants.IMG_RES * 8])
+            if self.body_only:
+                return item
 
             kps_transf = get_transform(center, sc * scale, [constants.IMG_RES, constants.IMG_RES], rot=rot)
 
             lhand_kp2d, rhand_kp2d, face_kp2d = self.joints2d_part['lhand'][idx], self.joints2d_part['rhand'][idx], self.joints2d_part['face'][idx]
 
             if cfg.MODEL.PyMAF.HF_BOX_ALIGN:
+                # high-resolution body crop, only needed to sample the hand/face crops from
+                img_crop = self.crops.crop(img_path, center, sc*scale, [constants.IMG_RES * 8, constants.IMG_RES * 8])
 
                 hand_kp2d = self.j2d_processing(np.concatenate([lhand_kp2d, rhand_kp2d]).copy(), kps_transf, flip, is_hand=True)
                 face_kp2d = self.j2d_processing(face_kp2d.copy(), kps_transf, flip, is_face=True)
@@ -250,7 +300,7 @@ class Inference(Dataset):
                     grid = F.affine_grid(theta_part.detach(), crop_hf_img_size, align_corners=False)
                     img_part = F.grid_sample(torch.from_numpy(img_crop[None]), grid.cpu(), align_corners=False).squeeze(0)
 
-                    item[f'img_{part}'] = self.normalize_img(img_part.float())
+                    item[f'img_{part}'] = self.input_img(img_part.float())
 
                     theta_i_inv = torch.zeros_like(theta_part)
                     theta_i_inv[:, 0, 0] = 1. / theta_part[:, 0, 0]
@@ -288,9 +338,9 @@ class Inference(Dataset):
                         scale_part = 0.5
                         kp2d[:, 2] = 0
 
-                    img_part, _, crop_shape = self.rgb_processing(img_orig, center_part, scale_part, [constants.IMG_RES, constants.IMG_RES])
+                    img_part = self.crops.crop(img_path, center_part, scale_part, [constants.IMG_RES, constants.IMG_RES])
 
-                    item[f'img_{part}'] = self.normalize_img(torch.from_numpy(img_part).float())
+                    item[f'img_{part}'] = self.input_img(torch.from_numpy(img_part).float())
 
                     if part in self.vis_part:
                         item[f'vis_{part}'] = self.vis_part[part][idx]
@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+"""
+Batch loader for the Inference dataset with preallocated, shared (and pinned) image buffers.
+
+The plain DataLoader path allocates a normalized tensor per crop in the worker, pickles it
+through shared memory file descriptors, stacks the batch again in the main process and then
+copies every key to the device one by one. Here:
+  - image buffers [n_slots, batch_size, 3, H, W] are allocated once in shared memory
+    (page-locked with cudaHostRegister when running on CUDA),
+  - each worker fills one whole batch slot in place and only sends back the slot index plus
+    the small per-person fields (ids, image sizes, visibilities),
+  - normalization is done once per batch on the device instead of once per crop.
+"""
+
+import torch
+from torch.utils.data import Dataset, DataLoader, default_collate
+
+from core import constants
+
+
+def _identity(x):
+    return x
+
+
+class _BatchWriter(Dataset):
+    """ One item = one batch of the wrapped Inference dataset, written into a buffer slot. """
+
+    def __init__(self, dataset, buffers, batch_size):
+        self.dataset = dataset
+        self.buffers = buffers
+        self.batch_size = batch_size
+        self.n_slots = next(iter(buffers.values())).shape[0]
+
+    def __len__(self):
+        return (len(self.dataset) + self.batch_size - 1) // self.batch_size
+
+    def __getitem__(self, b):
+        slot = b % self.n_slots
+        start = b * self.batch_size
+        end = min(start + self.batch_size, len(self.dataset))
+        metas = []
+        for j, idx in enumerate(range(start, end)):
+            item = self.dataset[idx]
+            for k, buf in self.buffers.items():
+                buf[slot, j].copy_(item.pop(k))
+            metas.append(item)
+        return {'slot': slot, 'n': end - start, 'meta': default_collate(metas)}
+
+
+class InferenceBatchLoader:
+    """
+    Iterates over an Inference dataset (built with normalize=False) in batches of batch_size and
+    yields the same dict as DataLoader + default collate, already on the device and normalized.
+
+    Slots are reused round-robin: at most num_workers * prefetch_factor batches are in flight,
+    plus the one being consumed and the one whose host-to-device copy may still be running.
+    """
+
+    def __init__(self, dataset, batch_size, num_workers=2, prefetch_factor=2, device=torch.device('cpu'),
+                 pin_memory=False):
+        assert not dataset.normalize, 'build Inference with normalize=False, normalization is done per batch'
+        self.dataset = dataset
+        self.batch_size = batch_size
+        self.num_workers = num_workers
+        self.prefetch_factor = prefetch_factor
+        self.device = device
+
+        # buffer shapes from the first item (only the image crops go through the slots)
+        probe = dataset[0]
+        image_keys = [k for k, v in probe.items() if k.startswith('img_') and torch.is_tensor(v)]
+        n_slots = (num_workers * prefetch_factor if num_workers > 0 else 1) + 2
+        self.buffers = {k: torch.empty((n_slots, batch_size) + tuple(probe[k].shape), dtype=probe[k].dtype).share_memory_()
+                        for k in image_keys}
+
+        self._pinned = []
+        if pin_memory and device.type == 'cuda':
+            cudart = torch.cuda.cudart()
+            for buf in self.buffers.values():
+                if cudart.cudaHostRegister(buf.data_ptr(), buf.numel() * buf.element_size(), 0) == 0:
+                    self._pinned.append(buf)
+
+        self.mean = torch.tensor(constants.IMG_NORM_MEAN, dtype=torch.float32, device=device).view(1, 3, 1, 1)
+        self.std = torch.tensor(constants.IMG_NORM_STD, dtype=torch.float32, device=device).view(1, 3, 1, 1)
+
+        self.writer = _BatchWriter(dataset, self.buffers, batch_size)
+        loader_kwargs = {'prefetch_factor': prefetch_factor, 'persistent_workers': False} if num_workers > 0 else {}
+        self.loader = DataLoader(self.writer, batch_size=None, shuffle=False, num_workers=num_workers,
+                                 collate_fn=_identity, **loader_kwargs)
+
+    def __len__(self):
+        return len(self.writer)
+
+    def __iter__(self):
+        copied = None
+        for packed in self.loader:
+            slot, n = packed['slot'], packed['n']
+            batch = {k: v.to(self.device, non_blocking=True) if torch.is_tensor(v) else v
+                     for k, v in packed['meta'].items()}
+            for k, buf in self.buffers.items():
+                img = buf[slot, :n].to(self.device, non_blocking=True)
+                # the slot is rewritten by a worker once later batches are requested → never hand out the buffer itself
+                batch[k] = (img - self.mean).div_(self.std)
+            if self.device.type == 'cuda':
+                # the previous slot is free again only after its copy finished
+                if copied is not None:
+                    copied.synchronize()
+                copied = torch.cuda.Event()
+                copied.record()
+            yield batch
+
+    def close(self):
+        if self._pinned:
+            cudart = torch.cuda.cudart()
+            for buf in self._pinned:
+                cudart.cudaHostUnregister(buf.data_ptr())
+            self._pinned = []
+
+    def __del__(self):
+        self.close()
@@ -20,10 +20,49 @@ import logging
 logger = logging.getLogger(__name__)
 
 from utils.iuvmap import iuv_img2map, iuv_map2img, seg_img2map
-from .smpl import get_smpl_tpose
+from .smpl import get_smpl_tpose, sparse_transfer_tables, transfer_vertices
 from utils.imutils import j2d_processing
 
 
+# Process-wide gather tables for the mesh graphs, shared by every Mesh_Sampler: {(type, level): (down, up)}
+_SAMPLING_TABLES = {}
+
+
+def get_sampling_tables(type='smpl', level=2):
+    ''' Down/up-sampling operators of the SMPL / MANO mesh graphs as gather tables.
+    Each operator is (idx [N_out, K], weight [N_out, K]); see smpl.sparse_transfer_tables.
+    Built once per process from data/<type>_downsampling.npz and shared by all modules.
+    '''
+    key = (type, level)
+    if key not in _SAMPLING_TABLES:
+        # smpl: from https://github.com/nkolot/GraphCMR/blob/master/data/mesh_downsampling.npz
+        mesh_graph = np.load('data/{}_downsampling.npz'.format(type), allow_pickle=True, encoding='latin1')
+        U = [scipy.sparse.csr_matrix(u) for u in mesh_graph['U']]
+        D = [scipy.sparse.csr_matrix(d) for d in mesh_graph['D']] # shape: (2,)
+
+        # D[0] - Size: [1723, 6890] , [195, 778]
+        # D[1] - Size: [431, 1723] , [49, 195]
+        # U[0] - Size: [6890, 1723]
+        # U[1] - Size: [1723, 431]
+        if level == 2:
+            Dmap = D[1] @ D[0] # 6890 -> 431
+            Umap = U[0] @ U[1] # 431 -> 6890
+        elif level == 1:
+            Dmap = D[0]
+            Umap = U[0]
+
+        # each row mixes only a few vertices, so the tables stay tiny (K <= 9)
+        _SAMPLING_TABLES[key] = tuple(sparse_transfer_tables(m.toarray(), max_nnz=m.shape[1])
+                                      for m in (Dmap, Umap))
+    return _SAMPLING_TABLES[key]
+
+
+def _drop_dense_sampling_maps(state_dict, prefix):
+    # checkpoints saved before the shared sparse operators carry dense Dmap / Umap buffers
+    for name in ('Dmap', 'Umap'):
+        state_dict.pop(prefix + name, None)
+
+
 class Mesh_Sampler(nn.Module):
     ''' Mesh Up/Down-sampling
     '''
@@ -36,63 +75,32 @@ class Mesh_Sampler(nn.Module):
             sampling_idx = torch.LongTensor(list(np.load('data/flame_downsampling.npy')))
             self.register_buffer('sampling_idx', sampling_idx)
         else:
-            # downsample SMPL mesh and assign part labels
-            if type == 'smpl':
-                # from https://github.com/nkolot/GraphCMR/blob/master/data/mesh_downsampling.npz
-                smpl_mesh_graph = np.load('data/smpl_downsampling.npz', allow_pickle=True, encoding='latin1')
-
-                A = smpl_mesh_graph['A']
-                U = smpl_mesh_graph['U']
-                D = smpl_mesh_graph['D'] # shape: (2,)
-            elif type == 'mano':
-                mano_mesh_graph = np.load('data/mano_downsampling.npz', allow_pickle=True, encoding='latin1')
-
-                A = mano_mesh_graph['A']
-                U = mano_mesh_graph['U']
-                D = mano_mesh_graph['D'] # shape: (2,)
-
-            # downsampling
-            ptD = []
-            for lv in range(len(D)):
-                d = scipy.sparse.coo_matrix(D[lv])
-                i = torch.LongTensor(np.array([d.row, d.col]))
-                v = torch.FloatTensor(d.data)
-                ptD.append(torch.sparse.FloatTensor(i, v, d.shape))
-            
-            # downsampling mapping from 6890 points to 431 points
-            # ptD[0].to_dense() - Size: [1723, 6890] , [195, 778]
-            # ptD[1].to_dense() - Size: [431, 1723] , [49, 195]
-            if level == 2:
-                Dmap = torch.matmul(ptD[1].to_dense(), ptD[0].to_dense()) # 6890 -> 431
-            elif level == 1:
-                Dmap = ptD[0].to_dense() # 
-            self.register_buffer('Dmap', Dmap)
-
-            # upsampling
-            ptU = []
-            for lv in range(len(U)):
-                d = scipy.sparse.coo_matrix(U[lv])
-                i = torch.LongTensor(np.array([d.row, d.col]))
-                v = torch.FloatTensor(d.data)
-                ptU.append(torch.sparse.FloatTensor(i, v, d.shape))
-            
-            # upsampling mapping from 431 points to 6890 points
-            # ptU[0].to_dense() - Size: [6890, 1723]
-            # ptU[1].to_dense() - Size: [1723, 431]
-            if level == 2:
-                Umap = torch.matmul(ptU[0].to_dense(), ptU[1].to_dense()) # 431 -> 6890
-            elif level == 1:
-                Umap = ptU[0].to_dense() # 
-            self.register_buffer('Umap', Umap)
+            # downsample SMPL / MANO mesh with the shared sparse operators
+            (D_idx, D_weight), (U_idx, U_weight) = get_sampling_tables(type, level)
+            self.register_buffer('D_idx', D_idx, persistent=False)
+            self.register_buffer('D_weight', D_weight, persistent=False)
+            self.register_buffer('U_idx', U_idx, persistent=False)
+            self.register_buffer('U_weight', U_weight, persistent=False)
+
+    @property
+    def ds_len(self):
+        ''' number of vertices after downsampling '''
+        if self.model_type == 'flame':
+            return len(self.sampling_idx)
+        return self.D_idx.shape[0]
+
+    def _load_from_state_dict(self, state_dict, prefix, *args, **kwargs):
+        _drop_dense_sampling_maps(state_dict, prefix)
+        super()._load_from_state_dict(state_dict, prefix, *args, **kwargs)
 
     def downsample(self, x):
         if self.model_type == 'flame':
             return x[:, self.sampling_idx].contiguous()
         else:
-            return torch.matmul(self.Dmap.unsqueeze(0), x) # [B, 431, 3]
+            return transfer_vertices(x, self.D_idx, self.D_weight) # [B, 431, 3]
     
     def upsample(self, x):
-        return torch.matmul(self.Umap.unsqueeze(0), x) # [B, 6890, 3]
+        return transfer_vertices(x, self.U_idx, self.U_weight) # [B, 6890, 3]
 
     def forward(self, x, mode='downsample'):
         if mode == 'downsample':
@@ -132,42 +140,12 @@ class MAF_Extractor(nn.Module):
 
             self.add_module("conv%d" % l, self.filters[l])
 
-        # downsample SMPL mesh and assign part labels
-        # from https://github.com/nkolot/GraphCMR/blob/master/data/mesh_downsampling.npz
-        smpl_mesh_graph = np.load('data/smpl_downsampling.npz', allow_pickle=True, encoding='latin1')
-
-        A = smpl_mesh_graph['A']
-        U = smpl_mesh_graph['U']
-        D = smpl_mesh_graph['D'] # shape: (2,)
-
-        # downsampling
-        ptD = []
-        for level in range(len(D)):
-            d = scipy.sparse.coo_matrix(D[level])
-            i = torch.LongTensor(np.array([d.row, d.col]))
-            v = torch.FloatTensor(d.data)
-            ptD.append(torch.sparse.FloatTensor(i, v, d.shape))
-        
-        # downsampling mapping from 6890 points to 431 points
-        # ptD[0].to_dense() - Size: [1723, 6890]
-        # ptD[1].to_dense() - Size: [431. 1723]
-        Dmap = torch.matmul(ptD[1].to_dense(), ptD[0].to_dense()) # 6890 -> 431
-        self.register_buffer('Dmap', Dmap)
-
-        # upsampling
-        ptU = []
-        for level in range(len(U)):
-            d = scipy.sparse.coo_matrix(U[level])
-            i = torch.LongTensor(np.array([d.row, d.col]))
-            v = torch.FloatTensor(d.data)
-            ptU.append(torch.sparse.FloatTensor(i, v, d.shape))
-        
-        # upsampling mapping from 431 points to 6890 points
-        # ptU[0].to_dense() - Size: [6890, 1723]
-        # ptU[1].to_dense() - Size: [1723, 431]
-        Umap = torch.matmul(ptU[0].to_dense(), ptU[1].to_dense()) # 431 -> 6890
-        self.register_buffer('Umap', Umap)
+        # The dense SMPL Dmap / Umap buffers that used to be built here were never used by the
+        # extractor; mesh up/down-sampling lives in the shared Mesh_Sampler operators.
 
+    def _load_from_state_dict(self, state_dict, prefix, *args, **kwargs):
+        _drop_dense_sampling_maps(state_dict, prefix)
+        super()._load_from_state_dict(state_dict, prefix, *args, **kwargs)
 
     def reduce_dim(self, feature):
         '''
@@ -196,7 +196,11 @@ class Regressor(nn.Module):
             self.register_buffer('init_exp', init_exp)
 
 
-    def forward(self, x=None, n_iter=1, J_regressor=None, rw_cam={}, init_mode=False, global_iter=-1, **kwargs):
+    def forward(self, x=None, n_iter=1, J_regressor=None, rw_cam={}, init_mode=False, global_iter=-1, body_only=False, **kwargs):
+        '''
+        body_only: update the body parameters only; hand/face parameters stay at their initial (mean) values
+                   and the wrist/head corrections from the hand/face branches are not applied.
+        '''
         if x is not None:
             batch_size = x.shape[0]
         else:
@@ -308,7 +312,7 @@ class Regressor(nn.Module):
                     if cfg.MODEL.PyMAF.OPT_WRIST:
                         pred_rotmat_body = rot6d_to_rotmat(pred_pose.reshape(batch_size, -1, 6)) # .view(batch_size, 24, 3, 3)
 
-                if not self.smpl_mode:
+                if not self.smpl_mode and not body_only:
                     if self.hand_only_mode:
                         xc_rhand = kwargs['xc_rhand']
                         xc_rhand = torch.cat([xc_rhand, pred_rhand], 1)
@@ -495,7 +499,7 @@ class Regressor(nn.Module):
 
         # if self.full_body_mode:
         if self.smplx_mode:
-            if cfg.MODEL.PyMAF.PRED_VIS_H and global_iter == (cfg.MODEL.PyMAF.N_ITER - 1):
+            if cfg.MODEL.PyMAF.PRED_VIS_H and global_iter == (cfg.MODEL.PyMAF.N_ITER - 1) and not body_only:
                 pred_lhand_filtered = [pred_lhand[_i] if pred_vis_lhand[_i] else self.init_rhand[0] for _i in range(batch_size)]
                 pred_rhand_filtered = [pred_rhand[_i] if pred_vis_rhand[_i] else self.init_rhand[0] for _i in range(batch_size)]
                 pred_lhand_filtered = torch.stack(pred_lhand_filtered)
@@ -560,7 +564,7 @@ class Regressor(nn.Module):
             pred_vertices = pred_output.vertices
             pred_joints = pred_output.joints
 
-            if not cfg.MODEL.PyMAF.HF_BOX_ALIGN:
+            if not cfg.MODEL.PyMAF.HF_BOX_ALIGN and not body_only:
                 if 'hand' in self.bhf_names:
                     pred_rotmat_rh = rot6d_to_rotmat(torch.cat([pred_orient_rh, pred_rhand], dim=1).reshape(batch_size, -1, 6)) # .view(batch_size, 16, 3, 3)
                     pred_output_rhand = self.mano(
@@ -672,7 +676,7 @@ class Regressor(nn.Module):
                 if cfg.MODEL.PyMAF.PRED_VIS_H:
                     output.update({'pred_vis_hands': pred_vis_hands})
 
-                if not cfg.MODEL.PyMAF.HF_BOX_ALIGN:
+                if not cfg.MODEL.PyMAF.HF_BOX_ALIGN and not body_only:
                     if 'hand' in self.bhf_names:
                         output.update({'verts_lh_mano': pred_output_lhand.rhand_vertices,
                                        'verts_rh_mano': pred_output_rhand.rhand_vertices,
@@ -910,9 +914,9 @@ class PyMAF(nn.Module):
         if 'body' in self.bhf_names:
             self.mesh_sampler = Mesh_Sampler(type='smpl')
             self.part_module_names['body'].update({'mesh_sampler': self.mesh_sampler})
-            self.smpl_ds_len = self.mesh_sampler.Dmap.shape[0]
+            self.smpl_ds_len = self.mesh_sampler.ds_len
             if not cfg.MODEL.PyMAF.GRID_FEAT:
-                ma_feat_dim = self.mesh_sampler.Dmap.shape[0] * cfg.MODEL.PyMAF.MLP_DIM[-1]
+                ma_feat_dim = self.mesh_sampler.ds_len * cfg.MODEL.PyMAF.MLP_DIM[-1]
             else:
                 ma_feat_dim = 0
             bhf_ma_feat_dim.update({'body': ma_feat_dim})
@@ -921,7 +925,7 @@ class PyMAF(nn.Module):
 
         if 'hand' in self.bhf_names:
             self.mano_sampler = Mesh_Sampler(type='mano', level=1)
-            self.mano_ds_len = self.mano_sampler.Dmap.shape[0]
+            self.mano_ds_len = self.mano_sampler.ds_len
             self.part_module_names['hand'].update({'mano_sampler': self.mano_sampler})
             bhf_ma_feat_dim.update({'hand': self.mano_ds_len * cfg.MODEL.PyMAF.HF_MLP_DIM[-1]})
             if self.fuse_grid_align:
@@ -1156,7 +1160,7 @@ class PyMAF(nn.Module):
                 self.smpl_family[m].model.cuda(*args, **kwargs)
         return
 
-    def forward(self, input_batch={}, J_regressor=None, rw_cam={}):
+    def forward(self, input_batch={}, J_regressor=None, rw_cam={}, body_only=False):
         '''
         Args:
             input_batch: input dictionary, including 
@@ -1164,6 +1168,8 @@ class PyMAF(nn.Module):
                    inversed affine transformation for the cropping of hand/face images: '{part}_theta_inv' for part in lhand, rhand, and face if applicable
             J_regressor: joint regression matrix
             rw_cam: real-world camera information, applied when cfg.MODEL.USE_IWP_CAM is False
+            body_only: skip the hand/face encoders, mesh-aligned features and regressors (serving mode);
+                   only 'img_body' is needed and the hand/face parameters stay at their mean values
         Returns:
             out_dict: the list containing the predicted parameters
             vis_feat_list: the list containing features for visualization
@@ -1179,6 +1185,9 @@ class PyMAF(nn.Module):
                 for _, part_module in self.part_module_names[part].items():
                     part_module.eval()
 
+        assert not body_only or 'body' in self.bhf_names
+        hf_names = [] if body_only else [n for n in self.bhf_names if n != 'body']
+
         # extract spatial features or global features
         # run encoder for body
         if 'body' in self.bhf_names:
@@ -1189,15 +1198,15 @@ class PyMAF(nn.Module):
                 assert len(s_feat_body) == cfg.MODEL.PyMAF.N_ITER
 
         # run encoders for hand / face
-        if 'hand' in self.bhf_names or 'face' in self.bhf_names:
+        if 'hand' in hf_names or 'face' in hf_names:
             limb_feat_dict = {}
             limb_gfeat_dict = {}
-            if 'face' in self.bhf_names:
+            if 'face' in hf_names:
                 img_face = input_batch['img_face']
                 batch_size = img_face.shape[0]
                 limb_feat_dict['face'], limb_gfeat_dict['face'] = self.encoders['face'](img_face)
 
-            if 'hand' in self.bhf_names:
+            if 'hand' in hf_names:
                 if 'lhand' in self.part_names:
                     img_rhand = input_batch['img_rhand']
                     batch_size = img_rhand.shape[0]
@@ -1270,7 +1279,7 @@ class PyMAF(nn.Module):
 
             # re-project hand/face mesh on the image plane
             proj_hf_center, proj_hf_pts = {}, {}
-            if 'hand' in self.bhf_names:
+            if 'hand' in hf_names:
                 if self.hand_only_mode:
                     pred_cam = mesh_output['pred_cam'].detach() if cfg.MODEL.PyMAF.MAF_ON else mesh_output['pred_cam']
                     pred_rhand_v = self.mano_sampler(mesh_output['verts_rh'])
@@ -1315,7 +1324,7 @@ class PyMAF(nn.Module):
                                     'rhand': torch.cat([proj_hf_center['rhand'], pred_hand_proj[batch_size:]], dim=1),
                                     })
 
-            if 'face' in self.bhf_names:
+            if 'face' in hf_names:
                 if self.face_only_mode or (not cfg.MODEL.PyMAF.HF_BOX_ALIGN):
                     if self.face_only_mode:
                         pred_cam_fa = mesh_output['pred_cam'].detach() if cfg.MODEL.PyMAF.MAF_ON else mesh_output['pred_cam']
@@ -1349,7 +1358,7 @@ class PyMAF(nn.Module):
                     proj_hf_pts.update({'face': torch.cat([proj_hf_center['face'], pred_face_proj], dim=1)})
 
             # extract mesh-aligned features for the hand / face part
-            if 'hand' in self.bhf_names or 'face' in self.bhf_names:
+            if 'hand' in hf_names or 'face' in hf_names:
                 limb_rf_i = rf_i
 
                 hand_face_feat = {}
@@ -1464,7 +1473,7 @@ class PyMAF(nn.Module):
             else:
                 ref_feature = None
 
-            if not self.smpl_mode:
+            if not self.smpl_mode and not body_only:
                 if self.hand_only_mode:
                     current_states['xc_rhand'] = hand_face_feat['rhand']
                 elif self.face_only_mode:
@@ -1512,7 +1521,7 @@ class PyMAF(nn.Module):
                             current_states['init_orient_fa'] = mesh_output['pred_orient_fa'].detach() if cfg.MODEL.PyMAF.MAF_ON else mesh_output['pred_orient_fa']
                             current_states['init_cam_fa'] = mesh_output['pred_cam_fa'].detach() if cfg.MODEL.PyMAF.MAF_ON else mesh_output['pred_cam_fa']
 
-            mesh_output = self.regressor[rf_i](ref_feature, n_iter=1, J_regressor=J_regressor, rw_cam=rw_cam, global_iter=rf_i, **current_states)
+            mesh_output = self.regressor[rf_i](ref_feature, n_iter=1, J_regressor=J_regressor, rw_cam=rw_cam, global_iter=rf_i, body_only=body_only, **current_states)
 
             out_list['mesh_out'].append(mesh_output)
 
@@ -357,10 +357,37 @@ class SMPLX(SMPLXLayer):
         return global_rotmat, posed_joints
 
 
+def sparse_transfer_tables(matrix, max_nnz=64):
+    """ Convert a dense [N_out, N_in] vertex transfer matrix (e.g. SMPL-X -> SMPL) into
+    gather tables: idx [N_out, K] and weight [N_out, K], K = max non-zeros per row.
+    Rows with fewer non-zeros are padded with (index 0, weight 0).
+    Returns None if the matrix is not sparse enough (K > max_nnz).
+    """
+    matrix = np.asarray(matrix, dtype=np.float32)
+    nnz = (matrix != 0).sum(axis=1)
+    K = max(int(nnz.max()), 1)
+    if K > max_nnz:
+        return None
+    # stable sort puts the non-zero columns of each row first, in column order
+    idx = np.argsort(matrix == 0, axis=1, kind='stable')[:, :K]
+    weight = np.take_along_axis(matrix, idx, axis=1)
+    idx[weight == 0] = 0
+    return torch.from_numpy(idx.astype(np.int64)), torch.from_numpy(weight)
+
+
+def transfer_vertices(vertices, idx, weight):
+    """ Apply gather tables from sparse_transfer_tables: [B, N_in, 3] -> [B, N_out, 3] """
+    return torch.einsum('bvkc,vk->bvc', vertices[:, idx], weight)
+
+
+# gender codes used by SMPLX_ALL: 0 = male, 1 = female, 2 = neutral
+SMPLX_GENDERS = ['male', 'female', 'neutral']
+
+
 class SMPLX_ALL(nn.Module):
     """ Extension of the official SMPLX implementation to support more joints """
 
-    def __init__(self, batch_size=1, use_face_contour=True, all_gender=False, **kwargs):
+    def __init__(self, batch_size=1, use_face_contour=True, all_gender=False, sparse_transfer=True, **kwargs):
         super().__init__()
         numBetas = 10
         self.use_face_contour = use_face_contour
@@ -383,7 +410,15 @@ class SMPLX_ALL(nn.Module):
         self.register_buffer('J_regressor_extra', torch.tensor(J_regressor_extra, dtype=torch.float32))
         self.joint_map = torch.tensor(joints, dtype=torch.long)
         smplx_to_smpl = pickle.load(open(os.path.join(SMPL_MODEL_DIR, 'model_transfer/smplx_to_smpl.pkl'), 'rb'))    
-        self.register_buffer('smplx2smpl', torch.tensor(smplx_to_smpl['matrix'][None], dtype=torch.float32))
+        # Each SMPL vertex is a barycentric mix of a few SMPL-X vertices: keep (index, weight) tables
+        # and gather, instead of a dense 6890 x 10475 buffer (~290 MB) and a batched GEMM per forward.
+        tables = sparse_transfer_tables(smplx_to_smpl['matrix']) if sparse_transfer else None
+        self.sparse_transfer = tables is not None
+        if self.sparse_transfer:
+            self.register_buffer('smplx2smpl_idx', tables[0])
+            self.register_buffer('smplx2smpl_weight', tables[1])
+        else:
+            self.register_buffer('smplx2smpl', torch.tensor(smplx_to_smpl['matrix'][None], dtype=torch.float32))
 
         self.smplx2flame = torch.from_numpy(np.load(os.path.join(SMPL_MODEL_DIR, 'model_transfer/SMPL-X__FLAME_vertex_ids.npy'))).long()
 
@@ -453,13 +488,25 @@ class SMPLX_ALL(nn.Module):
             self.register_buffer(f'{g}_J_dirs', J_dirs)
 
 
+    def gender_groups(self, gender):
+        """ Split a batch by gender (0: male, 1: female, 2: neutral) with one stable sort.
+        Returns [(gender name, batch indices)] in male/female/neutral order and the index
+        that restores the batch order after concatenating the per-gender outputs.
+        """
+        order = torch.sort(gender, stable=True)[1]
+        counts = torch.bincount(gender.long(), minlength=len(SMPLX_GENDERS)).tolist()
+        groups, start = [], 0
+        for g, n in zip(SMPLX_GENDERS, counts):
+            if n > 0:
+                groups.append((g, order[start:start + n]))
+                start += n
+        return groups, torch.argsort(order)
+
     def forward(self, *args, **kwargs):
         batch_size = kwargs['body_pose'].shape[0]
         kwargs['get_skin'] = True
         if 'pose2rot' not in kwargs:
             kwargs['pose2rot'] = True
-        if 'gender' not in kwargs:
-            kwargs['gender'] = 2 * torch.ones(batch_size).to(kwargs['body_pose'].device)
 
         # pose for 55 joints: 1, 21, 15, 15, 1, 1, 1
         pose_keys = ['global_orient', 'body_pose', 'left_hand_pose', 'right_hand_pose', 'jaw_pose', 'leye_pose', 'reye_pose']
@@ -475,24 +522,31 @@ class SMPLX_ALL(nn.Module):
         if kwargs['body_pose'].shape[1] == 23:
             # remove hand pose in the body_pose
             kwargs['body_pose'] = kwargs['body_pose'][:, :21]
-        gender_idx_list = []
-        smplx_vertices, smplx_joints = [], []
-        for gi, g in enumerate(['male', 'female', 'neutral']):
-            gender_idx = ((kwargs['gender'] == gi).nonzero(as_tuple=True)[0])
-            if len(gender_idx) == 0:
-                continue
-            gender_idx_list.extend([int(idx) for idx in gender_idx])
-            gender_kwargs = {'get_skin': kwargs['get_skin'], 'pose2rot': kwargs['pose2rot']}
-            gender_kwargs.update({k: kwargs[k][gender_idx] for k in param_keys if k in kwargs})
-            gender_smplx_output = self.model_dict[g].forward(*args, **gender_kwargs)
-            smplx_vertices.append(gender_smplx_output.vertices)
-            smplx_joints.append(gender_smplx_output.joints)
-
-        idx_rearrange = [gender_idx_list.index(i) for i in range(len(list(gender_idx_list)))]
-        idx_rearrange = torch.tensor(idx_rearrange).long().to(kwargs['body_pose'].device)
+        model_kwargs = {'get_skin': kwargs['get_skin'], 'pose2rot': kwargs['pose2rot']}
+        model_kwargs.update({k: kwargs[k] for k in param_keys if k in kwargs})
 
-        smplx_vertices = torch.cat(smplx_vertices)[idx_rearrange]
-        smplx_joints = torch.cat(smplx_joints)[idx_rearrange]
+        if len(self.genders) == 1:
+            # single-gender config (ALL_GENDER: False): only this model exists, one fused forward
+            smplx_output = self.model_dict[self.genders[0]].forward(*args, **model_kwargs)
+            smplx_vertices, smplx_joints = smplx_output.vertices, smplx_output.joints
+        else:
+            gender = kwargs.get('gender')
+            if gender is None:
+                gender = 2 * torch.ones(batch_size, device=kwargs['body_pose'].device)
+            groups, idx_rearrange = self.gender_groups(gender)
+            if len(groups) == 1:
+                smplx_output = self.model_dict[groups[0][0]].forward(*args, **model_kwargs)
+                smplx_vertices, smplx_joints = smplx_output.vertices, smplx_output.joints
+            else:
+                smplx_vertices, smplx_joints = [], []
+                for g, gender_idx in groups:
+                    gender_kwargs = {k: (v[gender_idx] if k in param_keys else v) for k, v in model_kwargs.items()}
+                    gender_smplx_output = self.model_dict[g].forward(*args, **gender_kwargs)
+                    smplx_vertices.append(gender_smplx_output.vertices)
+                    smplx_joints.append(gender_smplx_output.joints)
+
+                smplx_vertices = torch.cat(smplx_vertices)[idx_rearrange]
+                smplx_joints = torch.cat(smplx_joints)[idx_rearrange]
 
         # constants.HAND_NAMES
         lhand_joints = smplx_joints[:, self.smplx2lh_joint_map]
@@ -503,7 +557,7 @@ class SMPLX_ALL(nn.Module):
         lfoot_joints = smplx_joints[:, self.smplx2lf_joint_map]
         rfoot_joints = smplx_joints[:, self.smplx2rf_joint_map]
 
-        smpl_vertices = torch.bmm(self.smplx2smpl.expand(batch_size, -1, -1), smplx_vertices)
+        smpl_vertices = self.smplx_to_smpl(smplx_vertices)
         lhand_vertices = smpl_vertices[:, self.smpl2lhand]
         rhand_vertices = smpl_vertices[:, self.smpl2rhand]
         extra_joints = vertices2joints(self.J_regressor_extra, smpl_vertices)
@@ -533,6 +587,13 @@ class SMPLX_ALL(nn.Module):
                              )
         return output
 
+    def smplx_to_smpl(self, smplx_vertices):
+        """ SMPL-X vertices [B, 10475, 3] -> SMPL vertices [B, 6890, 3] """
+        if self.sparse_transfer:
+            return transfer_vertices(smplx_vertices, self.smplx2smpl_idx, self.smplx2smpl_weight)
+        batch_size = smplx_vertices.shape[0]
+        return torch.bmm(self.smplx2smpl.expand(batch_size, -1, -1), smplx_vertices)
+
     def get_joints(self, smplx_vertices):
         batch_size = smplx_vertices.shape[0]
 
@@ -566,7 +627,7 @@ class SMPLX_ALL(nn.Module):
         lfoot_joints = smplx_joints[:, self.smplx2lf_joint_map]
         rfoot_joints = smplx_joints[:, self.smplx2rf_joint_map]
 
-        smpl_vertices = torch.bmm(self.smplx2smpl.expand(batch_size, -1, -1), smplx_vertices)
+        smpl_vertices = self.smplx_to_smpl(smplx_vertices)
         lhand_vertices = smpl_vertices[:, self.smpl2lhand]
         rhand_vertices = smpl_vertices[:, self.smpl2rhand]
         extra_joints = vertices2joints(self.J_regressor_extra, smpl_vertices)
@@ -623,41 +684,28 @@ class SMPLX_ALL(nn.Module):
         return torch.from_numpy(lhand_regressor).float(), torch.from_numpy(rhand_regressor).float()
 
     def get_tpose(self, betas=None, gender=None):
-        kwargs = {}
         if betas is None:
             betas = torch.zeros(1, 10).to(self.J_regressor_extra.device)
-        kwargs['betas'] = betas
 
-        batch_size = kwargs['betas'].shape[0]
-        device = kwargs['betas'].device
+        batch_size = betas.shape[0]
+        device = betas.device
+
+        if len(self.genders) == 1:
+            g = self.genders[0]
+            return getattr(self, f'{g}_J_template').unsqueeze(0) + blend_shapes(betas, getattr(self, f'{g}_J_dirs'))
 
         if gender is None:
-            kwargs['gender'] = 2 * torch.ones(batch_size).to(device)
-        else:
-            kwargs['gender'] = gender
-        
-        param_keys = ['betas']
+            gender = 2 * torch.ones(batch_size, device=device)
 
-        gender_idx_list = []
+        groups, idx_rearrange = self.gender_groups(gender)
         smplx_joints = []
-        for gi, g in enumerate(['male', 'female', 'neutral']):
-            gender_idx = ((kwargs['gender'] == gi).nonzero(as_tuple=True)[0])
-            if len(gender_idx) == 0:
-                continue
-            gender_idx_list.extend([int(idx) for idx in gender_idx])
-            gender_kwargs = {}
-            gender_kwargs.update({k: kwargs[k][gender_idx] for k in param_keys if k in kwargs})
-
-            J = getattr(self, f'{g}_J_template').unsqueeze(0) + blend_shapes(gender_kwargs['betas'], getattr(self, f'{g}_J_dirs'))
-
+        for g, gender_idx in groups:
+            J = getattr(self, f'{g}_J_template').unsqueeze(0) + blend_shapes(betas[gender_idx], getattr(self, f'{g}_J_dirs'))
             smplx_joints.append(J)
 
-        idx_rearrange = [gender_idx_list.index(i) for i in range(len(list(gender_idx_list)))]
-        idx_rearrange = torch.tensor(idx_rearrange).long().to(device)
-
-        smplx_joints = torch.cat(smplx_joints)[idx_rearrange]
-
-        return smplx_joints
+        if len(groups) == 1:
+            return smplx_joints[0]
+        return torch.cat(smplx_joints)[idx_rearrange]
 
 class MANO(MANOLayer):
     """ Extension of the official MANO implementation to support more joints """
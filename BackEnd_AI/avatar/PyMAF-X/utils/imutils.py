@@ -53,11 +53,21 @@ def transform(pt, center, scale, res, invert=0, rot=0):
     new_pt = np.dot(t, new_pt)
     return new_pt[:2].astype(int) + 1
 
+def affine_transform_pts(pts, t):
+    """Apply one 3x3 affine transform to (N, 2) or (B, N, 2) points; t may also be (B, 3, 3), one per batch item.
+    Extra columns after x, y (e.g. confidence) are ignored; returns the transformed (..., 2) coordinates.
+    """
+    pts = np.asarray(pts)
+    t = np.asarray(t)
+    return np.matmul(pts[..., :2], np.swapaxes(t[..., :2, :2], -1, -2)) + t[..., None, :2, 2]
+
 def transform_pts(coords, center, scale, res, invert=0, rot=0):
     """Transform coordinates (N x 2) to different reference."""
+    t = get_transform(center, scale, res, rot=rot)
+    if invert:
+        t = np.linalg.inv(t)
     new_coords = coords.copy()
-    for p in range(coords.shape[0]):
-        new_coords[p, 0:2] = transform(coords[p, 0:2], center, scale, res, invert, rot)
+    new_coords[:, 0:2] = affine_transform_pts(coords[:, 0:2] - 1, t).astype(int) + 1
     return new_coords
 
 def crop(img, center, scale, res, rot=0):
@@ -99,6 +109,14 @@ def crop(img, center, scale, res, rot=0):
     new_img_resized = np.array(Image.fromarray(new_img.astype(np.uint8)).resize(res))
     return new_img_resized, new_img, new_shape
 
+def crop_affine(img, center, scale, res, rot=0, interp=cv2.INTER_LINEAR):
+    """Crop and resize in a single affine warp (same box as crop(), zero padding outside the image).
+    Works on uint8 or float32 images and keeps the dtype; uses the same matrix as the keypoints (get_transform).
+    """
+    t = get_transform(center, scale, res, rot=rot)
+    return cv2.warpAffine(img, t[:2], (int(res[1]), int(res[0])), flags=interp,
+                          borderMode=cv2.BORDER_CONSTANT, borderValue=0)
+
 def uncrop(img, center, scale, orig_shape, rot=0, is_rgb=True):
     """'Undo' the image cropping/resizing.
     This function is used when evaluating mask/part segmentation.
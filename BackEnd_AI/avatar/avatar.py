@@ -14,24 +14,39 @@ Pipeline order (final):
 
 Design notes:
   - Gender forced to 'male' for measurements
-  - Measurements via PyMAF-X/core/measure_body.py::measure_full_body_from_params
-  - UMA via PyMAF-X/core/uma_converter.py::uma_from_measurements (dict-in → dict-out)
+  - Measurements via PyMAF-X/core/measure_body.py::MeasurementEngine (cached models, all images in one batch)
+  - UMA via PyMAF-X/core/uma_converter.py::uma_from_records (vectorized over all images)
   - EXIF Orientation: mode selectable: copy / inplace / off
+  - SMPLify-X runs once per user over the whole image folder; results are keyed
+    by image stem: smplifyx/results/<stem>/000.pkl
+  - Stage runners are pluggable: by default PyMAF-X / SMPLify-X are launched as
+    subprocesses; avatar_worker.py passes resident in-process runners instead.
+  - Stage results (EXIF, detection, PyMAF-X, SMPLify-X, measurements) are cached
+    under data/_avatar_cache, keyed by image bytes + checkpoint + config hashes
+    (avatar_cache.py). Unchanged images are reused across runs/users; changed
+    images or checkpoints always miss. PyMAF results are also split per image:
+    pymaf/images/<stem>/output.pkl
+  - process_user runs the stage_* functions in order on a UserRun; for many users
+    avatar_worker.py (batch / list jobs) overlaps them with avatar_pipeline.py
 """
 from __future__ import annotations
 
 import argparse
+import io
 import json
 import os
 import pickle
+import shutil
 import subprocess
 import sys
-from dataclasses import dataclass
+from dataclasses import dataclass, field, replace
 from pathlib import Path
-from typing import Any, Dict, List, Optional, Tuple
+from typing import Any, Callable, Dict, List, Optional, Tuple
 
 import numpy as np
 
+from avatar_cache import ResultCache, bytes_digest, code_digest, file_digest, make_key, path_digest
+
 # === EXIF 처리용 ===
 try:
     from PIL import Image, ImageOps
@@ -60,7 +75,29 @@ class Config:
     JSON_OUT_DIR: Path
     SMPLIFYX_OUT_DIR: Path
     PYMAF_EXTRA_ARGS: Tuple[str, ...] = ()
+    # 손/얼굴 crop·encoder·regressor 생략 (SMPLify-X 도 손/얼굴을 안 쓰고 측정은 body 만 사용)
+    PYMAF_BODY_ONLY: bool = False
     SMPLIFYX_CFG: Optional[Path] = None
+    # 사용자 이미지 전체를 한 배치로 피팅 (샘플별 수렴 마스크를 가진 batched L-BFGS)
+    SMPLIFYX_BATCH_FITTING: bool = False
+    SMPLIFYX_FIT_BATCH_SIZE: int = 8
+    # 측면 사진의 두 방향(정/180° 회전)을 동시에 피팅하고, 이 stage 이후 확연히 나쁜 쪽은 버림 (-1: 끝까지 유지)
+    SMPLIFYX_ORIENT_DROP_STAGE: int = -1
+    # PyMAF-X 의 betas/body pose/global orient/카메라에서 피팅 시작, 앞쪽(강한 prior) stage 생략
+    SMPLIFYX_WARM_START: bool = False
+    SMPLIFYX_WARM_START_SKIP_STAGES: int = 2
+    # annealing stage 별 반복 상한 (빈 tuple: 모두 fit_smplx.yaml 의 maxiters)
+    SMPLIFYX_STAGE_MAXITERS: Tuple[int, ...] = ()
+    # 수렴 검사 간격 (검사마다 GPU 동기화), 재투영 오차 plateau(px, 0: 끔)와 그 반복 창
+    SMPLIFYX_CHECK_EVERY: int = 1
+    SMPLIFYX_PLATEAU_PX: float = 0.0
+    SMPLIFYX_PLATEAU_PATIENCE: int = 5
+    # 직전 stage 의 재투영 오차가 이 값(px) 이하면 다음 stage 생략, 마지막 stage 는 항상 실행 (0: 끔)
+    SMPLIFYX_STAGE_SKIP_PX: float = 0.0
+    # 자기 관통(interpenetration) 항. GPU 가 없으면 mesh_intersection 의 CPU BVH 백엔드로 계산
+    SMPLIFYX_INTERPENETRATION: bool = False
+    # stage 결과 content-addressed 캐시 위치 (None: 캐시 끔)
+    CACHE_DIR: Optional[Path] = None
 
 
 DEFAULTS = Config(
@@ -74,7 +111,18 @@ DEFAULTS = Config(
     JSON_OUT_DIR=BASE_DIR / "_will_be_overridden",
     SMPLIFYX_OUT_DIR=BASE_DIR / "_will_be_overridden",
     PYMAF_EXTRA_ARGS=(),
+    # body-only 는 손목·팔꿈치·얼굴 보정이 빠져 body 출력이 달라짐 → --compare_full_body 로 차이를 확인하기 전까지 끔
+    PYMAF_BODY_ONLY=False,
     SMPLIFYX_CFG=AVATAR_DIR / "smplify-x" / "cfg_files" / "fit_smplx.yaml",
+    # batch 피팅은 fit_smplx.yaml 의 lbfgsls 대신 batch_lbfgs 를 써서 결과가 달라짐 → 비교 전까지 끔
+    SMPLIFYX_BATCH_FITTING=False,
+    SMPLIFYX_FIT_BATCH_SIZE=8,
+    # 나쁜 방향을 일찍 버리면 가끔 최종 선택이 달라짐 → 기본은 끝까지 둘 다 피팅
+    SMPLIFYX_ORIENT_DROP_STAGE=-1,
+    # warm start 는 초기값과 건너뛰는 stage 가 달라 결과가 바뀜 (뒤집힌 방향 피팅도 꺼짐) → 필요할 때만 켬
+    SMPLIFYX_WARM_START=False,
+    SMPLIFYX_WARM_START_SKIP_STAGES=0,
+    CACHE_DIR=DATA_ROOT / "_avatar_cache",  # 사용자 간 공유 (같은 사진이면 재사용)
 )
 
 # =========================
@@ -86,11 +134,47 @@ def run(cmd: List[str], cwd: Optional[Path] = None) -> None:
     subprocess.run(cmd, cwd=str(cwd) if cwd else None, check=True)
 
 
+def as_cli_args(kwargs: Dict[str, Any]) -> List[str]:
+    """{'output_folder': p} → ['--output_folder', 'p'] (runner kwargs ↔ subprocess argv 공용)"""
+    out: List[str] = []
+    for k, v in kwargs.items():
+        out += [f"--{k}", str(v)]
+    return out
+
+
 def ensure_dir(p: Path) -> Path:
     p.mkdir(parents=True, exist_ok=True)
     return p
 
 
+def open_cache(cfg: Config) -> Optional[ResultCache]:
+    return ResultCache(cfg.CACHE_DIR) if cfg.CACHE_DIR else None
+
+
+def stage_files(files: List[Path], dst_dir: Path) -> Path:
+    """files 만 담긴 폴더를 새로 만듦 (하드링크, 안 되면 복사). 폴더 단위 러너에 일부 파일만 넘길 때 사용."""
+    if dst_dir.exists():
+        shutil.rmtree(dst_dir)
+    ensure_dir(dst_dir)
+    for f in files:
+        try:
+            os.link(f, dst_dir / f.name)
+        except OSError:
+            shutil.copy2(f, dst_dir / f.name)
+    return dst_dir
+
+
+def write_bytes_atomic(path: Path, data: bytes) -> None:
+    tmp_path = path.with_suffix(path.suffix + ".tmp")
+    try:
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)  # 원자적 교체
+    finally:
+        if tmp_path.exists():
+            tmp_path.unlink()
+
+
 def to_list(x: Any) -> List[float]:
     if x is None:
         return []
@@ -113,25 +197,51 @@ def to_joints2d_list(arr: Any) -> List[List[float]]:
 
 IMG_EXTS = {".jpg", ".jpeg", ".png", ".bmp"}
 
-def _save_with_same_suffix(im: "Image.Image", out_path: Path) -> None:
-    suffix = out_path.suffix.lower()
-    if suffix in {".jpg", ".jpeg"}:
-        if im.mode not in ("RGB", "L"):
-            im = im.convert("RGB")
-        im.save(out_path, format="JPEG", quality=95, optimize=True)
-    elif suffix == ".png":
-        im.save(out_path, format="PNG", optimize=True)
-    elif suffix == ".bmp":
-        im.save(out_path, format="BMP")
-    else:
-        out_path = out_path.with_suffix(".png")
-        im.save(out_path, format="PNG", optimize=True)
+_PIL_FORMATS = {".jpg": "JPEG", ".jpeg": "JPEG", ".png": "PNG", ".bmp": "BMP"}
+
+def _exif_normalized_bytes(p: Path) -> bytes:
+    """
+    EXIF Orientation 을 픽셀에 반영하고 같은 포맷으로 다시 인코딩한 바이트.
+    저장 시 EXIF(특히 ORIENTATION) 제거 → 재실행해도 추가 회전 없음
+    """
+    fmt = _PIL_FORMATS[p.suffix.lower()]
+    with Image.open(p) as im:
+        im = ImageOps.exif_transpose(im)
+        buf = io.BytesIO()
+        if fmt == "JPEG":
+            if im.mode not in ("RGB", "L"):
+                im = im.convert("RGB")
+            im.save(buf, format=fmt, quality=95, optimize=True)
+        elif fmt == "PNG":
+            im.save(buf, format=fmt, optimize=True)
+        else:
+            im.save(buf, format=fmt)
+    return buf.getvalue()
 
-def normalize_images_with_exif(image_folder: Path, mode: str = "copy") -> Path:
+def _exif_normalize(p: Path, cache: Optional[ResultCache]) -> Tuple[bytes, bytes]:
+    """
+    (원본 바이트, 정규화 바이트). 원본 내용 해시로 캐시하고, 정규화 결과 자신도 '이미 정규화됨' 으로
+    등록해 두어 inplace 재실행 시 JPEG 를 다시 인코딩(화질 열화)하지 않음.
+    """
+    src = p.read_bytes()
+    key = make_key("exif", bytes_digest(src))
+    hit = cache.get("exif", key) if cache is not None else None
+    if hit is not None:
+        return src, (src if hit["data"] is None else hit["data"])
+
+    data = _exif_normalized_bytes(p)
+    if cache is not None:
+        cache.put("exif", key, {"data": data})
+        cache.put("exif", make_key("exif", bytes_digest(data)), {"data": None})
+    return src, data
+
+def normalize_images_with_exif(image_folder: Path, mode: str = "copy",
+                               cache: Optional[ResultCache] = None) -> Path:
     """
     mode='copy'   : <image_folder>_exifnorm 폴더에 정규화된 이미지를 복사 저장
     mode='inplace': 원본 파일을 안전하게 덮어쓰기 (tmp에 저장 후 원자적 교체)
     mode='off'    : 아무것도 하지 않음 (호출부에서 분기)
+    파일명이 아닌 내용으로 판단: 사진이 바뀌면 항상 다시 정규화, 같은 내용이면 캐시 재사용.
     """
     if not _PIL_AVAILABLE:
         print("[EXIF] Pillow가 없어 EXIF 정규화를 건너뜁니다.")
@@ -147,17 +257,19 @@ def normalize_images_with_exif(image_folder: Path, mode: str = "copy") -> Path:
         out_dir = image_folder.parent / f"{image_folder.name}_exifnorm"
         ensure_dir(out_dir)
 
-        # 이미 동일 파일명이 모두 있으면 재처리 생략
-        if all((out_dir / p.name).exists() for p in images):
-            print(f"[EXIF] Found normalized folder: {out_dir}. Using it.")
-            return out_dir
+        # 원본에서 사라진 사진이 이후 stage 에 섞이지 않도록 정리
+        names = {p.name for p in images}
+        for q in out_dir.iterdir():
+            if q.is_file() and q.suffix.lower() in IMG_EXTS and q.name not in names:
+                q.unlink()
 
         print(f"[EXIF] Normalizing {len(images)} images → {out_dir}")
         for p in images:
+            out_path = out_dir / p.name
             try:
-                with Image.open(p) as im:
-                    im = ImageOps.exif_transpose(im)
-                    _save_with_same_suffix(im, out_dir / p.name)
+                _, data = _exif_normalize(p, cache)
+                if not (out_path.exists() and out_path.read_bytes() == data):
+                    write_bytes_atomic(out_path, data)
             except Exception as e:
                 print(f"[EXIF][warn] {p.name}: {e}. 건너뜀.")
         return out_dir
@@ -165,29 +277,11 @@ def normalize_images_with_exif(image_folder: Path, mode: str = "copy") -> Path:
     if mode == "inplace":
         print(f"[EXIF] In-place normalizing {len(images)} images in {image_folder}")
         for p in images:
-            tmp_path = p.with_suffix(p.suffix + ".tmp")
             try:
-                with Image.open(p) as im:
-                    im = ImageOps.exif_transpose(im)
-                    # 저장 시 EXIF(특히 ORIENTATION) 제거 → 재실행해도 추가 회전 없음
-                    if p.suffix.lower() in {".jpg", ".jpeg"}:
-                        if im.mode not in ("RGB", "L"):
-                            im = im.convert("RGB")
-                        im.save(tmp_path, format="JPEG", quality=95, optimize=True)
-                    elif p.suffix.lower() == ".png":
-                        im.save(tmp_path, format="PNG", optimize=True)
-                    elif p.suffix.lower() == ".bmp":
-                        im.save(tmp_path, format="BMP")
-                    else:
-                        print(f"[EXIF][skip] unsupported ext: {p.name}")
-                        continue
-                os.replace(tmp_path, p)  # 원자적 교체
+                src, data = _exif_normalize(p, cache)
+                if data != src:
+                    write_bytes_atomic(p, data)
             except Exception as e:
-                try:
-                    if tmp_path.exists():
-                        tmp_path.unlink()
-                except Exception:
-                    pass
                 print(f"[EXIF][warn] {p.name}: {e}. 건너뜀.")
         return image_folder
 
@@ -198,25 +292,214 @@ def normalize_images_with_exif(image_folder: Path, mode: str = "copy") -> Path:
 # PyMAF-X → PKL
 # =========================
 
-def run_pymaf_on_folder(cfg: Config, image_folder: Path, force: bool = False) -> Path:
-    out_dir = ensure_dir(cfg.PYMAF_OUT_DIR)
-    existing = list(out_dir.glob("**/*.pkl"))
-    if existing and not force:
-        print(f"[PyMAF] Found existing {len(existing)} PKLs under {out_dir}. Skipping run.")
-        return out_dir
+PYMAF_IMG_EXTS = (".png", ".jpg", ".jpeg")  # run_pymaf.py 가 읽는 확장자
+
+def pymaf_cfg_file(cfg: Config) -> Path:
+    return cfg.PYMAF_X_DIR / "configs" / "pymafx_config.yaml"
 
-    cmd = [
-        sys.executable,
-        str(cfg.PYMAF_DEMO),
-        "--image_folder", str(image_folder),
-        "--output_folder", str(out_dir),
-        "--cfg_file", str(cfg.PYMAF_X_DIR / "configs" / "pymafx_config.yaml"),
-        "--pretrained_model", str(cfg.PYMAF_X_DIR / "data" / "pretrained_model" / "PyMAF-X_model_checkpoint_v1.1.pt"),
+
+def pymaf_checkpoint(cfg: Config) -> Path:
+    return cfg.PYMAF_X_DIR / "data" / "pretrained_model" / "PyMAF-X_model_checkpoint_v1.1.pt"
+
+
+def pymaf_model_args(cfg: Config) -> List[str]:
+    """모델/체크포인트 관련 인자 (폴더와 무관 → 상주 러너 초기화에도 사용)"""
+    args = [
+        "--cfg_file", str(pymaf_cfg_file(cfg)),
+        "--pretrained_model", str(pymaf_checkpoint(cfg)),
     ]
+    if cfg.PYMAF_BODY_ONLY:
+        args.append("--body_only")
     if cfg.PYMAF_EXTRA_ARGS:
-        cmd += list(cfg.PYMAF_EXTRA_ARGS)
+        args += list(cfg.PYMAF_EXTRA_ARGS)
+    return args
+
+
+def detection_cache_config(cfg: Config) -> Dict[str, Any]:
+    """OpenPifPaf 검출 결과에 영향을 주는 설정 (검출기 체크포인트/threshold 는 추가 인자로만 바뀜)"""
+    return {"extra_args": list(cfg.PYMAF_EXTRA_ARGS)}
+
+
+def pymaf_cache_config(cfg: Config) -> Dict[str, Any]:
+    """PyMAF-X 결과에 영향을 주는 것: 체크포인트/설정/SMPL 모델 내용 + 추론 코드 + 추가 인자"""
+    root = cfg.PYMAF_X_DIR
+    return {
+        "cfg_file": path_digest(pymaf_cfg_file(cfg)),
+        "checkpoint": path_digest(pymaf_checkpoint(cfg)),
+        "models": path_digest(cfg.MODEL_DIR),
+        "body_only": cfg.PYMAF_BODY_ONLY,
+        # crop/배치 로더/출력 형식이 바뀌면 이전 결과는 다시 계산
+        "code": code_digest(root / "models", root / "datasets" / "inference.py",
+                            root / "datasets" / "inference_loader.py", root / "utils" / "imutils.py",
+                            root / "apps" / "run_pymaf.py"),
+        "extra_args": list(cfg.PYMAF_EXTRA_ARGS),
+    }
+
+
+def pymaf_image_dir(pymaf_out_dir: Path, image_path: Path) -> Path:
+    return pymaf_out_dir / "images" / image_path.stem
+
+
+def _take_rows(value: Any, rows: List[int], n: int) -> Any:
+    """사람 축(길이 n)을 가진 값이면 rows 만 골라냄 (list / ndarray / tensor 공용)"""
+    if isinstance(value, list) and len(value) == n:
+        return [value[i] for i in rows]
+    shape = getattr(value, "shape", None)
+    if shape is not None and len(shape) > 0 and shape[0] == n:
+        return value[rows]
+    return value
+
+
+def split_pymaf_results(results: Dict[str, Any], det_results: Dict[str, Any],
+                        stems: List[str]) -> Dict[str, Tuple[Dict[str, Any], Dict[str, Any]]]:
+    """
+    폴더 단위 output.pkl / pp_det_results.pkl 을 이미지(stem)별 (pymaf, detection) 으로 나눔.
+    run_pymaf 의 person_id 는 '<stem>_f<frame>_p<pid>'. 사람이 없는 이미지는 person_ids 가 빈 결과.
+    """
+    def stem_of(person_id: str) -> str:
+        return str(person_id).rsplit("_f", 1)[0]
+
+    person_ids = list(results.get("person_ids", []))
+    n = len(person_ids)
+
+    # smplx_params 는 DataLoader 배치별 dict 목록 → 사람별 dict 목록으로 펼쳐서 나눔
+    flat = dict(results)
+    per_person = []
+    for batch in results.get("smplx_params", []):
+        size = len(next(iter(batch.values())))
+        per_person += [{k: v[j:j + 1] for k, v in batch.items()} for j in range(size)]
+    if len(per_person) == n:
+        flat["smplx_params"] = per_person
+
+    out = {}
+    for stem in stems:
+        rows = [i for i, pid in enumerate(person_ids) if stem_of(pid) == stem]
+        pymaf = {k: _take_rows(v, rows, n) for k, v in flat.items()}
+        det = {pid: v for pid, v in det_results.items() if stem_of(pid) == stem}
+        out[stem] = (pymaf, det)
+    return out
+
+
+def write_pymaf_per_image(pymaf_out_dir: Path, images: List[Path],
+                          per_image: Dict[str, Dict[str, Any]]) -> None:
+    """pymaf/images/<stem>/output.pkl 작성. 사람이 없으면 이전 결과를 지워 재사용되지 않게 함."""
+    for img in images:
+        pkl_path = pymaf_image_dir(pymaf_out_dir, img) / "output.pkl"
+        result = per_image.get(img.stem)
+        if result is None or not len(result.get("person_ids", [])):
+            if pkl_path.exists():
+                pkl_path.unlink()
+            continue
+        ensure_dir(pkl_path.parent)
+        with open(pkl_path, "wb") as f:
+            pickle.dump(result, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def _launch_pymaf(cfg: Config, image_folder: Path, out_dir: Path,
+                  runner: Optional[Callable[..., Any]],
+                  sidecar_dir: Optional[Path] = None,
+                  known_detections: Optional[Path] = None) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    """폴더 하나에 PyMAF-X 실행 → (output.pkl, pp_det_results.pkl) 내용"""
+    folders = {"image_folder": str(image_folder), "output_folder": str(out_dir)}
+    if sidecar_dir is not None:
+        folders["sidecar_dir"] = str(sidecar_dir)
+    if known_detections is not None:
+        folders["known_detections"] = str(known_detections)
+    if runner is not None:
+        runner(**folders)
+    else:
+        cmd = [sys.executable, str(cfg.PYMAF_DEMO)] + as_cli_args(folders) + pymaf_model_args(cfg)
+        run(cmd, cwd=cfg.PYMAF_X_DIR)
+    det_path = out_dir / "pp_det_results.pkl"
+    det = load_pymaf_pkl(det_path) if det_path.exists() else {}
+    return load_pymaf_pkl(out_dir / "output.pkl"), det
 
-    run(cmd, cwd=cfg.PYMAF_X_DIR)
+
+def sidecar_files(sidecar_dir: Optional[Path], images: List[Path]) -> Dict[str, Path]:
+    """이미지별 클라이언트 검출 정보 <stem>.json (bbox/keypoints) → {stem: path}. 없는 이미지는 빠짐."""
+    if sidecar_dir is None:
+        return {}
+    found = {p.stem: sidecar_dir / f"{p.stem}.json" for p in images}
+    return {stem: f for stem, f in found.items() if f.is_file()}
+
+
+def run_pymaf_on_folder(cfg: Config, image_folder: Path, force: bool = False,
+                        runner: Optional[Callable[..., Any]] = None,
+                        cache: Optional[ResultCache] = None,
+                        sidecar_dir: Optional[Path] = None) -> Path:
+    """
+    runner=None  : run_pymaf.py 를 subprocess 로 실행
+    runner=func  : func(image_folder=..., output_folder=...) 호출 (상주 PyMAFRunner.run)
+    cache        : 이미지 내용 + 체크포인트 + 설정 해시로 이미지별 결과를 재사용. 캐시에 없는 이미지만
+                   임시 폴더에 모아 한 번 실행. cache=None 이면 PKL 존재 여부로만 판단(이전 동작).
+                   검출 결과는 따로 캐시 → PyMAF-X 설정만 바뀐 이미지는 검출을 건너뜀 (run_pymaf --known_detections).
+    sidecar_dir  : <stem>.json 에 클라이언트가 준 bbox/keypoints 가 있으면 그 이미지는 사람 검출을
+                   건너뜀 (run_pymaf --sidecar_dir). 사이드카 내용도 캐시 키에 들어감.
+    결과는 이미지별로 나눠 pymaf/images/<stem>/output.pkl 에 씀.
+    """
+    out_dir = ensure_dir(cfg.PYMAF_OUT_DIR)
+    images = sorted(p for p in image_folder.iterdir()
+                    if p.is_file() and p.suffix.lower() in PYMAF_IMG_EXTS)
+
+    if cache is None:
+        existing = list(out_dir.glob("**/*.pkl"))
+        if existing and not force:
+            print(f"[PyMAF] Found existing {len(existing)} PKLs under {out_dir}. Skipping run.")
+            return out_dir
+        results, det = _launch_pymaf(cfg, image_folder, out_dir, runner,
+                                     sidecar_dir if sidecar_files(sidecar_dir, images) else None)
+        split = split_pymaf_results(results, det, [p.stem for p in images])
+        write_pymaf_per_image(out_dir, images, {stem: pymaf for stem, (pymaf, _) in split.items()})
+        return out_dir
+
+    # 사이드카가 있는 이미지는 (이미지, 사이드카) 내용 쌍이 입력
+    sidecars = sidecar_files(sidecar_dir, images)
+    digests = {p.stem: file_digest(p) for p in images}
+    for stem, f in sidecars.items():
+        digests[stem] = f"{digests[stem]}+{file_digest(f)}"
+    pymaf_config = pymaf_cache_config(cfg)
+    keys = {stem: make_key("pymaf", d, pymaf_config) for stem, d in digests.items()}
+    det_config = detection_cache_config(cfg)
+    det_keys = {stem: make_key("detection", d, det_config) for stem, d in digests.items()}
+
+    per_image: Dict[str, Dict[str, Any]] = {}
+    if not force:
+        for p in images:
+            hit = cache.get("pymaf", keys[p.stem])
+            if hit is not None:
+                per_image[p.stem] = hit
+
+    pending = [p for p in images if p.stem not in per_image]
+    print(f"[PyMAF] {len(images) - len(pending)}/{len(images)} images cached; running {len(pending)}")
+    if pending:
+        known: Dict[str, Dict[str, Any]] = {}
+        if not force:
+            for p in pending:
+                det_rows = cache.get("detection", det_keys[p.stem])
+                if det_rows is not None:
+                    known[p.name] = det_rows
+        if known:
+            print(f"[PyMAF] detection cached for {len(known)}/{len(pending)} images")
+
+        stage_dir = out_dir / "_pending"
+        pending_sidecars = [sidecars[p.stem] for p in pending if p.stem in sidecars]
+        image_dir = stage_files(pending, stage_dir / "images")
+        known_path = None
+        if known:
+            known_path = stage_dir / "known_detections.pkl"
+            with open(known_path, "wb") as f:
+                pickle.dump(known, f, protocol=pickle.HIGHEST_PROTOCOL)
+        results, det = _launch_pymaf(cfg, image_dir, stage_dir, runner,
+                                     stage_files(pending_sidecars, stage_dir / "sidecars") if pending_sidecars else None,
+                                     known_path)
+        detected = {p.stem for p in pending if p.name not in known}
+        for stem, (pymaf, det_rows) in split_pymaf_results(results, det, [p.stem for p in pending]).items():
+            if stem in detected:
+                cache.put("detection", det_keys[stem], det_rows)
+            cache.put("pymaf", keys[stem], pymaf)
+            per_image[stem] = pymaf
+
+    write_pymaf_per_image(out_dir, images, per_image)
     return out_dir
 
 # =========================
@@ -225,9 +508,14 @@ def run_pymaf_on_folder(cfg: Config, image_folder: Path, force: bool = False) ->
 
 def find_pkl_for_image(pymaf_out_dir: Path, image_path: Path) -> Optional[Path]:
     """Locate PyMAF results.
-    demo_smplx_test.py writes a *batch* file: <out>/<image_folder_name>/output.pkl.
-    Fallback to older per-image patterns if needed.
+    run_pymaf_on_folder splits results per image: <out>/images/<stem>/output.pkl.
+    If that layout exists it is authoritative (no file = no person detected).
+    Otherwise fall back to the batch / older per-image patterns.
     """
+    if (pymaf_out_dir / "images").is_dir():
+        pkl = pymaf_image_dir(pymaf_out_dir, image_path) / "output.pkl"
+        return pkl if pkl.exists() else None
+
     # 1) Batch-style output.pkl under a subfolder named after the input_folder
     batch_pkl = pymaf_out_dir / image_path.parent.name / "output.pkl"
     if batch_pkl.exists():
@@ -254,13 +542,14 @@ def load_pymaf_pkl(pkl_path: Path) -> Dict[str, Any]:
         return joblib.load(pkl_path)
 
 
-def extract_pymaf_fields(raw: Dict[str, Any]) -> Dict[str, Any]:
+def extract_pymaf_fields(raw: Dict[str, Any], person: int = 0) -> Dict[str, Any]:
     def get_first(arr_like):
+        # 사람 축이 있는 값([N, ...])은 항상 person 번째. 사람이 1 명이어도 축을 벗겨냄
         if arr_like is None:
             return None
         a = np.asarray(arr_like)
-        if a.ndim >= 1 and a.shape[0] > 1:
-            return a[0]
+        if a.ndim >= 2:
+            return a[person]
         return a
 
     pymaf: Dict[str, Any] = {}
@@ -308,7 +597,51 @@ def extract_pymaf_fields(raw: Dict[str, Any]) -> Dict[str, Any]:
     if betas is not None:
         pymaf["betas"] = to_list(betas)
 
-    return {"pymaf": pymaf, "gender": gender}
+    # SMPLify-X 입력 keypoints (OpenPose 배치). 통합 JSON 에는 쓰지 않음
+    wholebody = raw.get("keypoints2d_wholebody")
+    if wholebody is not None:
+        openpose = wholebody_to_openpose(get_first(wholebody))
+    elif "joints2d" in pymaf:
+        openpose = wholebody_to_openpose(pymaf["joints2d"])  # 이전 결과: COCO 17 관절만
+    else:
+        openpose = None
+    init = pymaf_smplx_init(raw, person)
+    if openpose is not None and init is not None:
+        openpose["smplx_init"] = init
+
+    return {"pymaf": pymaf, "gender": gender, "openpose": openpose}
+
+def _as_numpy(x: Any) -> np.ndarray:
+    """torch tensor(GPU 포함) / list / ndarray → ndarray"""
+    if hasattr(x, "detach"):
+        x = x.detach().cpu().numpy()
+    return np.asarray(x)
+
+
+def pymaf_smplx_init(raw: Dict[str, Any], person: int = 0) -> Optional[Dict[str, List[float]]]:
+    """
+    SMPLify-X warm start 값 (smplifyx fitting.warm_start_init 형식):
+    betas, global_orient/body_pose (axis-angle, SMPL-X body 21 관절), camera_translation (focal 5000,
+    주점 = 이미지 중심 — run_pymaf 의 orig_cam_t 와 SMPLify-X 카메라가 같은 규약).
+    smplx_params 의 body_pose 는 회전행렬 [24, 3, 3] (0: global orient, 1..21: body).
+    """
+    params = raw.get("smplx_params")
+    betas, cam_t = raw.get("betas"), raw.get("orig_cam_t")
+    if not params or betas is None or cam_t is None or person >= len(params):
+        return None
+    rotmat = _as_numpy(params[person]["body_pose"]).reshape(-1, 3, 3)
+    if rotmat.shape[0] < 22:
+        return None
+    from scipy.spatial.transform import Rotation
+    aa = Rotation.from_matrix(rotmat[:22].astype(np.float64)).as_rotvec()
+    return {
+        "betas": to_list(_as_numpy(betas)[person]),
+        "global_orient": to_list(aa[0]),
+        "body_pose": to_list(aa[1:22]),
+        "camera_translation": to_list(_as_numpy(cam_t)[person]),
+        "focal_length": 5000.0,
+    }
+
 
 def write_unified_json(json_out: Path, image_path: Path, extracted: Dict[str, Any],
                        measurements: Optional[Dict[str, Any]] = None,
@@ -333,35 +666,65 @@ def write_unified_json(json_out: Path, image_path: Path, extracted: Dict[str, An
     with open(json_out, "w", encoding="utf-8") as f:
         json.dump(data, f, ensure_ascii=False, indent=2)
 
-def write_openpose_like(json_path: Path, joints2d, image_w: Optional[int] = None, image_h: Optional[int] = None) -> None:
+# OpenPose BODY_25 슬롯 ← COCO-WholeBody 인덱스. Neck(1)/MidHip(8) 은 어깨/엉덩이 중점으로 만듦
+WHOLEBODY_TO_BODY25 = np.array([
+    0, -1, 6, 8, 10, 5, 7, 9,      # Nose, Neck, R/L 어깨·팔꿈치·손목
+    -1, 12, 14, 16, 11, 13, 15,    # MidHip, R/L 엉덩이·무릎·발목
+    2, 1, 4, 3,                    # REye, LEye, REar, LEar
+    17, 18, 19, 20, 21, 22,        # L 엄지발가락·새끼발가락·뒤꿈치, R 동일
+])
+_BODY25_MIDPOINTS = {1: (5, 6), 8: (11, 12)}
+
+
+def wholebody_to_openpose(keypoints: Any) -> Optional[Dict[str, np.ndarray]]:
     """
-    PyMAF joints2d (보통 COCO-17)를 그대로 앞 17개 채우고,
-    BODY_25 슬롯(25개)으로 0 패딩해서 OpenPose-like JSON 저장.
+    COCO-WholeBody keypoints (133×3, 앞 17 개만 있는 COCO 도 허용) → OpenPose 사람 항목
+    {pose_keypoints_2d: 25×3 (BODY_25), hand_left/right_keypoints_2d: 21×3, face_keypoints_2d: 70×3}.
+    손(손목+손가락 4×5)과 얼굴 68 점은 OpenPose 와 순서가 같음 (얼굴 pupil 2 점은 0).
+    보이는 점이 하나도 없으면 None.
     """
-    import numpy as np, json
-    arr = np.asarray(joints2d, dtype=float)
+    if keypoints is None:
+        return None
+    kps = np.asarray(keypoints, dtype=np.float32)
+    if kps.ndim != 2 or kps.shape[0] < 17:
+        return None
+    if kps.shape[1] < 3:
+        kps = np.concatenate([kps[:, :2], np.ones((kps.shape[0], 1), np.float32)], axis=1)
+    wb = np.zeros((133, 3), dtype=np.float32)
+    n = min(133, kps.shape[0])
+    wb[:n] = kps[:n, :3]
+    if not (wb[:, 2] > 0).any():
+        return None
 
-    if arr.ndim == 3:
-        arr = arr[0]
-    if arr.shape[1] < 3:
-        conf = np.ones((arr.shape[0], 1), dtype=float)
-        arr = np.concatenate([arr[:, :2], conf], axis=1)
-    else:
-        arr = arr[:, :3]
+    body = wb[np.maximum(WHOLEBODY_TO_BODY25, 0)]
+    for slot, (a, b) in _BODY25_MIDPOINTS.items():
+        conf = min(wb[a, 2], wb[b, 2])
+        body[slot] = [*((wb[a, :2] + wb[b, :2]) / 2), conf] if conf > 0 else 0.0
+    face = np.zeros((70, 3), dtype=np.float32)
+    face[:68] = wb[23:91]
+    return {
+        "pose_keypoints_2d": body,
+        "hand_left_keypoints_2d": wb[91:112].copy(),
+        "hand_right_keypoints_2d": wb[112:133].copy(),
+        "face_keypoints_2d": face,
+    }
 
-    keypoints_25 = np.zeros((25, 3), dtype=float)
-    n = min(17, arr.shape[0])
-    keypoints_25[:n] = arr[:n]
 
-    flat = keypoints_25.reshape(-1).astype(float).tolist()
+def write_openpose_like(json_path: Path, person: Any, image_w: Optional[int] = None, image_h: Optional[int] = None) -> None:
+    """
+    OpenPose 사람 항목(wholebody_to_openpose 결과)을 OpenPose-like JSON 으로 저장.
+    keypoints 배열(COCO 17 / COCO-WholeBody 133)을 넘기면 먼저 BODY_25 로 매핑.
+    """
+    if not isinstance(person, dict):
+        arr = np.asarray(person, dtype=np.float32)
+        person = wholebody_to_openpose(arr[0] if arr.ndim == 3 else arr)
+    flat = {k: v if isinstance(v, dict) else np.asarray(v, dtype=float).reshape(-1).tolist()
+            for k, v in person.items()}
 
     content = {
         "version": 1.2,
         "people": [{
-            "pose_keypoints_2d": flat,
-            "hand_left_keypoints_2d": [],
-            "hand_right_keypoints_2d": [],
-            "face_keypoints_2d": [],
+            **flat,
             "image_w": int(image_w) if image_w is not None else None,
             "image_h": int(image_h) if image_h is not None else None,
         }],
@@ -374,104 +737,225 @@ def write_openpose_like(json_path: Path, joints2d, image_w: Optional[int] = None
 # Measurements (via PyMAF-X/core/measure_body.py)
 # =========================
 
-def compute_measurements_from_sources(cfg: Config, extracted: Dict[str, Any], refined: Optional[Dict[str, Any]], target_height_cm: Optional[float] = None) -> Optional[Dict[str, Any]]:
-    """
-    측정은 항상 '마지막'에 실행. SMPLify-X refined betas가 있으면 그걸 우선 사용하고,
-    없으면 PyMAF betas로 측정.
-    """
-    try:
-        if str(cfg.PYMAF_X_DIR) not in sys.path:
-            sys.path.insert(0, str(cfg.PYMAF_X_DIR))
-        from core.measure_body import measure_full_body_from_params  # type: ignore
-    except Exception as e:
-        print(f"[measure] import failed: {e}")
-        return None
-
+def select_measurement_betas(extracted: Dict[str, Any], refined: Optional[Dict[str, Any]]) -> Optional[List[float]]:
+    """SMPLify-X refined betas 우선, 없으면 PyMAF betas"""
     betas = None
     if refined and isinstance(refined.get("betas"), (list, tuple)):
         betas = refined["betas"]
     if betas is None:
         betas = extracted.get("pymaf", {}).get("betas")
+    return betas or None
+
+def measure_cache_config(cfg: Config) -> Dict[str, Any]:
+    """측정값에 영향을 주는 것: 측정 gender, SMPL-X 모델, 측정 코드"""
+    core = cfg.PYMAF_X_DIR / "core"
+    return {
+        "gender": "male",
+        "models": path_digest(cfg.MODEL_DIR),
+        "code": [path_digest(core / "measure_body.py"), path_digest(core / "utils_geometry.py")],
+    }
 
+def compute_measurements_batch(cfg: Config, sources: List[Tuple[Dict[str, Any], Optional[Dict[str, Any]]]],
+                               target_height_cm: Optional[float] = None,
+                               cache: Optional[ResultCache] = None) -> List[Optional[Dict[str, Any]]]:
+    """
+    (extracted, refined) 목록을 한 번에 측정. 모델은 프로세스 당 한 번만 로드(MeasurementEngine 캐시)하고
+    betas 를 모아 T/A-pose 배치 forward 한 번으로 처리. betas 가 없는 항목은 None.
+    cache 가 있으면 (betas, target_height_cm) 이 같은 항목은 다시 측정하지 않음.
+    """
+    results: List[Optional[Dict[str, Any]]] = [None] * len(sources)
+
+    idxs, betas, keys = [], [], []
+    config = measure_cache_config(cfg) if cache is not None else None
+    for i, (extracted, refined) in enumerate(sources):
+        b = select_measurement_betas(extracted, refined)
+        if b is None:
+            print("[measure] betas not found in refined or pymaf; cannot compute measurements")
+            continue
+        key = None
+        if cache is not None:
+            key = make_key("measure", [float(x) for x in b], target_height_cm, config)
+            hit = cache.get("measure", key)
+            if hit is not None:
+                results[i] = hit
+                continue
+        idxs.append(i)
+        betas.append(b)
+        keys.append(key)
     if not betas:
-        print("[measure] betas not found in refined or pymaf; cannot compute measurements")
-        return None
+        return results
 
-    params = {"betas": betas}
-    smplx_model_path = str(cfg.MODEL_DIR)
     try:
-        result = measure_full_body_from_params(
-            params,
-            smplx_model_path=smplx_model_path,
-            gender="male",
-            target_height_cm=target_height_cm
-        )
-        return result if isinstance(result, dict) else None
+        if str(cfg.PYMAF_X_DIR) not in sys.path:
+            sys.path.insert(0, str(cfg.PYMAF_X_DIR))
+        from core.measure_body import get_measurement_engine  # type: ignore
     except Exception as e:
-        print(f"[measure] measure_full_body_from_params failed: {e}")
-        return None
+        print(f"[measure] import failed: {e}")
+        return results
 
-def compute_uma_from_measurements(cfg: Config, measurements: Dict[str, Any]) -> Optional[Dict[str, float]]:
+    try:
+        engine = get_measurement_engine(str(cfg.MODEL_DIR))
+        measured = engine.measure_batch(betas, gender="male", target_height_cm=target_height_cm)
+    except Exception as e:
+        print(f"[measure] batch measurement failed: {e}")
+        return results
+
+    for i, key, m in zip(idxs, keys, measured):
+        results[i] = m if isinstance(m, dict) else None
+        if cache is not None and results[i] is not None:
+            cache.put("measure", key, results[i])
+    return results
+
+def compute_measurements_from_sources(cfg: Config, extracted: Dict[str, Any], refined: Optional[Dict[str, Any]], target_height_cm: Optional[float] = None) -> Optional[Dict[str, Any]]:
     """
-    measure_body 결과(measurements)로 UMA만 계산해서 반환.
+    측정은 항상 '마지막'에 실행. SMPLify-X refined betas가 있으면 그걸 우선 사용하고,
+    없으면 PyMAF betas로 측정.
+    """
+    return compute_measurements_batch(cfg, [(extracted, refined)], target_height_cm)[0]
+
+def compute_uma_batch(cfg: Config, measurements_list: List[Optional[Dict[str, Any]]]) -> List[Optional[Dict[str, float]]]:
+    """
+    측정 결과 목록 → UMA 목록 (uma_converter 의 벡터화 API 로 한 번에 계산). 측정이 없는 항목은 None.
     """
+    results: List[Optional[Dict[str, float]]] = [None] * len(measurements_list)
     try:
         if str(cfg.PYMAF_X_DIR) not in sys.path:
             sys.path.insert(0, str(cfg.PYMAF_X_DIR))
-        from core.uma_converter import uma_from_measurements  # type: ignore
+        from core.uma_converter import uma_from_records  # type: ignore
     except Exception as e:
         print(f"[UMA] import failed: {e}")
-        return None
+        return results
 
+    idxs = [i for i, m in enumerate(measurements_list) if isinstance(m, dict)]
     try:
-        return uma_from_measurements(measurements)  # 딕셔너리 그대로 전달
+        umas = uma_from_records([measurements_list[i] for i in idxs])
     except Exception as e:
         print(f"[UMA] compute failed: {e}")
-        return None
+        return results
+    for i, uma in zip(idxs, umas):
+        results[i] = uma
+    return results
+
+def compute_uma_from_measurements(cfg: Config, measurements: Dict[str, Any]) -> Optional[Dict[str, float]]:
+    """
+    measure_body 결과(measurements)로 UMA만 계산해서 반환.
+    """
+    return compute_uma_batch(cfg, [measurements])[0]
 
 # =========================
 # SMPLify-X
 # =========================
 
-def run_smplifyx(cfg: Config, image_path: Path, keypoints_json: Path, out_dir: Path) -> None:
-    ensure_dir(out_dir)
-    cmd = [
-        sys.executable,
-        str(cfg.SMPLIFYX_MAIN),
-        "--output_folder", str(out_dir),
+def smplifyx_model_args(cfg: Config) -> List[str]:
+    """모델/prior/옵션 인자 (폴더와 무관 → 상주 러너 초기화에도 사용)"""
+    args = [
         "--model_folder", str(cfg.MODEL_DIR.parent),        # .../avatar/PyMAF-X/data
-        "--data_folder", str(image_path.parent),
-        "--img_folder", str(image_path.parent),
-        "--keyp_folder", str(keypoints_json.parent),
         "--visualize", "False",
         "--gender", "neutral",
         "--use_hands", "False",
         "--use_face", "False",
         "--use_face_contour", "False",
-        "--interpenetration", "False",
-        "--max_collisions", "0",
         "--vposer_ckpt", str((cfg.SMPLIFYX_DIR / "vposer_v1_0").resolve()),
         "--prior_folder", str((cfg.SMPLIFYX_DIR / "src" / "human-body-prior" / "support_data" / "priors").resolve()),
     ]
+    if cfg.SMPLIFYX_INTERPENETRATION:
+        # max_collisions 는 fit_smplx.yaml 값 사용, 같은 부위끼리의 충돌은 part segmentation 으로 거름
+        args += ["--interpenetration", "True",
+                 "--part_segm_fn", str((cfg.SMPLIFYX_DIR / "smplx_parts_segm.pkl").resolve())]
+    else:
+        args += ["--interpenetration", "False", "--max_collisions", "0"]
+    if cfg.SMPLIFYX_BATCH_FITTING:
+        args += ["--batch_fitting", "True",
+                 "--fit_batch_size", str(cfg.SMPLIFYX_FIT_BATCH_SIZE)]
+    else:
+        args += ["--parallel_orient", "True"]
+    args += ["--orient_drop_stage", str(cfg.SMPLIFYX_ORIENT_DROP_STAGE)]
+    if cfg.SMPLIFYX_WARM_START:
+        args += ["--warm_start", "True",
+                 "--warm_start_skip_stages", str(cfg.SMPLIFYX_WARM_START_SKIP_STAGES)]
+    if cfg.SMPLIFYX_STAGE_MAXITERS:
+        args += ["--stage_maxiters"] + [str(n) for n in cfg.SMPLIFYX_STAGE_MAXITERS]
+    args += ["--check_every", str(cfg.SMPLIFYX_CHECK_EVERY),
+             "--plateau_px", str(cfg.SMPLIFYX_PLATEAU_PX),
+             "--plateau_patience", str(cfg.SMPLIFYX_PLATEAU_PATIENCE),
+             "--stage_skip_px", str(cfg.SMPLIFYX_STAGE_SKIP_PX)]
     if cfg.SMPLIFYX_CFG and cfg.SMPLIFYX_CFG.exists():
-        cmd += ["--config", str(cfg.SMPLIFYX_CFG)]
-    run(cmd, cwd=cfg.SMPLIFYX_DIR)
+        args += ["--config", str(cfg.SMPLIFYX_CFG)]
+    return args
 
-def read_smplifyx_result(out_dir: Path, image_path: Path) -> Optional[Dict[str, Any]]:
-    results_dir = out_dir / "results"
-    if not results_dir.exists():
-        print(f"[SMPLify-X] No results directory: {results_dir}")
-        return None
 
-    pkls = sorted(results_dir.glob("*.pkl"))
-    if not pkls:
-        print(f"[SMPLify-X] No pkl files in {results_dir}")
+def smplifyx_cache_config(cfg: Config) -> Dict[str, Any]:
+    """
+    SMPLify-X 결과에 영향을 주는 인자와 fitting 코드. 경로 인자는 내용 해시(디렉터리는 파일 목록 해시)로
+    바꿔서 사용자/출력 폴더와 무관하게 같은 설정이면 같은 키가 되도록 함.
+    """
+    return {
+        "args": [path_digest(a) if os.path.isabs(a) else a for a in smplifyx_model_args(cfg)],
+        "code": code_digest(cfg.SMPLIFYX_DIR / "smplifyx",
+                            cfg.SMPLIFYX_DIR / "torch-mesh-isect" / "mesh_intersection"),
+    }
+
+
+def run_smplifyx(cfg: Config, image_folder: Path, keyp_folder: Path, out_dir: Path,
+                 runner: Optional[Callable[..., Any]] = None,
+                 keypoints: Optional[Dict[str, List[Dict[str, np.ndarray]]]] = None) -> None:
+    """
+    image_folder 의 모든 이미지를 한 번의 호출로 각각 정확히 한 번씩 피팅.
+    결과: <out_dir>/results/<image_stem>/000.pkl (이미지별로 분리, mtime 추측 불필요)
+
+    runner=None  : smplifyx/main.py 를 subprocess 로 실행
+    runner=func  : func(output_folder=..., data_folder=..., ...) 호출 (상주 SMPLifyXRunner.run)
+    keypoints    : {stem: [OpenPose 사람 항목]} — runner 에 메모리로 넘겨 keyp_folder JSON 을 읽지 않음.
+                   여기 없는 이미지는 피팅하지 않음. subprocess 실행에서는 무시 (JSON 사용).
+    """
+    ensure_dir(out_dir)
+    folders = {
+        "output_folder": str(out_dir),
+        "data_folder": str(image_folder),
+        "img_folder": str(image_folder),
+        "keyp_folder": str(keyp_folder),
+    }
+    if runner is not None:
+        if keypoints is not None:
+            folders["keypoints"] = keypoints
+        runner(**folders)
+        return
+
+    cmd = [sys.executable, str(cfg.SMPLIFYX_MAIN)] + as_cli_args(folders) + smplifyx_model_args(cfg)
+    run(cmd, cwd=cfg.SMPLIFYX_DIR)
+
+def smplifyx_result_dir(out_dir: Path, image_path: Path) -> Path:
+    return out_dir / "results" / image_path.stem
+
+def clear_smplifyx_result(out_dir: Path, image_path: Path) -> None:
+    """이전 실행의 결과가 이번 실패를 가리지 않도록 이미지별 결과 pkl 제거"""
+    result_dir = smplifyx_result_dir(out_dir, image_path)
+    if result_dir.is_dir():
+        for p in result_dir.glob("*.pkl"):
+            p.unlink()
+
+def load_smplifyx_files(out_dir: Path, image_path: Path) -> Dict[str, bytes]:
+    """이미지별 결과 pkl 들의 원본 바이트 (캐시 저장용)"""
+    result_dir = smplifyx_result_dir(out_dir, image_path)
+    if not result_dir.is_dir():
+        return {}
+    return {p.name: p.read_bytes() for p in sorted(result_dir.glob("*.pkl"))}
+
+def restore_smplifyx_files(out_dir: Path, image_path: Path, files: Dict[str, bytes]) -> None:
+    clear_smplifyx_result(out_dir, image_path)
+    result_dir = ensure_dir(smplifyx_result_dir(out_dir, image_path))
+    for name, data in files.items():
+        write_bytes_atomic(result_dir / name, data)
+
+def read_smplifyx_result(out_dir: Path, image_path: Path, person_id: int = 0) -> Optional[Dict[str, Any]]:
+    result_pkl = smplifyx_result_dir(out_dir, image_path) / f"{person_id:03d}.pkl"
+    if not result_pkl.exists():
+        print(f"[SMPLify-X] No result for {image_path.name}: {result_pkl}")
         return None
 
-    best = max(pkls, key=lambda p: p.stat().st_mtime)
-    print(f"[SMPLify-X] Using result: {best}")
+    print(f"[SMPLify-X] Using result: {result_pkl}")
 
-    with open(best, "rb") as f:
+    with open(result_pkl, "rb") as f:
         data = pickle.load(f, encoding="latin1") if sys.version_info >= (3, 0) else pickle.load(f)
 
     out: Dict[str, Any] = {}
@@ -489,59 +973,82 @@ def read_smplifyx_result(out_dir: Path, image_path: Path) -> Optional[Dict[str,
 # Main
 # =========================
 
-def main():
-    ap = argparse.ArgumentParser(description="PyMAF-X → JSON → (opt) SMPLify-X + measurements(+UMA) (single user)")
-    ap.add_argument("user_id", type=str, help="User ID (reads data/<user_id>/avatar, writes data/<user_id>/avatar_output)")
-    ap.add_argument("images", type=str, nargs="?", help="Optional: custom images folder. Default: data/<user_id>/avatar")
-    ap.add_argument("--target_height_cm", type=float, default=None, help="User Height (Adjust measurements based on target height (cm))")
-    ap.add_argument("--force_pymaf", action="store_true", help="Force re-run PyMAF even if PKLs exist")
-    ap.add_argument("--skip_pymaf", action="store_true", help="Skip running PyMAF (assume PKLs exist)")
-    ap.add_argument("--no_smplifyx", action="store_true", help="Disable SMPLify-X refinement")
-    ap.add_argument("--exif_mode", choices=["copy", "inplace", "off"], default="inplace",
-                    help="EXIF normalize mode: copy (default), inplace (overwrite originals), off (disable)")
-    args = ap.parse_args()
-
-    cfg = DEFAULTS
+def user_config(user_id: str) -> Config:
+    """DEFAULTS 를 복사해 사용자별 출력 경로를 채운 Config (전역 DEFAULTS 는 건드리지 않음)"""
+    user_output_dir = DATA_ROOT / user_id / "avatar_output"
+    return replace(
+        DEFAULTS,
+        PYMAF_OUT_DIR=user_output_dir / "pymaf",
+        JSON_OUT_DIR=user_output_dir,
+        SMPLIFYX_OUT_DIR=user_output_dir / "smplifyx",
+    )
 
-    # User-scoped I/O folders
-    user_input_dir = DATA_ROOT / args.user_id / "avatar"
-    user_output_dir = DATA_ROOT / args.user_id / "avatar_output"
-    pymaf_out_dir = user_output_dir / "pymaf"
-    smplifyx_out_dir = user_output_dir / "smplifyx"
 
+def resolve_image_folder(user_id: str, images: Optional[str] = None) -> Path:
+    user_input_dir = DATA_ROOT / user_id / "avatar"
     ensure_dir(user_input_dir)
-    ensure_dir(user_output_dir)
 
-    # Override config with user-scoped paths
-    cfg.PYMAF_OUT_DIR = pymaf_out_dir
-    cfg.JSON_OUT_DIR = user_output_dir
-    cfg.SMPLIFYX_OUT_DIR = smplifyx_out_dir
-
-    # Resolve images folder
-    if args.images:
-        images_arg = Path(args.images)
-        images = images_arg if images_arg.is_absolute() else (BASE_DIR / images_arg)
+    if images:
+        images_arg = Path(images)
+        folder = images_arg if images_arg.is_absolute() else (BASE_DIR / images_arg)
     else:
-        images = user_input_dir
-    images = images.resolve()
-    assert images.exists() and images.is_dir(), f"Image folder not found: {images}"
+        folder = user_input_dir
+    folder = folder.resolve()
+    assert folder.exists() and folder.is_dir(), f"Image folder not found: {folder}"
+    return folder
+
 
-    # EXIF 정규화
-    if args.exif_mode == "off":
-        normalized_images = images
+@dataclass
+class UserRun:
+    """
+    한 사용자 실행의 입력과 stage 사이에 넘겨지는 상태.
+    process_user 는 아래 stage_* 를 순서대로 부르고, avatar_pipeline.py 는 여러 사용자에 대해
+    stage 별 worker 로 겹쳐 실행한다.
+    """
+    cfg: Config
+    images: Path
+    target_height_cm: Optional[float] = None
+    force_pymaf: bool = False
+    skip_pymaf: bool = False
+    no_smplifyx: bool = False
+    exif_mode: str = "inplace"
+    cache: Optional[ResultCache] = None
+    # stage 결과
+    normalized_images: Optional[Path] = None
+    keypoints: Dict[str, List[Dict[str, np.ndarray]]] = field(default_factory=dict)  # stem → OpenPose 사람 항목
+    prepared: List[Tuple[Path, Path, Dict[str, Any]]] = field(default_factory=list)
+    fit_images: List[Path] = field(default_factory=list)
+    smplifyx_ran: bool = False
+    written: List[Path] = field(default_factory=list)
+
+
+def stage_exif(job: UserRun) -> UserRun:
+    """EXIF 정규화 + 출력 폴더 준비"""
+    cfg = job.cfg
+    if job.exif_mode == "off":
+        job.normalized_images = job.images
         print("[EXIF] Skipped (mode=off). Using original images.")
     else:
-        normalized_images = normalize_images_with_exif(images, mode=args.exif_mode)
-        print(f"[EXIF] Using image folder: {normalized_images}")
+        job.normalized_images = normalize_images_with_exif(job.images, mode=job.exif_mode, cache=job.cache)
+        print(f"[EXIF] Using image folder: {job.normalized_images}")
 
     # Ensure output dirs
     ensure_dir(cfg.PYMAF_OUT_DIR)
     ensure_dir(cfg.JSON_OUT_DIR)
     ensure_dir(cfg.SMPLIFYX_OUT_DIR)
+    return job
+
+
+def stage_pymaf(job: UserRun, runner: Optional[Callable[..., Any]] = None) -> UserRun:
+    """PyMAF-X 추론 → 이미지별 초기 JSON + keypoints JSON"""
+    cfg = job.cfg
+    normalized_images = job.normalized_images
 
     # 1) PyMAF-X inference
-    if not args.skip_pymaf:
-        run_pymaf_on_folder(cfg, image_folder=normalized_images, force=args.force_pymaf)
+    if not job.skip_pymaf:
+        # 업로드 폴더의 <stem>.json (클라이언트 bbox/keypoints, EXIF 정규화 후 좌표) → 검출 생략
+        run_pymaf_on_folder(cfg, image_folder=normalized_images, force=job.force_pymaf,
+                            runner=runner, cache=job.cache, sidecar_dir=job.images)
     else:
         print("[Pipeline] Skipping PyMAF run; assuming PKLs exist.")
 
@@ -550,8 +1057,10 @@ def main():
                        if p.is_file() and p.suffix.lower() in IMG_EXTS])
     print(f"[Pipeline] Found {len(img_list)} images.")
 
+    # 2-a/b) 이미지별 초기 JSON + keypoints JSON
+    job.prepared, job.fit_images, job.keypoints = [], [], {}
     for img in img_list:
-        print(f"=== Processing {img.name} ===")
+        print(f"=== Preparing {img.name} ===")
         pkl_path = find_pkl_for_image(cfg.PYMAF_OUT_DIR, img)
         if not pkl_path:
             print(f"[Warn] No PyMAF PKL found for {img.name}. Skipping.")
@@ -565,35 +1074,103 @@ def main():
         write_unified_json(json_path, img, extracted, measurements=None)
         print(f"[JSON] Wrote {json_path} (without measurements/UMA)")
 
-        # 2-b) Keypoints JSON (17→25 패딩)
-        joints2d = extracted.get("pymaf", {}).get("joints2d", [])
+        # 2-b) Keypoints: COCO-WholeBody → BODY_25(+손/얼굴). 상주 SMPLify-X 에는 배열 그대로 넘기고
+        #      JSON 은 subprocess 실행과 캐시 키용으로만 씀
+        person = extracted.get("openpose")
         kp_path = cfg.JSON_OUT_DIR / f"{img.stem}_keypoints.json"
-        if joints2d:
-            write_openpose_like(kp_path, joints2d)
+        if person is not None:
+            write_openpose_like(kp_path, person)
+            job.keypoints[img.stem] = [person]
+            job.fit_images.append(img)
         else:
-            kp_path = None
+            if kp_path.exists():
+                kp_path.unlink()  # 이전 실행의 keypoints 로 피팅되지 않도록
             print("[SMPLify-X] No 2D joints found in PyMAF output; refinement may skip.")
 
-        # 3) (opt) SMPLify-X refine → JSON에 우선 반영(측정은 아직 X)
+        job.prepared.append((img, json_path, extracted))
+    return job
+
+
+def stage_smplifyx(job: UserRun, runner: Optional[Callable[..., Any]] = None) -> UserRun:
+    """(opt) SMPLify-X: 사용자당 1회 호출, 이미지마다 정확히 한 번 피팅"""
+    cfg, cache, fit_images = job.cfg, job.cache, job.fit_images
+    out_dir = cfg.SMPLIFYX_OUT_DIR
+    job.smplifyx_ran = False
+    if job.no_smplifyx or not fit_images:
+        print("[Pipeline] SMPLify-X disabled or keypoints missing.")
+        return job
+
+    # 키: 이미지 내용(H/W → data weight, 카메라 중심) + keypoints + 설정
+    pending, keys = list(fit_images), {}
+    if cache is not None:
+        config = smplifyx_cache_config(cfg)
+        pending = []
+        for img in fit_images:
+            kp_path = cfg.JSON_OUT_DIR / f"{img.stem}_keypoints.json"
+            keys[img] = make_key("smplifyx", file_digest(img), file_digest(kp_path), config)
+            hit = cache.get("smplifyx", keys[img])
+            if hit is not None:
+                restore_smplifyx_files(out_dir, img, hit)
+            else:
+                pending.append(img)
+
+    for img in pending:
+        clear_smplifyx_result(out_dir, img)
+    print(f"[SMPLify-X] {len(fit_images) - len(pending)}/{len(fit_images)} cached; "
+          f"fitting {len(pending)} images in one run")
+    if pending:
+        # 캐시에 없는 이미지의 keypoints 만 넘김 (keypoints 가 없는 이미지는 피팅 대상에서 빠짐)
+        keypoints = None
+        if runner is not None and all(img.stem in job.keypoints for img in pending):
+            keypoints = {img.stem: job.keypoints[img.stem] for img in pending}
+        keyp_folder = cfg.JSON_OUT_DIR
+        if keypoints is None and len(pending) < len(fit_images):
+            keyp_folder = stage_files([cfg.JSON_OUT_DIR / f"{img.stem}_keypoints.json" for img in pending],
+                                      out_dir / "_pending_keypoints")
+        run_smplifyx(cfg, image_folder=job.normalized_images, keyp_folder=keyp_folder,
+                     out_dir=out_dir, runner=runner, keypoints=keypoints)
+        if cache is not None:
+            for img in pending:
+                files = load_smplifyx_files(out_dir, img)
+                if "000.pkl" in files:  # 실패한 피팅은 저장하지 않음
+                    cache.put("smplifyx", keys[img], files)
+    job.smplifyx_ran = True
+    return job
+
+
+def stage_finalize(job: UserRun) -> UserRun:
+    """SMPLify-X 결과 반영 → 측정(배치) → UMA → 최종 JSON"""
+    cfg, prepared = job.cfg, job.prepared
+    out_dir = cfg.SMPLIFYX_OUT_DIR
+
+    refined_list: List[Optional[Dict[str, Any]]] = []
+    for img, json_path, extracted in prepared:
+        print(f"=== Processing {img.name} ===")
+
+        # 3-a) SMPLify-X 결과 → JSON에 우선 반영(측정은 아직 X)
         refined = None
-        if not args.no_smplifyx and kp_path and kp_path.exists():
-            out_dir = cfg.SMPLIFYX_OUT_DIR
-            run_smplifyx(cfg, image_path=img, keypoints_json=kp_path, out_dir=out_dir)
+        if job.smplifyx_ran and img in job.fit_images:
             refined = read_smplifyx_result(out_dir, img)
             if refined:
                 write_unified_json(json_path, img, extracted, measurements=None, smplifyx_refined=refined)
                 print(f"[JSON] Updated with SMPLify-X refinement (no measurements/UMA yet): {json_path}")
             else:
                 print("[SMPLify-X] No result; continuing without refinement.")
-        else:
-            print("[Pipeline] SMPLify-X disabled or keypoints missing.")
 
-        # 4) (마지막) measure_body 실행 (refined betas 우선) → UMA 계산/저장
-        measurements = compute_measurements_from_sources(cfg, extracted, refined, args.target_height_cm)
+        refined_list.append(refined)
+
+    # 4) (마지막) measure_body 실행 (refined betas 우선) — 모든 이미지를 한 배치로 측정
+    all_measurements = compute_measurements_batch(
+        cfg, [(extracted, refined) for (_, _, extracted), refined in zip(prepared, refined_list)],
+        job.target_height_cm, cache=job.cache)
+
+    # UMA 계산 (measure_body는 UMA를 넣지 않으므로 여기서 계산) — 전체 이미지 한 번에
+    all_uma = compute_uma_batch(cfg, all_measurements)
 
+    written: List[Path] = []
+    for (img, json_path, extracted), refined, measurements, uma in zip(prepared, refined_list, all_measurements, all_uma):
         if isinstance(measurements, dict):
-            # UMA 계산 (measure_body는 UMA를 넣지 않으므로 여기서 계산)
-            uma = compute_uma_from_measurements(cfg, measurements) or {}
+            uma = uma or {}
 
             # 분리 저장: metrics(원시 수치) / uma
             metrics = {k: v for k, v in measurements.items() if not str(k).startswith("uma_")}
@@ -624,9 +1201,70 @@ def main():
             write_unified_json(json_path, img, extracted,
                                measurements=metrics, smplifyx_refined=refined, uma=uma)
             print(f"[JSON] Finalized {json_path}")
+            written.append(json_path)
         else:
             print("[Measurements] unavailable")
 
+    if job.cache is not None:
+        print(f"[Cache] {job.cache.summary()}")
+    job.written = written
+    return job
+
+
+def process_user(cfg: Config, images: Path,
+                 target_height_cm: Optional[float] = None,
+                 force_pymaf: bool = False,
+                 skip_pymaf: bool = False,
+                 no_smplifyx: bool = False,
+                 exif_mode: str = "inplace",
+                 pymaf_runner: Optional[Callable[..., Any]] = None,
+                 smplifyx_runner: Optional[Callable[..., Any]] = None,
+                 use_cache: bool = True) -> List[Path]:
+    """
+    한 사용자의 전체 파이프라인. 최종 통합 JSON 경로 목록을 반환.
+    *_runner 를 넘기면 subprocess 대신 해당 러너로 PyMAF-X / SMPLify-X 를 실행.
+    use_cache=True 면 stage 결과를 cfg.CACHE_DIR 의 content-addressed 캐시에서 재사용.
+    """
+    job = UserRun(cfg, images,
+                  target_height_cm=target_height_cm,
+                  force_pymaf=force_pymaf,
+                  skip_pymaf=skip_pymaf,
+                  no_smplifyx=no_smplifyx,
+                  exif_mode=exif_mode,
+                  cache=open_cache(cfg) if use_cache else None)
+    stage_exif(job)
+    stage_pymaf(job, runner=pymaf_runner)
+    stage_smplifyx(job, runner=smplifyx_runner)
+    stage_finalize(job)
+    return job.written
+
+
+def main():
+    ap = argparse.ArgumentParser(description="PyMAF-X → JSON → (opt) SMPLify-X + measurements(+UMA) (single user)")
+    ap.add_argument("user_id", type=str, help="User ID (reads data/<user_id>/avatar, writes data/<user_id>/avatar_output)")
+    ap.add_argument("images", type=str, nargs="?", help="Optional: custom images folder. Default: data/<user_id>/avatar")
+    ap.add_argument("--target_height_cm", type=float, default=None, help="User Height (Adjust measurements based on target height (cm))")
+    ap.add_argument("--force_pymaf", action="store_true", help="Force re-run PyMAF even if PKLs exist")
+    ap.add_argument("--skip_pymaf", action="store_true", help="Skip running PyMAF (assume PKLs exist)")
+    ap.add_argument("--no_smplifyx", action="store_true", help="Disable SMPLify-X refinement")
+    ap.add_argument("--exif_mode", choices=["copy", "inplace", "off"], default="inplace",
+                    help="EXIF normalize mode: copy (default), inplace (overwrite originals), off (disable)")
+    ap.add_argument("--no_cache", action="store_true", help="Do not read/write the content-addressed stage cache")
+    args = ap.parse_args()
+
+    cfg = user_config(args.user_id)
+    images = resolve_image_folder(args.user_id, args.images)
+
+    process_user(
+        cfg, images,
+        target_height_cm=args.target_height_cm,
+        force_pymaf=args.force_pymaf,
+        skip_pymaf=args.skip_pymaf,
+        no_smplifyx=args.no_smplifyx,
+        exif_mode=args.exif_mode,
+        use_cache=not args.no_cache,
+    )
+
     print("🎉 Done.")
 
 
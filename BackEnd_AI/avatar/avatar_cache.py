@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+"""
+BackEnd_AI/avatar/avatar_cache.py — Content-addressed stage cache for the avatar pipeline
+
+avatar.py 의 각 stage(EXIF, detection, PyMAF-X, SMPLify-X, measurement) 결과를
+"입력 내용 + 모델 체크포인트 + 관련 설정" 의 해시로 저장한다.
+  - 파일명/존재 여부가 아닌 바이트 내용으로 키를 만들므로, 사진이 바뀌면 반드시 다시 계산하고
+    같은 사진이면 다른 사용자/재업로드라도 재사용한다.
+  - 체크포인트·설정 파일이 바뀌면 키가 달라져 자동으로 무효화된다.
+
+Layout:
+  <root>/<stage>/<key[:2]>/<key>.pkl     (값은 pickle, tmp 에 쓴 뒤 원자적 교체)
+"""
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import pickle
+import threading
+from pathlib import Path
+from typing import Any, Dict, Tuple, Union
+
+# 키 형식이나 저장 값의 구조가 바뀌면 올려서 이전 캐시를 통째로 무효화
+CACHE_VERSION = 1
+
+_CHUNK = 1 << 20
+
+PathLike = Union[str, Path]
+
+# =========================
+# Digests
+# =========================
+
+_digest_lock = threading.Lock()
+_file_digests: Dict[Tuple[str, int, int], str] = {}
+
+
+def bytes_digest(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def file_digest(path: PathLike) -> str:
+    """파일 내용의 sha256. (경로, 크기, mtime) 이 같으면 프로세스 안에서 다시 읽지 않음 (체크포인트 대비)."""
+    p = Path(path).resolve()
+    st = p.stat()
+    sig = (str(p), st.st_size, st.st_mtime_ns)
+    with _digest_lock:
+        cached = _file_digests.get(sig)
+    if cached is not None:
+        return cached
+
+    h = hashlib.sha256()
+    with open(p, "rb") as f:
+        for chunk in iter(lambda: f.read(_CHUNK), b""):
+            h.update(chunk)
+    digest = h.hexdigest()
+    with _digest_lock:
+        _file_digests[sig] = digest
+    return digest
+
+
+def code_digest(*paths: PathLike) -> str:
+    """
+    stage 코드의 내용 해시. 디렉터리는 하위 *.py 전부(상대경로 + 내용), 파일은 그 파일 내용.
+    코드가 바뀌면 결과도 바뀔 수 있으므로 모델/설정과 함께 캐시 키에 넣는다.
+    """
+    h = hashlib.sha256()
+    for path in paths:
+        p = Path(path)
+        if p.is_dir():
+            files = sorted(f for f in p.rglob("*.py") if f.is_file() and "__pycache__" not in f.parts)
+            for f in files:
+                h.update(f"{f.relative_to(p).as_posix()}\0{file_digest(f)}\n".encode())
+        elif p.is_file():
+            h.update(f"{p.name}\0{file_digest(p)}\n".encode())
+        else:
+            h.update(f"missing:{p.name}\n".encode())
+    return h.hexdigest()
+
+
+def path_digest(path: PathLike) -> str:
+    """
+    파일이면 내용 해시. 디렉터리(모델 폴더 등)는 하위 파일의 (상대경로, 크기, mtime) 목록 해시
+    — 수 GB 를 매번 읽지 않기 위한 절충. 없는 경로도 키에 반영되도록 'missing:<name>'.
+    """
+    p = Path(path)
+    if p.is_file():
+        return file_digest(p)
+    if not p.is_dir():
+        return f"missing:{p.name}"
+    h = hashlib.sha256()
+    for f in sorted(x for x in p.rglob("*") if x.is_file()):
+        st = f.stat()
+        h.update(f"{f.relative_to(p).as_posix()}\0{st.st_size}\0{st.st_mtime_ns}\n".encode())
+    return h.hexdigest()
+
+
+def make_key(stage: str, *parts: Any) -> str:
+    """stage 이름과 JSON 직렬화 가능한 part 들로 캐시 키 생성 (dict 는 키 순서 무관)."""
+    payload = json.dumps([CACHE_VERSION, stage, parts], sort_keys=True, default=str,
+                         separators=(",", ":"))
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+# =========================
+# Cache
+# =========================
+
+class ResultCache:
+    """
+    stage 별 결과 저장소. get/put 은 여러 스레드·프로세스에서 동시에 불러도 안전
+    (쓰기는 tmp → os.replace, 같은 키는 같은 내용이므로 마지막 쓰기가 이겨도 무방).
+    """
+
+    _MISSING = object()
+
+    def __init__(self, root: PathLike):
+        self.root = Path(root)
+        self._lock = threading.Lock()
+        self.hits: Dict[str, int] = {}
+        self.misses: Dict[str, int] = {}
+
+    def path(self, stage: str, key: str) -> Path:
+        return self.root / stage / key[:2] / f"{key}.pkl"
+
+    def _count(self, table: Dict[str, int], stage: str) -> None:
+        with self._lock:
+            table[stage] = table.get(stage, 0) + 1
+
+    def get(self, stage: str, key: str, default: Any = None) -> Any:
+        p = self.path(stage, key)
+        try:
+            with open(p, "rb") as f:
+                value = pickle.load(f)
+        except FileNotFoundError:
+            self._count(self.misses, stage)
+            return default
+        except Exception as e:
+            # 깨진 항목(중단된 쓰기 등)은 miss 로 취급하고 다시 계산되게 둠
+            print(f"[Cache][warn] unreadable entry {p}: {e}")
+            self._count(self.misses, stage)
+            return default
+        self._count(self.hits, stage)
+        return value
+
+    def has(self, stage: str, key: str) -> bool:
+        return self.path(stage, key).exists()
+
+    def put(self, stage: str, key: str, value: Any) -> None:
+        p = self.path(stage, key)
+        p.parent.mkdir(parents=True, exist_ok=True)
+        tmp = p.with_name(f"{p.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+        try:
+            with open(tmp, "wb") as f:
+                pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp, p)
+        finally:
+            if tmp.exists():
+                tmp.unlink()
+
+    def summary(self) -> str:
+        stages = sorted(set(self.hits) | set(self.misses))
+        return ", ".join(f"{s}: {self.hits.get(s, 0)} hit / {self.misses.get(s, 0)} miss"
+                         for s in stages) or "unused"
@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+"""
+BackEnd_AI/avatar/avatar_pipeline.py — Small stage scheduler for the avatar pipeline
+
+avatar.py 는 한 사용자를 EXIF → PyMAF-X → SMPLify-X → 측정/UMA/JSON 순서로 직렬 처리한다.
+여러 사용자를 처리할 때 이 모듈은 각 단계를 stage 로 두고 stage 마다 worker 를 돌려
+단계끼리 겹치게 한다:
+  - exif     : thread pool (PIL decode/encode + 디스크 I/O)
+  - pymaf    : worker 1 개 (GPU 를 독점하는 상주 PyMAF-X 엔진)
+  - smplifyx : SMPLify-X 엔진 프로세스 수만큼의 worker → PyMAF 가 다음 사용자로 넘어가는 동안 피팅
+  - finalize : SMPLify-X 결과가 도착하는 대로 측정/UMA/JSON 작성
+stage 사이는 bounded queue 라서 앞 stage 가 너무 앞서가면 막힌다(backpressure, 메모리 상한).
+실행이 끝나면 stage 별 처리량/busy/대기 시간을 보고 → worker 수 산정에 사용.
+
+Pipeline 자체는 avatar 와 무관한 일반 스케줄러이고, avatar 용 구성은 build_user_pipeline().
+"""
+from __future__ import annotations
+
+import queue
+import threading
+import time
+import traceback
+from dataclasses import dataclass
+from functools import partial
+from typing import Any, Callable, Iterable, List, Optional, Tuple
+
+_STOP = object()
+
+# =========================
+# Scheduler
+# =========================
+
+@dataclass
+class StageStats:
+    name: str
+    workers: int
+    items: int = 0
+    failed: int = 0
+    busy_s: float = 0.0
+    wait_s: float = 0.0  # 입력 큐에 들어간 뒤 worker 가 꺼낼 때까지 기다린 시간 합
+    first_start: Optional[float] = None
+    last_end: Optional[float] = None
+
+    @property
+    def span_s(self) -> float:
+        if self.first_start is None or self.last_end is None:
+            return 0.0
+        return self.last_end - self.first_start
+
+    @property
+    def throughput(self) -> float:
+        """첫 item 시작 ~ 마지막 item 종료 구간의 items/s"""
+        return self.items / self.span_s if self.span_s > 0 else 0.0
+
+    @property
+    def utilization(self) -> float:
+        """worker 가 실제로 일한 비율. 1 에 가까우면 이 stage 가 병목 → worker 를 늘릴 후보"""
+        return self.busy_s / (self.span_s * self.workers) if self.span_s > 0 else 0.0
+
+
+class Stage:
+    def __init__(self, name: str, fn: Callable[[Any], Any], workers: int = 1, queue_size: int = 2):
+        self.name = name
+        self.fn = fn
+        self.workers = max(1, int(workers))
+        self.queue_size = max(1, int(queue_size))
+
+
+@dataclass
+class _Item:
+    index: int
+    value: Any
+    error: Optional[str] = None
+    enqueued: float = 0.0
+
+
+class Pipeline:
+    """
+    stage 들을 순서대로 연결한 스케줄러. 각 stage 는 bounded 입력 큐와 workers 개의 스레드를 가진다.
+    fn 은 item 을 받아 다음 stage 로 넘길 값을 반환. 예외가 난 item 은 이후 stage 를 건너뛰고
+    (value, error) 로 결과에 남는다. 무거운 일은 fn 안에서 엔진 프로세스/서브프로세스로 넘기므로
+    스레드로 충분하다 (GIL 은 대기 중에 풀림).
+    """
+
+    def __init__(self, stages: List[Stage]):
+        if not stages:
+            raise ValueError("Pipeline needs at least one stage")
+        self.stages = stages
+        self.stats = [StageStats(s.name, s.workers) for s in stages]
+        self._lock = threading.Lock()
+
+    def _worker(self, i: int, q_in: "queue.Queue", q_out: "queue.Queue", remaining: List[int]) -> None:
+        stage, stats = self.stages[i], self.stats[i]
+        while True:
+            item = q_in.get()
+            if item is _STOP:
+                with self._lock:
+                    remaining[i] -= 1
+                    last = remaining[i] == 0
+                if last:
+                    # 이 stage 의 마지막 worker 가 끝날 때 다음 stage 에 종료를 알림
+                    n_next = self.stages[i + 1].workers if i + 1 < len(self.stages) else 1
+                    for _ in range(n_next):
+                        q_out.put(_STOP)
+                return
+
+            t0 = time.perf_counter()
+            if item.error is None:
+                try:
+                    item.value = stage.fn(item.value)
+                except Exception:
+                    item.error = f"[{stage.name}] {traceback.format_exc()}"
+            t1 = time.perf_counter()
+
+            with self._lock:
+                stats.wait_s += t0 - item.enqueued
+                if item.error is None or item.error.startswith(f"[{stage.name}]"):
+                    stats.items += 1
+                    stats.busy_s += t1 - t0
+                    stats.failed += item.error is not None
+                    stats.first_start = t0 if stats.first_start is None else min(stats.first_start, t0)
+                    stats.last_end = t1 if stats.last_end is None else max(stats.last_end, t1)
+
+            item.enqueued = time.perf_counter()
+            q_out.put(item)
+
+    def run(self, inputs: Iterable[Any]) -> List[Tuple[Any, Optional[str]]]:
+        """inputs 를 모두 흘려보내고 입력 순서대로 (value, error) 목록을 반환"""
+        queues = [queue.Queue(maxsize=s.queue_size) for s in self.stages]
+        done: "queue.Queue" = queue.Queue()
+        remaining = [s.workers for s in self.stages]
+
+        threads = []
+        for i, stage in enumerate(self.stages):
+            q_out = queues[i + 1] if i + 1 < len(self.stages) else done
+            for w in range(stage.workers):
+                t = threading.Thread(target=self._worker, args=(i, queues[i], q_out, remaining),
+                                     name=f"{stage.name}-{w}", daemon=True)
+                t.start()
+                threads.append(t)
+
+        # 첫 큐가 차 있으면 여기서 막힘 → 입력도 backpressure 를 받음
+        count = 0
+        for count, value in enumerate(inputs, start=1):
+            queues[0].put(_Item(count - 1, value, enqueued=time.perf_counter()))
+        for _ in range(self.stages[0].workers):
+            queues[0].put(_STOP)
+
+        results: List[Tuple[Any, Optional[str]]] = [(None, None)] * count
+        while True:
+            item = done.get()
+            if item is _STOP:
+                break
+            results[item.index] = (item.value, item.error)
+        for t in threads:
+            t.join()
+        return results
+
+    def report(self) -> str:
+        lines = [f"{'stage':<10} {'workers':>7} {'items':>5} {'failed':>6} {'items/s':>8} "
+                 f"{'avg_s':>7} {'wait_s':>7} {'util':>5}"]
+        for s in self.stats:
+            avg = s.busy_s / s.items if s.items else 0.0
+            wait = s.wait_s / s.items if s.items else 0.0
+            lines.append(f"{s.name:<10} {s.workers:>7} {s.items:>5} {s.failed:>6} {s.throughput:>8.3f} "
+                         f"{avg:>7.2f} {wait:>7.2f} {s.utilization:>5.2f}")
+        return "\n".join(lines)
+
+# =========================
+# Avatar stages
+# =========================
+
+def build_user_pipeline(pymaf_runner: Optional[Callable[..., Any]] = None,
+                        smplifyx_runner: Optional[Callable[..., Any]] = None,
+                        exif_workers: int = 2,
+                        smplifyx_workers: int = 1,
+                        queue_size: int = 2) -> Pipeline:
+    """
+    avatar.UserRun 을 흘려보내는 파이프라인. smplifyx_runner 는 smplifyx_workers 개의 호출을
+    동시에 받을 수 있어야 함 (avatar_worker.EnginePool, 또는 None = 호출마다 subprocess).
+    """
+    import avatar
+
+    return Pipeline([
+        Stage("exif", avatar.stage_exif, workers=exif_workers, queue_size=queue_size),
+        Stage("pymaf", partial(avatar.stage_pymaf, runner=pymaf_runner), workers=1, queue_size=queue_size),
+        Stage("smplifyx", partial(avatar.stage_smplifyx, runner=smplifyx_runner),
+              workers=smplifyx_workers, queue_size=queue_size),
+        # MeasurementEngine 은 프로세스 공유 캐시라 한 스레드에서만 사용
+        Stage("finalize", avatar.stage_finalize, workers=1, queue_size=queue_size),
+    ])
@@ -0,0 +1,411 @@
+#!/usr/bin/env python3
+"""
+BackEnd_AI/avatar/avatar_worker.py — Long-lived avatar worker for weather_cloth
+
+avatar.py 는 사용자마다 run_pymaf.py / smplifyx/main.py 를 subprocess 로 새로 띄우므로
+매번 torch/openpifpaf import, pymaf_net 생성 + 체크포인트 로드, SMPL-X(neutral/male/female)
++ prior 생성을 반복한다. 이 워커는 그것들을 한 번만 로드해 두고 job 을 받아 처리한다.
+
+Layout:
+  - main process   : 소켓(Listener)에서 job 수신 → avatar.process_user() 실행, 측정/UMA 포함
+  - PyMAF engine   : 상주 자식 프로세스 (apps/run_pymaf.py::PyMAFRunner)
+  - SMPLify-X engine: 상주 자식 프로세스 (smplifyx/main.py::SMPLifyXRunner)
+  PyMAF-X(`utils` 패키지)와 smplifyx(`utils.py` 모듈)는 최상위 모듈명이 겹치므로
+  같은 인터프리터에 올릴 수 없다 → 엔진마다 spawn 프로세스 하나씩, 각자 sys.path/cwd 를 가짐.
+
+Job (dict):
+  {"user_id": str, "images": Optional[str], "target_height_cm": Optional[float],
+   "force_pymaf": bool, "no_smplifyx": bool, "exif_mode": "copy"|"inplace"|"off",
+   "no_cache": bool}
+
+여러 job 을 한 번에 받으면(list) avatar_pipeline.py 의 stage 스케줄러로 겹쳐 처리한다:
+SMPLify-X 엔진을 --smplifyx_workers 개 띄워 두고, PyMAF 가 다음 사용자를 처리하는 동안 피팅.
+
+Usage:
+  python avatar_worker.py serve  [--host 127.0.0.1] [--port 6010] [--smplifyx_workers 2]
+  python avatar_worker.py submit <user_id> [images] [--target_height_cm 175]
+  python avatar_worker.py batch  <user_id> [<user_id> ...] [--smplifyx_workers 2]
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import multiprocessing as mp
+import os
+import queue
+import sys
+import threading
+import time
+import traceback
+from multiprocessing.connection import Client, Connection, Listener
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import avatar
+from avatar import DEFAULTS, Config
+from avatar_pipeline import build_user_pipeline
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 6010
+AUTHKEY = os.environ.get("AVATAR_WORKER_AUTHKEY", "weather_cloth").encode()
+
+# =========================
+# Engine processes (child side)
+# =========================
+
+def _serve_engine(conn: Connection, build: Callable[[], Callable[..., Any]]) -> None:
+    """러너를 만든 뒤 ('ready') 를 보내고, kwargs 를 받을 때마다 러너를 호출. None 이면 종료."""
+    try:
+        call = build()
+    except Exception:
+        conn.send(("error", traceback.format_exc()))
+        return
+    conn.send(("ready", None))
+
+    while True:
+        kwargs = conn.recv()
+        if kwargs is None:
+            break
+        try:
+            conn.send(("ok", call(**kwargs)))
+        except Exception:
+            conn.send(("error", traceback.format_exc()))
+
+
+def _pymaf_engine(conn: Connection, cfg: Config, argv: List[str]) -> None:
+    os.chdir(cfg.PYMAF_X_DIR)
+    sys.path.insert(0, str(cfg.PYMAF_X_DIR))
+    sys.path.insert(0, str(cfg.PYMAF_DEMO.parent))
+
+    def build():
+        from core.cfgs import parse_args  # type: ignore
+        import run_pymaf  # type: ignore
+
+        args = run_pymaf.build_parser().parse_args(argv)
+        parse_args(args)
+        return run_pymaf.PyMAFRunner(args).run
+
+    _serve_engine(conn, build)
+
+
+def _smplifyx_engine(conn: Connection, cfg: Config, argv: List[str]) -> None:
+    os.chdir(cfg.SMPLIFYX_DIR)
+    sys.path.insert(0, str(cfg.SMPLIFYX_MAIN.parent))
+
+    def build():
+        from cmd_parser import parse_config  # type: ignore
+        from main import SMPLifyXRunner  # type: ignore
+
+        return SMPLifyXRunner(**parse_config(argv)).run
+
+    _serve_engine(conn, build)
+
+# =========================
+# Engine handle (parent side)
+# =========================
+
+class Engine:
+    """
+    상주 자식 프로세스 핸들. engine(**kwargs) 는 자식 러너의 반환값을 돌려준다.
+    자식이 죽으면 (EOF / broken pipe) 그 호출은 실패하고, 다음 호출 전에 같은 target/argv 로 다시 띄움.
+    """
+
+    def __init__(self, name: str, target: Callable[..., None], cfg: Config, argv: List[str]):
+        self.name = name
+        self._target, self._cfg, self._argv = target, cfg, argv
+        self._start()
+
+    def _start(self) -> None:
+        ctx = mp.get_context("spawn")  # torch/CUDA 는 fork 와 궁합이 나쁨
+        self._conn, child_conn = ctx.Pipe()
+        # daemon=False: DataLoader workers 등 자식의 자식 프로세스를 허용해야 함
+        self._proc = ctx.Process(target=self._target, args=(child_conn, self._cfg, self._argv), name=self.name)
+        self._proc.start()
+        child_conn.close()
+        self._expect()
+
+    @property
+    def alive(self) -> bool:
+        return self._proc.is_alive()
+
+    def restart(self) -> None:
+        print(f"[{self.name}] engine process exited (code={self._proc.exitcode}), restarting ...")
+        self.close()
+        self._conn.close()
+        self._start()
+
+    def _dead(self) -> RuntimeError:
+        self._proc.join(timeout=10)  # 다음 호출의 alive 검사가 확실히 False 가 되도록
+        return RuntimeError(f"[{self.name}] engine process exited (code={self._proc.exitcode})")
+
+    def _expect(self) -> Any:
+        try:
+            status, payload = self._conn.recv()
+        except (EOFError, OSError):
+            raise self._dead()
+        if status == "error":
+            raise RuntimeError(f"[{self.name}] engine failed:\n{payload}")
+        return payload
+
+    def __call__(self, **kwargs) -> Any:
+        if not self.alive:
+            self.restart()
+        try:
+            self._conn.send(kwargs)
+        except (BrokenPipeError, OSError):
+            raise self._dead()
+        return self._expect()
+
+    def close(self) -> None:
+        if self._proc.is_alive():
+            try:
+                self._conn.send(None)
+            except (BrokenPipeError, OSError):
+                pass
+            self._proc.join(timeout=10)
+        if self._proc.is_alive():
+            self._proc.terminate()
+
+
+class EnginePool:
+    """
+    같은 종류의 Engine n 개. pool(**kwargs) 는 놀고 있는 엔진 하나에서 실행 (여러 스레드에서 동시 호출 가능).
+    각 엔진은 별도 프로세스라 SMPLify-X 피팅이 실제로 병렬로 돈다.
+    죽은 엔진은 다시 띄운 뒤에만 _idle 로 돌려놓고, 다시 띄우지 못하면 pool 에서 뺌.
+    """
+
+    def __init__(self, name: str, target: Callable[..., None], cfg: Config, argv: List[str], size: int):
+        self.engines = [Engine(f"{name}-{i}", target, cfg, argv) for i in range(max(1, size))]
+        self._lock = threading.Lock()
+        # None: 엔진이 하나도 남지 않음 → 기다리던 호출도 깨워서 실패시킴
+        self._idle: "queue.Queue[Optional[Engine]]" = queue.Queue()
+        for engine in self.engines:
+            self._idle.put(engine)
+
+    def __call__(self, **kwargs) -> Any:
+        engine = self._idle.get()
+        if engine is None:
+            self._idle.put(None)
+            raise RuntimeError("every engine in the pool exited and could not be restarted")
+        try:
+            return engine(**kwargs)
+        finally:
+            self._release(engine)
+
+    def _release(self, engine: Engine) -> None:
+        if not engine.alive:
+            try:
+                engine.restart()
+            except Exception as e:
+                print(f"[{engine.name}] restart failed, dropping it from the pool: {e}")
+                with self._lock:
+                    self.engines.remove(engine)
+                    if not self.engines:
+                        self._idle.put(None)
+                return
+        self._idle.put(engine)
+
+    def close(self) -> None:
+        for engine in self.engines:
+            engine.close()
+
+# =========================
+# Worker
+# =========================
+
+class AvatarWorker:
+    def __init__(self, cfg: Config = DEFAULTS, use_smplifyx: bool = True, smplifyx_workers: int = 1):
+        self.cfg = cfg
+        t0 = time.time()
+        print("[Worker] Loading PyMAF-X engine ...")
+        self.pymaf = Engine("pymaf", _pymaf_engine, cfg, avatar.pymaf_model_args(cfg))
+        self.smplifyx: Optional[EnginePool] = None
+        if use_smplifyx:
+            print(f"[Worker] Loading {smplifyx_workers} SMPLify-X engine(s) ...")
+            self.smplifyx = EnginePool("smplifyx", _smplifyx_engine, cfg, avatar.smplifyx_model_args(cfg),
+                                       size=smplifyx_workers)
+        print(f"[Worker] Engines ready in {time.time() - t0:.1f}s")
+
+    def _user_args(self, job: Dict[str, Any]) -> Tuple[Config, Any, Dict[str, Any], bool]:
+        """job → (사용자 config, 이미지 폴더, process_user/UserRun 공통 옵션, 캐시 사용 여부)"""
+        user_id = str(job["user_id"])
+        cfg = avatar.user_config(user_id)
+        options = dict(
+            target_height_cm=job.get("target_height_cm"),
+            force_pymaf=bool(job.get("force_pymaf", False)),
+            no_smplifyx=bool(job.get("no_smplifyx", False)) or self.smplifyx is None,
+            exif_mode=job.get("exif_mode", "inplace"),
+        )
+        return cfg, avatar.resolve_image_folder(user_id, job.get("images")), options, not job.get("no_cache", False)
+
+    def _user_run(self, job: Dict[str, Any]) -> avatar.UserRun:
+        cfg, images, options, use_cache = self._user_args(job)
+        return avatar.UserRun(cfg, images, cache=avatar.open_cache(cfg) if use_cache else None, **options)
+
+    def handle(self, job: Dict[str, Any]) -> Dict[str, Any]:
+        t0 = time.time()
+        cfg, images, options, use_cache = self._user_args(job)
+        written = avatar.process_user(cfg, images, pymaf_runner=self.pymaf, smplifyx_runner=self.smplifyx,
+                                      use_cache=use_cache, **options)
+        return {
+            "ok": True,
+            "user_id": str(job["user_id"]),
+            "outputs": [str(p) for p in written],
+            "elapsed_s": round(time.time() - t0, 3),
+        }
+
+    def handle_many(self, jobs: List[Dict[str, Any]], exif_workers: int = 2,
+                    queue_size: int = 2) -> Dict[str, Any]:
+        """여러 사용자를 stage 스케줄러로 겹쳐 처리. 사용자별 결과(jobs 순서) + stage 별 처리량 보고."""
+        t0 = time.time()
+        runs = []
+        results: List[Optional[Dict[str, Any]]] = [None] * len(jobs)
+        for i, job in enumerate(jobs):
+            try:
+                runs.append((i, self._user_run(job)))
+            except Exception as e:
+                results[i] = {"ok": False, "user_id": job.get("user_id"), "error": f"{type(e).__name__}: {e}"}
+
+        pipeline = build_user_pipeline(
+            pymaf_runner=self.pymaf, smplifyx_runner=self.smplifyx,
+            exif_workers=exif_workers,
+            smplifyx_workers=len(self.smplifyx.engines) if self.smplifyx is not None else 1,
+            queue_size=queue_size,
+        )
+        for (i, _), (run, error) in zip(runs, pipeline.run(r for _, r in runs)):
+            job = jobs[i]
+            if error is not None:
+                print(error)
+                results[i] = {"ok": False, "user_id": job.get("user_id"), "error": error.strip().splitlines()[-1]}
+            else:
+                results[i] = {"ok": True, "user_id": str(job["user_id"]), "outputs": [str(p) for p in run.written]}
+
+        report = pipeline.report()
+        print(f"[Worker] Stage throughput:\n{report}")
+        return {
+            "ok": all(r["ok"] for r in results),
+            "results": results,
+            "stages": report,
+            "elapsed_s": round(time.time() - t0, 3),
+        }
+
+    def close(self) -> None:
+        self.pymaf.close()
+        if self.smplifyx is not None:
+            self.smplifyx.close()
+
+
+def serve(host: str = DEFAULT_HOST, port: int = DEFAULT_PORT, use_smplifyx: bool = True,
+          smplifyx_workers: int = 1) -> None:
+    """
+    연결마다 job 하나(dict) 또는 여러 개(list)를 받아 처리. list 는 stage 스케줄러로 겹쳐 처리.
+    연결끼리는 순서대로 (GPU 를 PyMAF 엔진이 독점하므로).
+    """
+    worker = AvatarWorker(use_smplifyx=use_smplifyx, smplifyx_workers=smplifyx_workers)
+    try:
+        with Listener((host, port), authkey=AUTHKEY) as listener:
+            print(f"[Worker] Listening on {host}:{port}")
+            while True:
+                with listener.accept() as conn:
+                    try:
+                        job = conn.recv()
+                    except EOFError:
+                        continue
+                    if job == "shutdown":
+                        conn.send({"ok": True, "shutdown": True})
+                        break
+                    print(f"[Worker] Job: {job}")
+                    try:
+                        result = worker.handle_many(job) if isinstance(job, list) else worker.handle(job)
+                    except Exception as e:
+                        traceback.print_exc()
+                        result = {"ok": False, "user_id": job.get("user_id") if isinstance(job, dict) else None,
+                                  "error": f"{type(e).__name__}: {e}"}
+                    conn.send(result)
+    finally:
+        worker.close()
+
+
+def submit(job: Any, host: str = DEFAULT_HOST, port: int = DEFAULT_PORT) -> Dict[str, Any]:
+    with Client((host, port), authkey=AUTHKEY) as conn:
+        conn.send(job)
+        return conn.recv()
+
+# =========================
+# Main
+# =========================
+
+def main():
+    ap = argparse.ArgumentParser(description="Resident PyMAF-X / SMPLify-X avatar worker")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+
+    sp = sub.add_parser("serve", help="Load models once and serve jobs")
+    sp.add_argument("--host", default=DEFAULT_HOST)
+    sp.add_argument("--port", type=int, default=DEFAULT_PORT)
+    sp.add_argument("--no_smplifyx", action="store_true", help="Do not load the SMPLify-X engine")
+    sp.add_argument("--smplifyx_workers", type=int, default=1, help="Number of SMPLify-X engine processes")
+
+    sj = sub.add_parser("submit", help="Send one job to a running worker")
+    sj.add_argument("user_id", type=str)
+    sj.add_argument("images", type=str, nargs="?")
+    sj.add_argument("--target_height_cm", type=float, default=None)
+    sj.add_argument("--force_pymaf", action="store_true")
+    sj.add_argument("--no_smplifyx", action="store_true")
+    sj.add_argument("--exif_mode", choices=["copy", "inplace", "off"], default="inplace")
+    sj.add_argument("--no_cache", action="store_true")
+    sj.add_argument("--host", default=DEFAULT_HOST)
+    sj.add_argument("--port", type=int, default=DEFAULT_PORT)
+
+    sb = sub.add_parser("batch", help="Load engines and run several users through the stage scheduler")
+    sb.add_argument("user_ids", type=str, nargs="+")
+    sb.add_argument("--target_height_cm", type=float, default=None)
+    sb.add_argument("--no_smplifyx", action="store_true")
+    sb.add_argument("--exif_mode", choices=["copy", "inplace", "off"], default="inplace")
+    sb.add_argument("--no_cache", action="store_true")
+    sb.add_argument("--exif_workers", type=int, default=2)
+    sb.add_argument("--smplifyx_workers", type=int, default=2)
+    sb.add_argument("--queue_size", type=int, default=2, help="Bounded queue length between stages")
+
+    sd = sub.add_parser("shutdown", help="Stop a running worker")
+    sd.add_argument("--host", default=DEFAULT_HOST)
+    sd.add_argument("--port", type=int, default=DEFAULT_PORT)
+
+    args = ap.parse_args()
+
+    if args.cmd == "serve":
+        serve(args.host, args.port, use_smplifyx=not args.no_smplifyx, smplifyx_workers=args.smplifyx_workers)
+        return
+
+    if args.cmd == "batch":
+        worker = AvatarWorker(use_smplifyx=not args.no_smplifyx, smplifyx_workers=args.smplifyx_workers)
+        try:
+            jobs = [{"user_id": u, "target_height_cm": args.target_height_cm, "exif_mode": args.exif_mode,
+                     "no_cache": args.no_cache} for u in args.user_ids]
+            result = worker.handle_many(jobs, exif_workers=args.exif_workers, queue_size=args.queue_size)
+        finally:
+            worker.close()
+        print(json.dumps(result, ensure_ascii=False, indent=2))
+        if not result.get("ok"):
+            sys.exit(1)
+        return
+
+    if args.cmd == "shutdown":
+        print(json.dumps(submit("shutdown", args.host, args.port), ensure_ascii=False))
+        return
+
+    job = {
+        "user_id": args.user_id,
+        "images": args.images,
+        "target_height_cm": args.target_height_cm,
+        "force_pymaf": args.force_pymaf,
+        "no_smplifyx": args.no_smplifyx,
+        "exif_mode": args.exif_mode,
+        "no_cache": args.no_cache,
+    }
+    result = submit(job, args.host, args.port)
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+    if not result.get("ok"):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,192 @@
+"""
+batched SMPLify-X 피팅이 사람별로 따로 돌린 피팅과 같은 결과를 내는지 확인.
+
+1) BatchLBFGS: 서로 독립인 B개의 문제를 한 배치로 풀면 하나씩 푼 것과 같아야 함
+   (일부 샘플이 step 중간에 멈췄다가 다음 step 에서 다시 도는 경우, 꽉 찬 history 포함)
+2) fit_multi_frame: 합성 keypoint 로 만든 여러 사람을 한 번에 피팅 vs 한 사람씩 피팅
+   camera 초기화 + 첫 stage 몇 iteration 까지는 float 정밀도 안에서 같아야 함.
+   전체 stage 는 비교하지 않음: line search 의 수락/반감 판정이 반올림 차이에 민감해서
+   한 사람만 피팅해도 keypoint 를 1e-12 px 옮기면 결과가 1e-3 수준으로 달라짐.
+
+smplify-x 폴더에서 실행:  python check_batch_fitting.py [모델 폴더 (smplx/ 를 포함)] [vposer 체크포인트]
+vposer 체크포인트를 주지 않으면 body pose 는 rest pose 중심의 L2 prior 로 피팅한다.
+"""
+import os
+import pickle
+import sys
+import tempfile
+
+import numpy as np
+import torch
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "smplifyx"))
+
+import smplx  # noqa: E402
+import fitting  # noqa: E402
+import prior  # noqa: E402
+import utils  # noqa: E402
+from camera import create_camera  # noqa: E402
+from fit_multi_frame import fit_multi_frame  # noqa: E402
+from optimizers.batch_lbfgs import BatchLBFGS  # noqa: E402
+from optimizers.optim_factory import create_optimizer  # noqa: E402
+
+# ===== 설정 =====
+MODEL_FOLDER = sys.argv[1] if len(sys.argv) > 1 else "models"
+VPOSER_CKPT = sys.argv[2] if len(sys.argv) > 2 else None
+DTYPE = torch.float64
+FOCAL_LENGTH = 5000.
+IMG_SIZES = [(500, 400), (640, 480), (480, 480)]     # (H, W), 사람마다 다른 크기
+SHORT_MAXITERS = 3
+TOL_PARAM = 1e-8
+
+torch.manual_seed(0)
+rng = np.random.default_rng(0)
+
+
+# ===== 1) BatchLBFGS =====
+def rosenbrock(x, scale):
+    return scale * ((1 - x[:, 0]) ** 2 + 100 * (x[:, 1] - x[:, 0] ** 2) ** 2)
+
+
+def minimize(x0, scale):
+    """FittingMonitor.run_batch_fitting 으로 수렴할 때까지"""
+    x = x0.clone().requires_grad_(True)
+    optimizer, _ = create_optimizer([x], optim_type="batch_lbfgs", lr=1.0, maxiters=30)
+
+    def closure():
+        optimizer.zero_grad()
+        loss = rosenbrock(x, scale)
+        loss.sum().backward()
+        return loss
+
+    monitor = fitting.FittingMonitor(maxiters=30, ftol=1e-12, gtol=1e-12)
+    with monitor:
+        monitor.run_batch_fitting(optimizer, closure, [x], None, use_vposer=False)
+    return x.detach()
+
+
+def minimize_steps(x0, scale, steps=15):
+    """짧은 history, 큰 tolerance_change: 샘플이 step 중간에 멈췄다 다음 step 에서 다시 돎"""
+    x = x0.clone().requires_grad_(True)
+    optimizer = BatchLBFGS([x], max_iter=4, history_size=3, tolerance_change=1e-2)
+
+    def closure():
+        optimizer.zero_grad()
+        loss = rosenbrock(x, scale) + x[:, 2:].pow(2).sum(dim=1)
+        loss.sum().backward()
+        return loss
+
+    for _ in range(steps):
+        optimizer.step(closure)
+    return x.detach()
+
+
+for name, run, dim in (("monitor", minimize, 2), ("idle samples", minimize_steps, 5)):
+    x0 = torch.randn(5, dim, dtype=DTYPE)
+    scale = torch.tensor([1., 10., 100., 1., 300.], dtype=DTYPE)
+    batched = run(x0, scale)
+    one_by_one = torch.cat([run(x0[i:i + 1], scale[i:i + 1]) for i in range(len(x0))])
+    err = (batched - one_by_one).abs().max().item()
+    print(f"BatchLBFGS ({name}) max |batched - one by one| = {err:.2e}")
+    assert err < 1e-10, name
+
+
+# ===== 2) fit_multi_frame =====
+class RestPoseL2Prior(prior.L2Prior):
+    """rest pose(0) 중심의 L2 prior. VPoser 없이 돌릴 때 body pose 초기값으로 쓸 평균을 제공"""
+
+    def get_mean(self):
+        return torch.zeros(1, 63, dtype=DTYPE)
+
+
+joint_mapper = utils.JointMapper(utils.smpl_to_openpose(
+    "smplx", use_hands=False, use_face=False, use_face_contour=False))
+model_params = dict(model_path=MODEL_FOLDER, model_type="smplx", joint_mapper=joint_mapper,
+                    create_global_orient=True, create_body_pose=not VPOSER_CKPT,
+                    create_betas=True, create_left_hand_pose=True, create_right_hand_pose=True,
+                    create_expression=True, create_jaw_pose=True, create_leye_pose=True,
+                    create_reye_pose=True, create_transl=False, use_pca=True, num_pca_comps=12,
+                    dtype=DTYPE)
+
+models = {}
+
+
+def create_models(batch_size):
+    if batch_size not in models:
+        body_model = smplx.create(batch_size=batch_size, **model_params)
+        camera = create_camera(batch_size=batch_size, focal_length_x=FOCAL_LENGTH,
+                               focal_length_y=FOCAL_LENGTH, dtype=DTYPE)
+        camera.rotation.requires_grad = False
+        models[batch_size] = (body_model, camera)
+    return models[batch_size]
+
+
+def synthetic_keypoints(img_size):
+    """랜덤 체형·자세의 관절을 카메라 앞 20m 에 두고 투영한 OpenPose BODY_25 keypoint"""
+    model = smplx.create(batch_size=1, **dict(model_params, create_body_pose=True))
+    with torch.no_grad():
+        model.betas.normal_(0, 1)
+        model.body_pose.normal_(0, 0.15)
+        model.global_orient.copy_(torch.tensor([[np.pi, rng.uniform(-0.3, 0.3), 0.]]))
+        joints = model(return_verts=False).joints[0].numpy()
+    joints = joints + np.array([0., 0., 20.])
+    h, w = img_size
+    pixels = FOCAL_LENGTH * joints[:, :2] / joints[:, 2:] + np.array([w / 2, h / 2])
+    keypoints = np.concatenate([pixels + rng.normal(0, 1.0, pixels.shape), np.ones((len(pixels), 1))], axis=1)
+    keypoints[[1, 9, 12], 2] = 0      # fit_smplx.yaml 의 joints_to_ign
+    return keypoints[None]
+
+
+imgs = [np.zeros((h, w, 3), dtype=np.uint8) for h, w in IMG_SIZES]
+keypoints = [synthetic_keypoints(size) for size in IMG_SIZES]
+num_joints = keypoints[0].shape[1]
+
+out_dir = tempfile.mkdtemp()
+fit_args = dict(
+    joint_weights=torch.ones(1, num_joints, dtype=DTYPE),
+    body_pose_prior=RestPoseL2Prior(), jaw_prior=None, left_hand_prior=None, right_hand_prior=None,
+    shape_prior=prior.create_prior("l2"), expr_prior=None,
+    angle_prior=prior.create_prior("angle", dtype=DTYPE),
+    use_cuda=False, use_face=False, use_hands=False, interpenetration=False,
+    use_joints_conf=True, save_meshes=False, interactive=False, dtype=DTYPE,
+    data_weights=[1] * 5, body_pose_prior_weights=[404, 404, 57.4, 4.78, 4.78],
+    shape_weights=[100, 50, 10, 5, 5], focal_length=FOCAL_LENGTH,
+    body_tri_idxs=[(5, 12), (2, 9)], maxiters=30, ftol=1e-9, gtol=1e-9, lr=1.0,
+    use_vposer=bool(VPOSER_CKPT), vposer_ckpt=VPOSER_CKPT or "", model_type="smplx")
+
+
+def result_fn(tag, i):
+    return os.path.join(out_dir, f"{tag}_{i}.pkl")
+
+
+def fit_both(tag, **overrides):
+    """모든 사람을 한 배치로 피팅한 결과와 한 사람씩 피팅한 결과의 최대 차이 (파라미터, loss 상대 오차)"""
+    args = dict(fit_args, **overrides)
+    n = len(imgs)
+    batched = fit_multi_frame(imgs, keypoints, create_models,
+                              result_fns=[result_fn(tag + "_batch", i) for i in range(n)],
+                              mesh_fns=[None] * n, **args)
+    single = [fit_multi_frame([imgs[i]], [keypoints[i]], create_models,
+                              result_fns=[result_fn(tag + "_single", i)], mesh_fns=[None], **args)[0]
+              for i in range(n)]
+
+    worst = 0.0
+    for i in range(n):
+        with open(result_fn(tag + "_batch", i), "rb") as f:
+            batch_result = pickle.load(f)
+        with open(result_fn(tag + "_single", i), "rb") as f:
+            single_result = pickle.load(f)
+        for key in single_result:
+            diff = np.abs(np.asarray(batch_result[key]) - np.asarray(single_result[key]))
+            worst = max(worst, float(diff.max()))
+    loss_err = max(abs(a - b) / max(abs(b), 1.0) for a, b in zip(batched, single))
+    print(f"fit_multi_frame ({tag}) losses  batched {np.round(batched, 4).tolist()}  "
+          f"one by one {np.round(single, 4).tolist()}")
+    print(f"fit_multi_frame ({tag}) max |batched - one by one|  params {worst:.2e}  loss (rel) {loss_err:.2e}")
+    return worst, loss_err
+
+
+worst, loss_err = fit_both("stage 0", maxiters=SHORT_MAXITERS, data_weights=[1],
+                           body_pose_prior_weights=[404], shape_weights=[100])
+assert worst < TOL_PARAM and loss_err < TOL_PARAM
+print("OK")
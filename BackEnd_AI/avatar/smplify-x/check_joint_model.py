@@ -0,0 +1,75 @@
+"""
+joint-only forward(JointModel) 가 body_model(...).joints / full_pose 와 같은 값과
+같은 gradient 를 내는지 확인.
+
+smplify-x 폴더에서 실행:  python check_joint_model.py [모델 폴더 (smplx/ 를 포함)]
+"""
+import os
+import sys
+import time
+
+import torch
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "smplifyx"))
+
+import smplx  # noqa: E402
+import registry  # noqa: E402
+import utils  # noqa: E402
+from joint_model import JointModel  # noqa: E402
+
+# ===== 설정 =====
+MODEL_FOLDER = sys.argv[1] if len(sys.argv) > 1 else "models"
+TOL = 1e-10
+
+
+def create_model(batch_size, use_face_contour, dtype=torch.float64):
+    joint_mapper = utils.JointMapper(utils.smpl_to_openpose(
+        "smplx", use_hands=True, use_face=True, use_face_contour=use_face_contour))
+    model = smplx.create(MODEL_FOLDER, model_type="smplx", joint_mapper=joint_mapper,
+                         use_face_contour=use_face_contour, use_pca=True, num_pca_comps=12,
+                         create_global_orient=True, create_body_pose=True, create_betas=True,
+                         create_left_hand_pose=True, create_right_hand_pose=True,
+                         create_expression=True, create_jaw_pose=True,
+                         create_leye_pose=True, create_reye_pose=True,
+                         create_transl=True, batch_size=batch_size, dtype=dtype)
+    with torch.no_grad():
+        for param in model.parameters():
+            param.normal_(0, 0.3)
+    return model
+
+
+torch.manual_seed(0)
+for use_face_contour in (False, True):
+    for batch_size in (1, 4):
+        model = create_model(batch_size, use_face_contour)
+        body_pose = 0.3 * torch.randn(batch_size, 63, dtype=torch.float64)
+
+        full = model(return_verts=True, body_pose=body_pose, return_full_pose=True)
+        joint_model = JointModel(model)
+        out = joint_model(return_verts=False, body_pose=body_pose, return_full_pose=True)
+
+        err_joints = (full.joints - out.joints).abs().max().item()
+        err_pose = (full.full_pose - out.full_pose).abs().max().item()
+        grad_full = torch.autograd.grad(full.joints.square().sum(), model.betas)[0]
+        grad_joint = torch.autograd.grad(out.joints.square().sum(), model.betas)[0]
+        err_grad = (grad_full - grad_joint).abs().max().item()
+
+        print(f"contour={use_face_contour!s:5s} B={batch_size}  skinned={len(joint_model.v_template)}  "
+              f"joints {err_joints:.1e}  full_pose {err_pose:.1e}  d/dbetas {err_grad:.1e}")
+        assert out.vertices is None and out.joints.shape == full.joints.shape
+        assert max(err_joints, err_pose, err_grad) < TOL
+
+# ===== registry: body model 당 한 번만 만들고 재사용 =====
+model = create_model(1, False, dtype=torch.float32)
+assert registry.joint_model(model) is registry.joint_model(model)
+
+# ===== 속도 (참고용) =====
+joint_model = registry.joint_model(model)
+for name, forward in (("full forward", lambda: model(return_verts=True, return_full_pose=True)),
+                      ("joint model", lambda: joint_model(return_full_pose=True))):
+    forward().joints.sum().backward()
+    t0 = time.perf_counter()
+    for _ in range(20):
+        forward().joints.sum().backward()
+    print(f"{name:12s} {(time.perf_counter() - t0) / 20 * 1e3:.1f} ms / forward+backward")
+print("OK")
@@ -278,6 +278,56 @@ def parse_config(argv=None):
                         help='The tolerance threshold for the function')
     parser.add_argument('--maxiters', type=int, default=100,
                         help='The maximum iterations for the optimization')
+    parser.add_argument('--batch_fitting',
+                        type=lambda arg: arg.lower() == 'true',
+                        default=False,
+                        help='Fit several images/persons at once with a' +
+                        ' batched L-BFGS that keeps a separate convergence' +
+                        ' state for every sample')
+    parser.add_argument('--fit_batch_size', type=int, default=8,
+                        help='The number of images/persons fitted together' +
+                        ' when batch_fitting is enabled')
+    parser.add_argument('--parallel_orient',
+                        type=lambda arg: arg.lower() == 'true',
+                        default=False,
+                        help='Fit both orientations of a side view at the' +
+                        ' same time, as a batch of 2, instead of one after' +
+                        ' the other. Always the case with batch_fitting')
+    parser.add_argument('--orient_drop_stage', type=int, default=-1,
+                        help='When both orientations are fitted together,' +
+                        ' drop the clearly worse one after this stage.' +
+                        ' Negative values keep both until the end')
+    parser.add_argument('--orient_drop_ratio', type=float, default=1.5,
+                        help='The loss ratio between the two orientations' +
+                        ' above which the worse one is dropped')
+    parser.add_argument('--warm_start',
+                        type=lambda arg: arg.lower() == 'true',
+                        default=False,
+                        help='Start from the shape, pose and camera stored' +
+                        ' under smplx_init in the keypoint files (e.g. the' +
+                        ' PyMAF-X prediction) instead of the mean pose')
+    parser.add_argument('--warm_start_skip_stages', type=int, default=2,
+                        help='The number of high prior stages skipped when' +
+                        ' the fit is warm started')
+    parser.add_argument('--stage_maxiters', nargs='*', type=int,
+                        default=[],
+                        help='The maximum number of iterations of every' +
+                        ' stage. Stages without a value use maxiters')
+    parser.add_argument('--check_every', type=int, default=1,
+                        help='The number of iterations between two checks' +
+                        ' of the convergence criteria. Every check waits' +
+                        ' for the device')
+    parser.add_argument('--plateau_px', type=float, default=0.0,
+                        help='Stop a stage once the 2D reprojection error' +
+                        ' improved by less than this many pixels during' +
+                        ' the last plateau_patience iterations. 0 disables' +
+                        ' the check')
+    parser.add_argument('--plateau_patience', type=int, default=5,
+                        help='The number of iterations of the plateau window')
+    parser.add_argument('--stage_skip_px', type=float, default=0.0,
+                        help='Skip a stage, except the last one, when the' +
+                        ' reprojection error after the previous stage is' +
+                        ' below this many pixels. 0 never skips')
 
     args = parser.parse_args(argv)
 
@@ -37,7 +37,7 @@ from torch.utils.data import Dataset
 from utils import smpl_to_openpose
 
 Keypoints = namedtuple('Keypoints',
-                       ['keypoints', 'gender_gt', 'gender_pd'])
+                       ['keypoints', 'gender_gt', 'gender_pd', 'init'])
 
 Keypoints.__new__.__defaults__ = (None,) * len(Keypoints._fields)
 
@@ -49,61 +49,117 @@ def create_dataset(dataset='openpose', data_folder='data', **kwargs):
         raise ValueError('Unknown dataset: {}'.format(dataset))
 
 
+def create_joint_weights(use_hands=False, use_face=False,
+                         use_face_contour=False, joints_to_ign=None,
+                         dtype=torch.float32):
+    ''' Returns the weights for the joint terms in the optimization
+
+        The weights only depend on which keypoint groups are used, so they
+        can be created once and shared by every fitted image.
+    '''
+    num_joints = (OpenPose.NUM_BODY_JOINTS +
+                  2 * OpenPose.NUM_HAND_JOINTS * use_hands)
+    optim_weights = np.ones(num_joints + 2 * use_hands +
+                            use_face * 51 +
+                            17 * use_face_contour,
+                            dtype=np.float32)
+
+    # Neck, Left and right hip
+    # These joints are ignored because SMPL has no neck joint and the
+    # annotation of the hips is ambiguous.
+    if joints_to_ign is not None and -1 not in joints_to_ign:
+        optim_weights[joints_to_ign] = 0.
+    return torch.tensor(optim_weights, dtype=dtype)
+
+
+def person_keypoints(person_data, use_hands=True, use_face=True,
+                     use_face_contour=False):
+    ''' Stacks the keypoints of one OpenPose person entry
+
+        Parameters
+        ----------
+        person_data: dict
+            An entry of the `people` list of an OpenPose JSON file. The
+            values can be flat lists, as stored in the file, or arrays of
+            shape Jx3, as handed over in memory by the caller.
+
+        Returns
+        -------
+        keypoints: np.array
+            The body (BODY_25), hand and face keypoints that are used by the
+            current configuration, in the order of the model joint mapping
+    '''
+    body_keypoints = np.array(person_data['pose_keypoints_2d'],
+                              dtype=np.float32)
+    body_keypoints = body_keypoints.reshape([-1, 3])
+    if use_hands:
+        left_hand_keyp = np.array(
+            person_data['hand_left_keypoints_2d'],
+            dtype=np.float32).reshape([-1, 3])
+        right_hand_keyp = np.array(
+            person_data['hand_right_keypoints_2d'],
+            dtype=np.float32).reshape([-1, 3])
+
+        body_keypoints = np.concatenate(
+            [body_keypoints, left_hand_keyp, right_hand_keyp], axis=0)
+    if use_face:
+        # TODO: Make parameters, 17 is the offset for the eye brows,
+        # etc. 51 is the total number of FLAME compatible landmarks
+        face_keypoints = np.array(
+            person_data['face_keypoints_2d'],
+            dtype=np.float32).reshape([-1, 3])[17: 17 + 51, :]
+
+        contour_keyps = np.array(
+            [], dtype=body_keypoints.dtype).reshape(0, 3)
+        if use_face_contour:
+            contour_keyps = np.array(
+                person_data['face_keypoints_2d'],
+                dtype=np.float32).reshape([-1, 3])[:17, :]
+
+        body_keypoints = np.concatenate(
+            [body_keypoints, face_keypoints, contour_keyps], axis=0)
+    return body_keypoints
+
+
 def read_keypoints(keypoint_fn, use_hands=True, use_face=True,
                    use_face_contour=False):
     with open(keypoint_fn) as keypoint_file:
         data = json.load(keypoint_file)
+    return people_keypoints(data['people'], use_hands=use_hands,
+                            use_face=use_face,
+                            use_face_contour=use_face_contour)
+
 
+def people_keypoints(people, use_hands=True, use_face=True,
+                     use_face_contour=False):
     keypoints = []
 
     gender_pd = []
     gender_gt = []
-    for idx, person_data in enumerate(data['people']):
-        body_keypoints = np.array(person_data['pose_keypoints_2d'],
-                                  dtype=np.float32)
-        body_keypoints = body_keypoints.reshape([-1, 3])
-        if use_hands:
-            left_hand_keyp = np.array(
-                person_data['hand_left_keypoints_2d'],
-                dtype=np.float32).reshape([-1, 3])
-            right_hand_keyp = np.array(
-                person_data['hand_right_keypoints_2d'],
-                dtype=np.float32).reshape([-1, 3])
-
-            body_keypoints = np.concatenate(
-                [body_keypoints, left_hand_keyp, right_hand_keyp], axis=0)
-        if use_face:
-            # TODO: Make parameters, 17 is the offset for the eye brows,
-            # etc. 51 is the total number of FLAME compatible landmarks
-            face_keypoints = np.array(
-                person_data['face_keypoints_2d'],
-                dtype=np.float32).reshape([-1, 3])[17: 17 + 51, :]
-
-            contour_keyps = np.array(
-                [], dtype=body_keypoints.dtype).reshape(0, 3)
-            if use_face_contour:
-                contour_keyps = np.array(
-                    person_data['face_keypoints_2d'],
-                    dtype=np.float32).reshape([-1, 3])[:17, :]
-
-            body_keypoints = np.concatenate(
-                [body_keypoints, face_keypoints, contour_keyps], axis=0)
+    # Optional regressor predictions used to warm start the fit
+    init = []
+    for idx, person_data in enumerate(people):
+        body_keypoints = person_keypoints(
+            person_data, use_hands=use_hands, use_face=use_face,
+            use_face_contour=use_face_contour)
 
         if 'gender_pd' in person_data:
             gender_pd.append(person_data['gender_pd'])
         if 'gender_gt' in person_data:
             gender_gt.append(person_data['gender_gt'])
+        init.append(person_data.get('smplx_init'))
 
         keypoints.append(body_keypoints)
 
     return Keypoints(keypoints=keypoints, gender_pd=gender_pd,
-                     gender_gt=gender_gt)
+                     gender_gt=gender_gt, init=init)
 
 
 class OpenPose(Dataset):
 
     NUM_BODY_JOINTS = 25
     NUM_HAND_JOINTS = 20
+    IMG_EXTS = ('.png', '.jpg', '.jpeg', '.bmp')
 
     def __init__(self, data_folder, img_folder='images',
                  keyp_folder='keypoints',
@@ -114,9 +170,18 @@ class OpenPose(Dataset):
                  joints_to_ign=None,
                  use_face_contour=False,
                  openpose_format='coco25',
+                 keypoints=None,
                  **kwargs):
+        ''' keypoints: dict, optional
+                Maps an image name (without extension) to its list of
+                OpenPose person entries (see `person_keypoints`). When given,
+                the keypoints are taken from it instead of the JSON files of
+                `keyp_folder` and images without an entry are skipped.
+        '''
         super(OpenPose, self).__init__()
 
+        self.keypoints = keypoints
+
         self.use_hands = use_hands
         self.use_face = use_face
         self.model_type = model_type
@@ -134,8 +199,7 @@ class OpenPose(Dataset):
 
         self.img_paths = [osp.join(self.img_folder, img_fn)
                           for img_fn in os.listdir(self.img_folder)
-                          if img_fn.endswith('.png') or
-                          img_fn.endswith('.jpg') and
+                          if img_fn.lower().endswith(self.IMG_EXTS) and
                           not img_fn.startswith('.')]
         self.img_paths = sorted(self.img_paths)
         self.cnt = 0
@@ -154,17 +218,11 @@ class OpenPose(Dataset):
 
     def get_joint_weights(self):
         # The weights for the joint terms in the optimization
-        optim_weights = np.ones(self.num_joints + 2 * self.use_hands +
-                                self.use_face * 51 +
-                                17 * self.use_face_contour,
-                                dtype=np.float32)
-
-        # Neck, Left and right hip
-        # These joints are ignored because SMPL has no neck joint and the
-        # annotation of the hips is ambiguous.
-        if self.joints_to_ign is not None and -1 not in self.joints_to_ign:
-            optim_weights[self.joints_to_ign] = 0.
-        return torch.tensor(optim_weights, dtype=self.dtype)
+        return create_joint_weights(use_hands=self.use_hands,
+                                    use_face=self.use_face,
+                                    use_face_contour=self.use_face_contour,
+                                    joints_to_ign=self.joints_to_ign,
+                                    dtype=self.dtype)
 
     def __len__(self):
         return len(self.img_paths)
@@ -174,15 +232,27 @@ class OpenPose(Dataset):
         return self.read_item(img_path)
 
     def read_item(self, img_path):
-        img = cv2.imread(img_path).astype(np.float32)[:, :, ::-1] / 255.0
         img_fn = osp.split(img_path)[1]
         img_fn, _ = osp.splitext(osp.split(img_path)[1])
 
-        keypoint_fn = osp.join(self.keyp_folder,
-                               img_fn + '_keypoints.json')
-        keyp_tuple = read_keypoints(keypoint_fn, use_hands=self.use_hands,
-                                    use_face=self.use_face,
-                                    use_face_contour=self.use_face_contour)
+        if self.keypoints is not None:
+            people = self.keypoints.get(img_fn)
+            if not people:
+                return {}
+            keyp_tuple = people_keypoints(
+                people, use_hands=self.use_hands, use_face=self.use_face,
+                use_face_contour=self.use_face_contour)
+        else:
+            keypoint_fn = osp.join(self.keyp_folder,
+                                   img_fn + '_keypoints.json')
+            if not osp.exists(keypoint_fn):
+                return {}
+            keyp_tuple = read_keypoints(
+                keypoint_fn, use_hands=self.use_hands,
+                use_face=self.use_face,
+                use_face_contour=self.use_face_contour)
+
+        img = cv2.imread(img_path).astype(np.float32)[:, :, ::-1] / 255.0
 
         if len(keyp_tuple.keypoints) < 1:
             return {}
@@ -197,6 +267,9 @@ class OpenPose(Dataset):
         if keyp_tuple.gender_pd is not None:
             if len(keyp_tuple.gender_pd) > 0:
                 output_dict['gender_pd'] = keyp_tuple.gender_pd
+        if keyp_tuple.init is not None:
+            if any(params is not None for params in keyp_tuple.init):
+                output_dict['init'] = keyp_tuple.init
         return output_dict
 
     def __iter__(self):
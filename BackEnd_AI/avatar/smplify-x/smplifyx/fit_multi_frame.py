@@ -0,0 +1,565 @@
+# -*- coding: utf-8 -*-
+
+# Max-Planck-Gesellschaft zur Förderung der Wissenschaften e.V. (MPG) is
+# holder of all proprietary rights on this computer program.
+# You can only use this computer program if you have closed
+# a license agreement with MPG or you get the right to use the computer
+# program from someone who is authorized to grant you that right.
+# Any use of the computer program without a valid license is prohibited and
+# liable to prosecution.
+#
+# Copyright©2019 Max-Planck-Gesellschaft zur Förderung
+# der Wissenschaften e.V. (MPG). acting on behalf of its Max Planck Institute
+# for Intelligent Systems and the Max Planck Institute for Biological
+# Cybernetics. All rights reserved.
+#
+# Contact: ps-license@tuebingen.mpg.de
+
+from __future__ import absolute_import
+from __future__ import print_function
+from __future__ import division
+
+
+import time
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+
+import numpy as np
+import torch
+
+from tqdm import tqdm
+
+import cv2
+
+from optimizers import optim_factory
+
+import fitting
+from fit_single_frame import create_opt_weights, create_collision_modules
+import registry
+
+
+def flip_orientation(global_orient):
+    ''' Rotates an axis-angle global orientation by 180 degrees around the
+        y-axis, i.e. the second hypothesis tried for side views
+    '''
+    flipped_orient = cv2.Rodrigues(global_orient)[0].dot(
+        cv2.Rodrigues(np.array([0., np.pi, 0]))[0])
+    return cv2.Rodrigues(flipped_orient)[0].ravel()
+
+
+def select_orientations(row_person, row_losses, drop_ratio):
+    ''' Returns the rows to keep after dropping clearly worse orientations
+
+        A person fitted with both orientations loses the row whose loss is
+        more than `drop_ratio` times the loss of the other one. Rows of
+        persons with a single orientation, or with close losses, are kept.
+    '''
+    keep = []
+    for row, person_idx in enumerate(row_person):
+        others = [other for other, idx in enumerate(row_person)
+                  if idx == person_idx and other != row]
+        if any(row_losses[row] > drop_ratio * row_losses[other]
+               for other in others):
+            continue
+        keep.append(row)
+    return keep
+
+
+def copy_rows(src_module, dst_module, rows, src_rows):
+    ''' Copies the selected rows of every batched parameter and buffer of a
+        module with `src_rows` rows into one created with len(rows) < src_rows
+        rows. Tensors without a batch dimension have the same shape in both
+        modules and are left untouched.
+    '''
+    num_rows = len(rows)
+    with torch.no_grad():
+        dst_tensors = dict(dst_module.named_parameters())
+        dst_tensors.update(dict(dst_module.named_buffers()))
+        src_tensors = list(src_module.named_parameters()) + list(
+            src_module.named_buffers())
+        for name, src in src_tensors:
+            dst = dst_tensors.get(name)
+            if (dst is None or src.dim() == 0 or
+                    src.shape[0] != src_rows or dst.shape[0] != num_rows or
+                    dst.shape[1:] != src.shape[1:]):
+                continue
+            dst.copy_(src[rows])
+
+
+def fit_multi_frame(imgs,
+                    keypoints,
+                    create_models,
+                    joint_weights,
+                    body_pose_prior,
+                    jaw_prior,
+                    left_hand_prior,
+                    right_hand_prior,
+                    shape_prior,
+                    expr_prior,
+                    angle_prior,
+                    result_fns,
+                    mesh_fns,
+                    loss_type='smplify',
+                    use_cuda=True,
+                    init_joints_idxs=(9, 12, 2, 5),
+                    use_face=True,
+                    use_hands=True,
+                    data_weights=None,
+                    body_pose_prior_weights=None,
+                    hand_pose_prior_weights=None,
+                    jaw_pose_prior_weights=None,
+                    shape_weights=None,
+                    expr_weights=None,
+                    hand_joints_weights=None,
+                    face_joints_weights=None,
+                    depth_loss_weight=1e2,
+                    interpenetration=True,
+                    coll_loss_weights=None,
+                    df_cone_height=0.5,
+                    penalize_outside=True,
+                    max_collisions=8,
+                    point2plane=False,
+                    part_segm_fn='',
+                    focal_length=5000.,
+                    side_view_thsh=25.,
+                    rho=100,
+                    vposer_latent_dim=32,
+                    vposer_ckpt='',
+                    use_joints_conf=False,
+                    interactive=True,
+                    save_meshes=True,
+                    dtype=torch.float32,
+                    ign_part_pairs=None,
+                    left_shoulder_idx=2,
+                    right_shoulder_idx=5,
+                    orient_drop_stage=-1,
+                    orient_drop_ratio=1.5,
+                    init_params=None,
+                    warm_start_skip_stages=2,
+                    stage_stats=None,
+                    **kwargs):
+    ''' Fits the body model to several images/persons at once
+
+        Every person is a row of one batched body model and camera. Side
+        views get a second row initialized with the 180 degree rotated
+        orientation and the row with the lowest final loss is kept, as in
+        `fit_single_frame`. All rows share the forward/backward passes, while
+        the batched L-BFGS and `FittingMonitor.run_batch_fitting` keep the
+        line search and the ftol/gtol checks per row, so a converged person
+        stops being updated while the rest of the batch keeps going.
+
+        With `orient_drop_stage` = k >= 0, the orientation of a side view
+        whose loss after stage k is more than `orient_drop_ratio` times the
+        loss of the other one is dropped: the batch is shrunk to the
+        remaining rows and the following stages only fit those.
+
+        Parameters
+        ----------
+        imgs: list of np.array HxWx3
+            The images of every person
+        keypoints: list of np.array 1xJx3
+            The OpenPose keypoints of every person
+        create_models: callable
+            Called with the number of rows, returns a (body_model, camera)
+            pair created with that batch size
+        result_fns, mesh_fns: list of str
+            The output files of every person
+        orient_drop_stage: int, optional (default = -1)
+            The stage after which clearly worse orientations are dropped.
+            Negative values keep both orientations until the end
+        orient_drop_ratio: float, optional (default = 1.5)
+            The loss ratio above which an orientation is dropped
+        init_params: list of dicts, optional
+            The prediction of a regression network for every person (see
+            `fitting.warm_start_init`). When every person has one, the fit
+            starts from it with a single orientation per person and skips
+            the first `warm_start_skip_stages` stages. Otherwise the default
+            initialization is used for the whole batch
+        warm_start_skip_stages: int, optional (default = 2)
+            The number of high prior stages skipped by a warm start
+        stage_stats: list, optional
+            When given, the per-stage statistics of the stage controller
+            (see `fitting.StageController`) are appended to it
+        Returns
+        -------
+        final_losses: list of float
+            The loss of the kept orientation of every person
+    '''
+    device = torch.device('cuda') if use_cuda else torch.device('cpu')
+    num_persons = len(imgs)
+    assert len(keypoints) == num_persons, (
+        'Got {} images but {} keypoint arrays'.format(num_persons,
+                                                       len(keypoints)))
+
+    if kwargs.pop('visualize', False):
+        print('Visualization is not supported when fitting in batch mode')
+
+    opt_weights = create_opt_weights(
+        use_hands=use_hands, use_face=use_face,
+        interpenetration=interpenetration,
+        data_weights=data_weights,
+        body_pose_prior_weights=body_pose_prior_weights,
+        hand_pose_prior_weights=hand_pose_prior_weights,
+        jaw_pose_prior_weights=jaw_pose_prior_weights,
+        shape_weights=shape_weights,
+        expr_weights=expr_weights,
+        hand_joints_weights=hand_joints_weights,
+        face_joints_weights=face_joints_weights,
+        coll_loss_weights=coll_loss_weights,
+        device=device, dtype=dtype)
+
+    keypoint_data = torch.tensor(
+        np.concatenate([np.asarray(kp).reshape(1, -1, 3)
+                        for kp in keypoints]), dtype=dtype)
+
+    # If the distance between the 2D shoulders is smaller than a
+    # predefined threshold then try 2 fits, the initial one and a 180
+    # degree rotation. Both hypotheses are rows of the same batch.
+    shoulder_dist = torch.norm(
+        keypoint_data[:, left_shoulder_idx, :2] -
+        keypoint_data[:, right_shoulder_idx, :2], dim=-1)
+    try_both_orient = (shoulder_dist < side_view_thsh).tolist()
+
+    warm_start = (init_params is not None and
+                  all(params is not None for params in init_params))
+    if warm_start:
+        # The regressed orientation is kept, no second hypothesis
+        try_both_orient = [False] * num_persons
+
+    row_person, row_flipped = [], []
+    for person_idx in range(num_persons):
+        row_person.append(person_idx)
+        row_flipped.append(False)
+        if try_both_orient[person_idx]:
+            row_person.append(person_idx)
+            row_flipped.append(True)
+    num_rows = len(row_person)
+    row_person_t = torch.tensor(row_person, dtype=torch.long)
+
+    body_model, camera = create_models(num_rows)
+
+    use_vposer = kwargs.get('use_vposer', True)
+    vposer, pose_embedding = [None, ] * 2
+    if use_vposer:
+        pose_embedding = torch.zeros([num_rows, 32],
+                                     dtype=dtype, device=device,
+                                     requires_grad=True)
+
+        # Loaded once per process and shared by every fit
+        vposer = registry.load_vposer(vposer_ckpt, device=device)
+
+    if use_vposer:
+        body_mean_pose = torch.zeros([num_rows, vposer_latent_dim],
+                                     dtype=dtype)
+    else:
+        body_mean_pose = body_pose_prior.get_mean().detach().cpu()
+
+    row_data = keypoint_data[row_person_t]
+    gt_joints = row_data[:, :, :2].to(device=device, dtype=dtype)
+    joints_conf = None
+    if use_joints_conf:
+        joints_conf = row_data[:, :, 2].reshape(num_rows, -1).to(
+            device=device, dtype=dtype)
+
+    # The image size, and with it the data term weight and the principal
+    # point, differ between the rows
+    img_sizes = torch.tensor([imgs[idx].shape[:2] for idx in row_person],
+                             dtype=dtype)
+    data_weight = (1000 / img_sizes[:, 0]).to(device=device)
+    img_centers = img_sizes.flip(dims=[1]) * 0.5
+
+    search_tree, pen_distance, filter_faces = None, None, None
+    if interpenetration:
+        search_tree, pen_distance, filter_faces = create_collision_modules(
+            use_cuda=use_cuda, max_collisions=max_collisions,
+            df_cone_height=df_cone_height, point2plane=point2plane,
+            penalize_outside=penalize_outside, part_segm_fn=part_segm_fn,
+            ign_part_pairs=ign_part_pairs, device=device)
+
+    # The indices of the joints used for the initialization of the camera
+    init_joints_idxs = torch.tensor(init_joints_idxs, device=device)
+
+    # Only the batched L-BFGS keeps a separate state for every row
+    optim_type = kwargs.get('optim_type', 'batch_lbfgs')
+    if optim_type != 'batch_lbfgs':
+        print('Batch fitting replaces the configured optimizer {} with'
+              ' batch_lbfgs'.format(optim_type))
+    optim_kwargs = dict(kwargs, optim_type='batch_lbfgs')
+
+    warm_params, warm_embedding = None, None
+    if warm_start:
+        warm_params, warm_embedding, init_t = fitting.warm_start_init(
+            [init_params[idx] for idx in row_person], body_model,
+            vposer=vposer, use_vposer=use_vposer,
+            focal_length=focal_length, dtype=dtype)
+        body_model.reset_params(**warm_params)
+        if use_vposer:
+            with torch.no_grad():
+                pose_embedding.copy_(warm_embedding)
+        # Always run at least the last stage
+        warm_start_skip_stages = min(warm_start_skip_stages,
+                                     len(opt_weights) - 1)
+    else:
+        body_model.reset_params(body_pose=body_mean_pose)
+
+        edge_indices = kwargs.get('body_tri_idxs')
+        init_t = fitting.guess_init(
+            body_model, gt_joints, edge_indices,
+            use_vposer=use_vposer, vposer=vposer,
+            pose_embedding=pose_embedding,
+            model_type=kwargs.get('model_type', 'smpl'),
+            focal_length=focal_length, dtype=dtype)
+
+    camera_loss = fitting.create_loss('camera_init',
+                                      trans_estimation=init_t,
+                                      init_joints_idxs=init_joints_idxs,
+                                      depth_loss_weight=depth_loss_weight,
+                                      reduction='none',
+                                      dtype=dtype).to(device=device)
+    camera_loss.trans_estimation[:] = init_t
+
+    loss = fitting.create_loss(loss_type=loss_type,
+                               joint_weights=joint_weights,
+                               rho=rho,
+                               use_joints_conf=use_joints_conf,
+                               use_face=use_face, use_hands=use_hands,
+                               vposer=vposer,
+                               pose_embedding=pose_embedding,
+                               body_pose_prior=body_pose_prior,
+                               shape_prior=shape_prior,
+                               angle_prior=angle_prior,
+                               expr_prior=expr_prior,
+                               left_hand_prior=left_hand_prior,
+                               right_hand_prior=right_hand_prior,
+                               jaw_prior=jaw_prior,
+                               interpenetration=interpenetration,
+                               pen_distance=pen_distance,
+                               search_tree=search_tree,
+                               tri_filtering_module=filter_faces,
+                               reduction='none',
+                               dtype=dtype,
+                               **kwargs)
+    loss = loss.to(device=device)
+
+    with fitting.FittingMonitor(visualize=False, **kwargs) as monitor:
+
+        camera_loss.reset_loss_weights({'data_weight': data_weight})
+
+        # Update the value of the translation of the camera as well as
+        # the image center.
+        with torch.no_grad():
+            camera.translation[:] = init_t.view_as(camera.translation)
+            camera.center[:] = img_centers.to(device=camera.center.device)
+
+        # Re-enable gradient calculation for the camera translation
+        camera.translation.requires_grad = True
+
+        camera_opt_params = [camera.translation, body_model.global_orient]
+
+        camera_optimizer, camera_create_graph = \
+            optim_factory.create_optimizer(camera_opt_params, **optim_kwargs)
+
+        fit_camera = monitor.create_fitting_closure(
+            camera_optimizer, body_model, camera, gt_joints,
+            camera_loss, create_graph=camera_create_graph,
+            use_vposer=use_vposer, vposer=vposer,
+            pose_embedding=pose_embedding,
+            return_full_pose=False, return_verts=False)
+
+        # Step 1: Optimize over the torso joints the camera translation
+        camera_init_start = time.time()
+        cam_init_loss_val = monitor.run_batch_fitting(
+            camera_optimizer, fit_camera, camera_opt_params, body_model,
+            use_vposer=use_vposer, pose_embedding=pose_embedding,
+            vposer=vposer)
+
+        if interactive:
+            if use_cuda and torch.cuda.is_available():
+                torch.cuda.synchronize()
+            tqdm.write('Camera initialization of {} rows done after '
+                       '{:.4f}'.format(num_rows,
+                                       time.time() - camera_init_start))
+            tqdm.write('Camera initialization final loss {:.4f}'.format(
+                cam_init_loss_val.sum().item()))
+
+        # Rotate the second row of every side view by 180 degrees
+        orientations = body_model.global_orient.detach().cpu().numpy()
+        for row, flipped in enumerate(row_flipped):
+            if flipped:
+                orientations[row] = flip_orientation(orientations[row])
+
+        if warm_start:
+            body_model.reset_params(
+                **dict(warm_params, global_orient=orientations))
+        else:
+            body_model.reset_params(global_orient=orientations,
+                                    body_pose=body_mean_pose)
+        if use_vposer:
+            with torch.no_grad():
+                if warm_start:
+                    pose_embedding.copy_(warm_embedding)
+                else:
+                    pose_embedding.fill_(0)
+
+        # Step 2: Optimize the full model
+        opt_start = time.time()
+        final_loss_val = None
+        orient_checked = False
+        for opt_idx, curr_weights in enumerate(
+                tqdm(opt_weights, desc='Stage')):
+            if warm_start and opt_idx < warm_start_skip_stages:
+                continue
+            if monitor.controller.skip_stage(opt_idx, len(opt_weights)):
+                if interactive:
+                    tqdm.write('Stage {:03d} skipped'.format(opt_idx))
+                continue
+
+            body_params = list(body_model.parameters())
+
+            final_params = list(
+                filter(lambda x: x.requires_grad, body_params))
+
+            if use_vposer:
+                final_params.append(pose_embedding)
+
+            body_optimizer, body_create_graph = \
+                optim_factory.create_optimizer(final_params, **optim_kwargs)
+            body_optimizer.zero_grad()
+
+            curr_weights['data_weight'] = data_weight
+            curr_weights['bending_prior_weight'] = (
+                3.17 * curr_weights['body_pose_weight'])
+            if use_hands:
+                joint_weights[:, 25:67] = curr_weights['hand_weight']
+            if use_face:
+                joint_weights[:, 67:] = curr_weights['face_weight']
+            loss.reset_loss_weights(curr_weights)
+
+            closure = monitor.create_fitting_closure(
+                body_optimizer, body_model,
+                camera=camera, gt_joints=gt_joints,
+                joints_conf=joints_conf,
+                joint_weights=joint_weights,
+                loss=loss, create_graph=body_create_graph,
+                use_vposer=use_vposer, vposer=vposer,
+                pose_embedding=pose_embedding,
+                return_verts=loss.uses_vertices(),
+                return_full_pose=True)
+
+            if interactive:
+                if use_cuda and torch.cuda.is_available():
+                    torch.cuda.synchronize()
+                stage_start = time.time()
+            monitor.controller.start_stage(opt_idx)
+            final_loss_val = monitor.run_batch_fitting(
+                body_optimizer,
+                closure, final_params,
+                body_model,
+                pose_embedding=pose_embedding, vposer=vposer,
+                use_vposer=use_vposer)
+
+            if interactive:
+                if use_cuda and torch.cuda.is_available():
+                    torch.cuda.synchronize()
+                elapsed = time.time() - stage_start
+                record = monitor.controller.records[-1]
+                tqdm.write('Stage {:03d} done after {:.4f} seconds, {} '
+                           'iterations ({}), reprojection error {:.2f} '
+                           'px'.format(opt_idx, elapsed, record['iters'],
+                                       record['stop'], record['reproj_px']))
+
+            # The first stage that runs from `orient_drop_stage` on, in case
+            # the stage controller skipped it
+            if 0 <= orient_drop_stage <= opt_idx and not orient_checked and \
+                    opt_idx < len(opt_weights) - 1:
+                orient_checked = True
+                keep = select_orientations(
+                    row_person, final_loss_val.tolist(), orient_drop_ratio)
+                if len(keep) < num_rows:
+                    if interactive:
+                        tqdm.write('Dropping orientation rows {} after stage '
+                                   '{:03d}'.format(
+                                       sorted(set(range(num_rows)) -
+                                              set(keep)), opt_idx))
+                    keep_t = torch.tensor(keep, dtype=torch.long,
+                                          device=device)
+                    row_person = [row_person[row] for row in keep]
+                    row_flipped = [row_flipped[row] for row in keep]
+
+                    new_body_model, new_camera = create_models(len(keep))
+                    copy_rows(body_model, new_body_model, keep_t, num_rows)
+                    copy_rows(camera, new_camera, keep_t, num_rows)
+                    num_rows = len(keep)
+                    body_model, camera = new_body_model, new_camera
+
+                    if use_vposer:
+                        pose_embedding = pose_embedding.detach()[
+                            keep_t].clone().requires_grad_(True)
+                    gt_joints = gt_joints[keep_t]
+                    if use_joints_conf:
+                        joints_conf = joints_conf[keep_t]
+                    data_weight = data_weight[keep_t]
+                    final_loss_val = final_loss_val[keep_t]
+
+        if interactive:
+            if use_cuda and torch.cuda.is_available():
+                torch.cuda.synchronize()
+            tqdm.write('Batch fitting of {} rows done after {:.4f} '
+                       'seconds'.format(num_rows, time.time() - opt_start))
+
+        if stage_stats is not None:
+            stage_stats.extend(monitor.controller.records)
+
+    # Keep, for every person, the orientation with the lowest error
+    final_loss_val = final_loss_val.detach().cpu()
+    best_rows = []
+    for person_idx in range(num_persons):
+        rows = [row for row, idx in enumerate(row_person)
+                if idx == person_idx]
+        best_rows.append(min(rows, key=lambda row: final_loss_val[row]))
+
+    camera_params = {'camera_' + str(key): val.detach().cpu().numpy()
+                     for key, val in camera.named_parameters()}
+    model_params = {key: val.detach().cpu().numpy()
+                    for key, val in body_model.named_parameters()}
+    if use_vposer:
+        model_params['body_pose'] = pose_embedding.detach().cpu().numpy()
+
+    for person_idx, row in enumerate(best_rows):
+        result = {key: val[row:row + 1] for key, val in camera_params.items()}
+        result.update({key: val[row:row + 1]
+                       for key, val in model_params.items()})
+        with open(result_fns[person_idx], 'wb') as result_file:
+            pickle.dump(result, result_file, protocol=2)
+
+    if save_meshes:
+        import trimesh
+
+        with torch.no_grad():
+            body_pose = vposer.decode(
+                pose_embedding,
+                output_type='aa').view(num_rows, -1) if use_vposer else None
+
+            model_type = kwargs.get('model_type', 'smpl')
+            append_wrists = model_type == 'smpl' and use_vposer
+            if append_wrists:
+                wrist_pose = torch.zeros([body_pose.shape[0], 6],
+                                         dtype=body_pose.dtype,
+                                         device=body_pose.device)
+                body_pose = torch.cat([body_pose, wrist_pose], dim=1)
+
+            model_output = body_model(return_verts=True, body_pose=body_pose)
+        vertices = model_output.vertices.detach().cpu().numpy()
+
+        rot = trimesh.transformations.rotation_matrix(
+            np.radians(180), [1, 0, 0])
+        for person_idx, row in enumerate(best_rows):
+            out_mesh = trimesh.Trimesh(vertices[row], body_model.faces,
+                                       process=False)
+            out_mesh.apply_transform(rot)
+            out_mesh.export(mesh_fns[person_idx])
+
+    return [final_loss_val[row].item() for row in best_rows]
@@ -28,7 +28,6 @@ except ImportError:
 
 import sys
 import os
-import os.path as osp
 
 import numpy as np
 import torch
@@ -43,68 +42,27 @@ import PIL.Image as pil_img
 from optimizers import optim_factory
 
 import fitting
-from human_body_prior.tools.model_loader import load_vposer
-
-
-def fit_single_frame(img,
-                     keypoints,
-                     body_model,
-                     camera,
-                     joint_weights,
-                     body_pose_prior,
-                     jaw_prior,
-                     left_hand_prior,
-                     right_hand_prior,
-                     shape_prior,
-                     expr_prior,
-                     angle_prior,
-                     result_fn='out.pkl',
-                     mesh_fn='out.obj',
-                     out_img_fn='overlay.png',
-                     loss_type='smplify',
-                     use_cuda=True,
-                     init_joints_idxs=(9, 12, 2, 5),
-                     use_face=True,
-                     use_hands=True,
-                     data_weights=None,
-                     body_pose_prior_weights=None,
-                     hand_pose_prior_weights=None,
-                     jaw_pose_prior_weights=None,
-                     shape_weights=None,
-                     expr_weights=None,
-                     hand_joints_weights=None,
-                     face_joints_weights=None,
-                     depth_loss_weight=1e2,
-                     interpenetration=True,
-                     coll_loss_weights=None,
-                     df_cone_height=0.5,
-                     penalize_outside=True,
-                     max_collisions=8,
-                     point2plane=False,
-                     part_segm_fn='',
-                     focal_length=5000.,
-                     side_view_thsh=25.,
-                     rho=100,
-                     vposer_latent_dim=32,
-                     vposer_ckpt='',
-                     use_joints_conf=False,
-                     interactive=True,
-                     visualize=False,
-                     save_meshes=True,
-                     degrees=None,
-                     batch_size=1,
-                     dtype=torch.float32,
-                     ign_part_pairs=None,
-                     left_shoulder_idx=2,
-                     right_shoulder_idx=5,
-                     **kwargs):
-    assert batch_size == 1, 'PyTorch L-BFGS only supports batch_size == 1'
-
-    device = torch.device('cuda') if use_cuda else torch.device('cpu')
-
-    if degrees is None:
-        degrees = [0, 90, 180, 270]
-
+import registry
+
+
+def create_opt_weights(use_hands=True, use_face=True, interpenetration=True,
+                       data_weights=None,
+                       body_pose_prior_weights=None,
+                       hand_pose_prior_weights=None,
+                       jaw_pose_prior_weights=None,
+                       shape_weights=None,
+                       expr_weights=None,
+                       hand_joints_weights=None,
+                       face_joints_weights=None,
+                       coll_loss_weights=None,
+                       device=None, dtype=torch.float32):
+    ''' Creates the loss weights of every optimization stage
+
+        Returns
+        -------
+            opt_weights: list of dicts
+                One dictionary of weight tensors per stage
+    '''
     if data_weights is None:
         data_weights = [1, ] * 5
 
@@ -177,6 +135,159 @@ def fit_single_frame(img,
     assert (len(coll_loss_weights) ==
             len(body_pose_prior_weights)), msg
 
+    # Weights used for the pose prior and the shape prior
+    opt_weights_dict = {'data_weight': data_weights,
+                        'body_pose_weight': body_pose_prior_weights,
+                        'shape_weight': shape_weights}
+    if use_face:
+        opt_weights_dict['face_weight'] = face_joints_weights
+        opt_weights_dict['expr_prior_weight'] = expr_weights
+        opt_weights_dict['jaw_prior_weight'] = jaw_pose_prior_weights
+    if use_hands:
+        opt_weights_dict['hand_weight'] = hand_joints_weights
+        opt_weights_dict['hand_prior_weight'] = hand_pose_prior_weights
+    if interpenetration:
+        opt_weights_dict['coll_loss_weight'] = coll_loss_weights
+
+    keys = opt_weights_dict.keys()
+    opt_weights = [dict(zip(keys, vals)) for vals in
+                   zip(*(opt_weights_dict[k] for k in keys
+                         if opt_weights_dict[k] is not None))]
+    for weight_list in opt_weights:
+        for key in weight_list:
+            weight_list[key] = torch.tensor(weight_list[key],
+                                            device=device,
+                                            dtype=dtype)
+
+    return opt_weights
+
+
+def create_collision_modules(use_cuda=True, max_collisions=8,
+                             df_cone_height=0.5, point2plane=False,
+                             penalize_outside=True, part_segm_fn='',
+                             ign_part_pairs=None, device=None):
+    ''' Creates the BVH search tree, the penetration distance and the
+        optional face filtering module of the interpenetration term
+
+        The search tree runs on the device of the vertices, with the CUDA
+        or the CPU backend of `mesh_intersection`.
+    '''
+    from mesh_intersection.bvh_search_tree import BVH
+    import mesh_intersection.loss as collisions_loss
+    from mesh_intersection.filter_faces import FilterFaces
+
+    search_tree = BVH(max_collisions=max_collisions)
+
+    pen_distance = \
+        collisions_loss.DistanceFieldPenetrationLoss(
+            sigma=df_cone_height, point2plane=point2plane,
+            vectorized=True, penalize_outside=penalize_outside)
+
+    filter_faces = None
+    if part_segm_fn:
+        # Read the part segmentation
+        part_segm_fn = os.path.expandvars(part_segm_fn)
+        with open(part_segm_fn, 'rb') as faces_parents_file:
+            face_segm_data = pickle.load(faces_parents_file,
+                                         encoding='latin1')
+        faces_segm = face_segm_data['segm']
+        faces_parents = face_segm_data['parents']
+        # Create the module used to filter invalid collision pairs
+        filter_faces = FilterFaces(
+            faces_segm=faces_segm, faces_parents=faces_parents,
+            ign_part_pairs=ign_part_pairs).to(device=device)
+
+    return search_tree, pen_distance, filter_faces
+
+
+def fit_single_frame(img,
+                     keypoints,
+                     body_model,
+                     camera,
+                     joint_weights,
+                     body_pose_prior,
+                     jaw_prior,
+                     left_hand_prior,
+                     right_hand_prior,
+                     shape_prior,
+                     expr_prior,
+                     angle_prior,
+                     result_fn='out.pkl',
+                     mesh_fn='out.obj',
+                     out_img_fn='overlay.png',
+                     loss_type='smplify',
+                     use_cuda=True,
+                     init_joints_idxs=(9, 12, 2, 5),
+                     use_face=True,
+                     use_hands=True,
+                     data_weights=None,
+                     body_pose_prior_weights=None,
+                     hand_pose_prior_weights=None,
+                     jaw_pose_prior_weights=None,
+                     shape_weights=None,
+                     expr_weights=None,
+                     hand_joints_weights=None,
+                     face_joints_weights=None,
+                     depth_loss_weight=1e2,
+                     interpenetration=True,
+                     coll_loss_weights=None,
+                     df_cone_height=0.5,
+                     penalize_outside=True,
+                     max_collisions=8,
+                     point2plane=False,
+                     part_segm_fn='',
+                     focal_length=5000.,
+                     side_view_thsh=25.,
+                     rho=100,
+                     vposer_latent_dim=32,
+                     vposer_ckpt='',
+                     use_joints_conf=False,
+                     interactive=True,
+                     visualize=False,
+                     save_meshes=True,
+                     degrees=None,
+                     batch_size=1,
+                     dtype=torch.float32,
+                     ign_part_pairs=None,
+                     left_shoulder_idx=2,
+                     right_shoulder_idx=5,
+                     init_params=None,
+                     warm_start_skip_stages=2,
+                     stage_stats=None,
+                     **kwargs):
+    ''' Fits the body model to the keypoints of one person
+
+        With `init_params` (see `fitting.warm_start_init`), the shape, pose,
+        global orientation and camera translation start from the given
+        prediction instead of the mean pose and the limb length heuristic,
+        only the given orientation is fitted, and the first
+        `warm_start_skip_stages` stages, with the strongest priors, are
+        skipped.
+
+        When `stage_stats` is a list, the per-stage statistics of the stage
+        controller (see `fitting.StageController`) are appended to it.
+    '''
+    assert batch_size == 1, 'PyTorch L-BFGS only supports batch_size == 1'
+
+    device = torch.device('cuda') if use_cuda else torch.device('cpu')
+
+    if degrees is None:
+        degrees = [0, 90, 180, 270]
+
+    opt_weights = create_opt_weights(
+        use_hands=use_hands, use_face=use_face,
+        interpenetration=interpenetration,
+        data_weights=data_weights,
+        body_pose_prior_weights=body_pose_prior_weights,
+        hand_pose_prior_weights=hand_pose_prior_weights,
+        jaw_pose_prior_weights=jaw_pose_prior_weights,
+        shape_weights=shape_weights,
+        expr_weights=expr_weights,
+        hand_joints_weights=hand_joints_weights,
+        face_joints_weights=face_joints_weights,
+        coll_loss_weights=coll_loss_weights,
+        device=device, dtype=dtype)
+
     use_vposer = kwargs.get('use_vposer', True)
     vposer, pose_embedding = [None, ] * 2
     if use_vposer:
@@ -184,10 +295,8 @@ def fit_single_frame(img,
                                      dtype=dtype, device=device,
                                      requires_grad=True)
 
-        vposer_ckpt = osp.expandvars(vposer_ckpt)
-        vposer, _ = load_vposer(vposer_ckpt, vp_model='snapshot')
-        vposer = vposer.to(device=device)
-        vposer.eval()
+        # Loaded once per process and shared by every fit
+        vposer = registry.load_vposer(vposer_ckpt, device=device)
 
     if use_vposer:
         body_mean_pose = torch.zeros([batch_size, vposer_latent_dim],
@@ -206,72 +315,33 @@ def fit_single_frame(img,
         joints_conf = joints_conf.to(device=device, dtype=dtype)
 
     # Create the search tree
-    search_tree = None
-    pen_distance = None
-    filter_faces = None
+    search_tree, pen_distance, filter_faces = None, None, None
     if interpenetration:
-        from mesh_intersection.bvh_search_tree import BVH
-        import mesh_intersection.loss as collisions_loss
-        from mesh_intersection.filter_faces import FilterFaces
-
-        assert use_cuda, 'Interpenetration term can only be used with CUDA'
-        assert torch.cuda.is_available(), \
-            'No CUDA Device! Interpenetration term can only be used' + \
-            ' with CUDA'
-
-        search_tree = BVH(max_collisions=max_collisions)
-
-        pen_distance = \
-            collisions_loss.DistanceFieldPenetrationLoss(
-                sigma=df_cone_height, point2plane=point2plane,
-                vectorized=True, penalize_outside=penalize_outside)
-
-        if part_segm_fn:
-            # Read the part segmentation
-            part_segm_fn = os.path.expandvars(part_segm_fn)
-            with open(part_segm_fn, 'rb') as faces_parents_file:
-                face_segm_data = pickle.load(faces_parents_file,
-                                             encoding='latin1')
-            faces_segm = face_segm_data['segm']
-            faces_parents = face_segm_data['parents']
-            # Create the module used to filter invalid collision pairs
-            filter_faces = FilterFaces(
-                faces_segm=faces_segm, faces_parents=faces_parents,
-                ign_part_pairs=ign_part_pairs).to(device=device)
-
-    # Weights used for the pose prior and the shape prior
-    opt_weights_dict = {'data_weight': data_weights,
-                        'body_pose_weight': body_pose_prior_weights,
-                        'shape_weight': shape_weights}
-    if use_face:
-        opt_weights_dict['face_weight'] = face_joints_weights
-        opt_weights_dict['expr_prior_weight'] = expr_weights
-        opt_weights_dict['jaw_prior_weight'] = jaw_pose_prior_weights
-    if use_hands:
-        opt_weights_dict['hand_weight'] = hand_joints_weights
-        opt_weights_dict['hand_prior_weight'] = hand_pose_prior_weights
-    if interpenetration:
-        opt_weights_dict['coll_loss_weight'] = coll_loss_weights
-
-    keys = opt_weights_dict.keys()
-    opt_weights = [dict(zip(keys, vals)) for vals in
-                   zip(*(opt_weights_dict[k] for k in keys
-                         if opt_weights_dict[k] is not None))]
-    for weight_list in opt_weights:
-        for key in weight_list:
-            weight_list[key] = torch.tensor(weight_list[key],
-                                            device=device,
-                                            dtype=dtype)
+        search_tree, pen_distance, filter_faces = create_collision_modules(
+            use_cuda=use_cuda, max_collisions=max_collisions,
+            df_cone_height=df_cone_height, point2plane=point2plane,
+            penalize_outside=penalize_outside, part_segm_fn=part_segm_fn,
+            ign_part_pairs=ign_part_pairs, device=device)
 
     # The indices of the joints used for the initialization of the camera
     init_joints_idxs = torch.tensor(init_joints_idxs, device=device)
 
-    edge_indices = kwargs.get('body_tri_idxs')
-    init_t = fitting.guess_init(body_model, gt_joints, edge_indices,
-                                use_vposer=use_vposer, vposer=vposer,
-                                pose_embedding=pose_embedding,
-                                model_type=kwargs.get('model_type', 'smpl'),
-                                focal_length=focal_length, dtype=dtype)
+    warm_params, warm_embedding = None, None
+    if init_params is not None:
+        warm_params, warm_embedding, init_t = fitting.warm_start_init(
+            [init_params], body_model, vposer=vposer, use_vposer=use_vposer,
+            focal_length=focal_length, dtype=dtype)
+        # Always run at least the last stage
+        warm_start_skip_stages = min(warm_start_skip_stages,
+                                     len(opt_weights) - 1)
+    else:
+        edge_indices = kwargs.get('body_tri_idxs')
+        init_t = fitting.guess_init(
+            body_model, gt_joints, edge_indices,
+            use_vposer=use_vposer, vposer=vposer,
+            pose_embedding=pose_embedding,
+            model_type=kwargs.get('model_type', 'smpl'),
+            focal_length=focal_length, dtype=dtype)
 
     camera_loss = fitting.create_loss('camera_init',
                                       trans_estimation=init_t,
@@ -315,14 +385,21 @@ def fit_single_frame(img,
 
         # Reset the parameters to estimate the initial translation of the
         # body model
-        body_model.reset_params(body_pose=body_mean_pose)
+        if warm_params is not None:
+            body_model.reset_params(**warm_params)
+            if use_vposer:
+                with torch.no_grad():
+                    pose_embedding.copy_(warm_embedding)
+        else:
+            body_model.reset_params(body_pose=body_mean_pose)
 
         # If the distance between the 2D shoulders is smaller than a
         # predefined threshold then try 2 fits, the initial one and a 180
-        # degree rotation
+        # degree rotation. A warm start already knows the orientation.
         shoulder_dist = torch.dist(gt_joints[:, left_shoulder_idx],
                                    gt_joints[:, right_shoulder_idx])
-        try_both_orient = shoulder_dist.item() < side_view_thsh
+        try_both_orient = (shoulder_dist.item() < side_view_thsh and
+                           warm_params is None)
 
         # Update the value of the translation of the camera as well as
         # the image center.
@@ -391,14 +468,28 @@ def fit_single_frame(img,
         for or_idx, orient in enumerate(tqdm(orientations, desc='Orientation')):
             opt_start = time.time()
 
-            new_params = defaultdict(global_orient=orient,
-                                     body_pose=body_mean_pose)
+            if warm_params is not None:
+                new_params = dict(warm_params, global_orient=orient)
+            else:
+                new_params = defaultdict(global_orient=orient,
+                                         body_pose=body_mean_pose)
             body_model.reset_params(**new_params)
+            monitor.controller.reset()
             if use_vposer:
                 with torch.no_grad():
-                    pose_embedding.fill_(0)
+                    if warm_params is not None:
+                        pose_embedding.copy_(warm_embedding)
+                    else:
+                        pose_embedding.fill_(0)
 
             for opt_idx, curr_weights in enumerate(tqdm(opt_weights, desc='Stage')):
+                if warm_params is not None and \
+                        opt_idx < warm_start_skip_stages:
+                    continue
+                if monitor.controller.skip_stage(opt_idx, len(opt_weights)):
+                    if interactive:
+                        tqdm.write('Stage {:03d} skipped'.format(opt_idx))
+                    continue
 
                 body_params = list(body_model.parameters())
 
@@ -430,12 +521,14 @@ def fit_single_frame(img,
                     loss=loss, create_graph=body_create_graph,
                     use_vposer=use_vposer, vposer=vposer,
                     pose_embedding=pose_embedding,
-                    return_verts=True, return_full_pose=True)
+                    return_verts=loss.uses_vertices(),
+                    return_full_pose=True)
 
                 if interactive:
                     if use_cuda and torch.cuda.is_available():
                         torch.cuda.synchronize()
                     stage_start = time.time()
+                monitor.controller.start_stage(opt_idx)
                 final_loss_val = monitor.run_fitting(
                     body_optimizer,
                     closure, final_params,
@@ -447,9 +540,12 @@ def fit_single_frame(img,
                     if use_cuda and torch.cuda.is_available():
                         torch.cuda.synchronize()
                     elapsed = time.time() - stage_start
-                    if interactive:
-                        tqdm.write('Stage {:03d} done after {:.4f} seconds'.format(
-                            opt_idx, elapsed))
+                    record = monitor.controller.records[-1]
+                    tqdm.write('Stage {:03d} done after {:.4f} seconds, {} '
+                               'iterations ({}), reprojection error {:.2f} '
+                               'px'.format(opt_idx, elapsed, record['iters'],
+                                           record['stop'],
+                                           record['reproj_px']))
 
             if interactive:
                 if use_cuda and torch.cuda.is_available():
@@ -482,6 +578,9 @@ def fit_single_frame(img,
                 min_idx = 0
             pickle.dump(results[min_idx]['result'], result_file, protocol=2)
 
+        if stage_stats is not None:
+            stage_stats.extend(monitor.controller.records)
+
     if save_meshes or visualize:
         body_pose = vposer.decode(
             pose_embedding,
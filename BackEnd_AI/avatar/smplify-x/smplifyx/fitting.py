@@ -30,6 +30,7 @@ import torch
 import torch.nn as nn
 
 from mesh_viewer import MeshViewer
+import registry
 import utils
 
 
@@ -72,7 +73,8 @@ def guess_init(model,
     '''
 
     body_pose = vposer.decode(
-        pose_embedding, output_type='aa').view(1, -1) if use_vposer else None
+        pose_embedding, output_type='aa').view(
+            pose_embedding.shape[0], -1) if use_vposer else None
     if use_vposer and model_type == 'smpl':
         wrist_pose = torch.zeros([body_pose.shape[0], 6],
                                  dtype=body_pose.dtype,
@@ -110,6 +112,231 @@ def guess_init(model,
     return init_t
 
 
+@torch.no_grad()
+def warm_start_init(init_params, model, vposer=None, use_vposer=True,
+                    focal_length=5000, dtype=torch.float32):
+    ''' Converts the predictions of a regression network (e.g. PyMAF-X)
+        into the initial values of the fit
+
+        Parameters
+        ----------
+        init_params: list of dicts
+            One dictionary for every row of the body model with the keys
+            `betas`, `global_orient` (axis-angle, 3), `body_pose`
+            (axis-angle, 63) and `camera_translation` (3). The translation
+            is given for a camera with the principal point at the image
+            center and the focal length `focal_length` of the dictionary
+            (default = 5000)
+        model: nn.Module
+            The PyTorch module of the body
+        vposer: nn.Module, optional (None)
+            The V-Poser module used to encode the body pose
+        focal_length: float, optional (default = 5000)
+            The focal length of the camera of the fit
+        Returns
+        -------
+        model_params: dict
+            The `betas`, `global_orient` and, without V-Poser, `body_pose`
+            arrays to pass to `model.reset_params`
+        pose_embedding: torch.tensor Bx32 or None
+            The V-Poser code of the body pose
+        init_t: torch.tensor Bx3
+            The camera translation
+    '''
+    def stack(key, dim):
+        values = np.zeros([len(init_params), dim], dtype=np.float32)
+        for row, params in enumerate(init_params):
+            value = np.asarray(params[key], dtype=np.float32).reshape(-1)
+            values[row, :min(dim, value.shape[0])] = value[:dim]
+        return values
+
+    device = model.betas.device
+    model_params = {'betas': stack('betas', model.betas.shape[1]),
+                    'global_orient': stack('global_orient', 3)}
+
+    pose_embedding = None
+    body_pose = stack('body_pose', 63)
+    if use_vposer:
+        pose_embedding = vposer.encode(
+            torch.tensor(body_pose, dtype=dtype, device=device)).mean
+    else:
+        model_params['body_pose'] = stack('body_pose',
+                                          model.body_pose.shape[1])
+
+    # The depth scales with the focal length, the offset in the image plane
+    # does not
+    init_t = torch.tensor(stack('camera_translation', 3), dtype=dtype,
+                          device=device)
+    init_t[:, 2] *= torch.tensor(
+        [focal_length / float(params.get('focal_length', 5000))
+         for params in init_params], dtype=dtype, device=device)
+    return model_params, pose_embedding, init_t
+
+
+def reprojection_error(projected_joints, gt_joints, weights):
+    ''' Mean distance in pixels between the projected joints and the 2D
+        detections, over the joints with a positive weight
+
+        Returns
+        -------
+            error: torch.tensor, B
+                The error of every sample
+    '''
+    dist = (projected_joints - gt_joints).norm(dim=-1)
+    valid = (weights > 0).to(dtype=dist.dtype)
+    return (dist * valid).sum(dim=-1) / valid.sum(dim=-1).clamp(min=1)
+
+
+class StageController(object):
+    ''' Decides how long every stage of the annealing runs
+
+        Parameters
+        ----------
+            maxiters: int
+                The iteration budget of a stage
+            stage_maxiters: list of ints, optional
+                Per-stage budgets. Stages past the end of the list use
+                `maxiters`
+            check_every: int, optional (default = 1)
+                The number of iterations between two convergence checks.
+                Every check synchronizes with the device
+            plateau_px: float, optional (default = 0)
+                A stage stops once the 2D reprojection error improved by
+                less than this many pixels over the last `plateau_patience`
+                iterations. Disabled when 0
+            plateau_patience: int, optional (default = 5)
+                The number of iterations of the plateau window
+            stage_skip_px: float, optional (default = 0)
+                A stage is skipped when the reprojection error after the
+                previous stage is already below this many pixels. The last
+                stage always runs. Disabled when 0
+    '''
+
+    def __init__(self, maxiters=100, stage_maxiters=None, check_every=1,
+                 plateau_px=0.0, plateau_patience=5, stage_skip_px=0.0,
+                 **kwargs):
+        super(StageController, self).__init__()
+
+        self.maxiters = maxiters
+        self.stage_maxiters = list(stage_maxiters or [])
+        self.check_every = max(int(check_every), 1)
+        self.plateau_px = plateau_px
+        self.plateau_patience = max(int(plateau_patience), 1)
+        self.stage_skip_px = stage_skip_px
+
+        # One dictionary per stage of every annealing run by the monitor
+        self.records = []
+        self.stage_idx = None
+        self.last_error = None
+
+    def reset(self):
+        ''' Starts a new annealing, e.g. for another orientation '''
+        self.stage_idx = None
+        self.last_error = None
+
+    def budget(self):
+        ''' The maximum number of iterations of the current stage '''
+        if (self.stage_idx is not None and
+                self.stage_idx < len(self.stage_maxiters)):
+            return self.stage_maxiters[self.stage_idx]
+        return self.maxiters
+
+    def check_now(self, n, maxiters):
+        ''' Whether the convergence criteria are evaluated after the n-th
+            iteration. The last one is always checked
+        '''
+        return (n + 1) % self.check_every == 0 or n == maxiters - 1
+
+    def skip_stage(self, stage_idx, num_stages):
+        ''' Whether the stage can be skipped, the skipped stages are
+            recorded as well
+        '''
+        skip = (self.stage_skip_px > 0 and self.last_error is not None and
+                stage_idx < num_stages - 1 and
+                self.last_error <= self.stage_skip_px)
+        if skip:
+            self.records.append(dict(stage=stage_idx, iters=0, time=0.0,
+                                     loss=None, reproj_px=self.last_error,
+                                     stop='skipped'))
+        return skip
+
+    def start_stage(self, stage_idx):
+        self.stage_idx = stage_idx
+        self.stage_start = time.time()
+        self.history = []
+
+    def plateaued(self, n, error):
+        ''' Compares the reprojection error after the n-th iteration with
+            the one of the last check at least `plateau_patience` iterations
+            before
+
+            Returns
+            -------
+                plateau: torch.tensor, B or None
+                    Mask of the samples that stopped improving, None while
+                    there is no error to compare with or when disabled
+        '''
+        if self.plateau_px <= 0 or self.stage_idx is None or error is None:
+            return None
+        self.history.append((n, error))
+        past = [err for m, err in self.history
+                if n - m >= self.plateau_patience]
+        if len(past) < 1:
+            return None
+        return past[-1] - error < self.plateau_px
+
+    def finish_stage(self, iters, stop, loss, error):
+        ''' Records the statistics of the current stage
+
+            Parameters
+            ----------
+                iters: int
+                    The number of iterations that were run
+                stop: str
+                    Why the stage ended
+                loss: torch.tensor or float
+                    The final loss, averaged over the samples
+                error: torch.tensor, B
+                    The final reprojection error of every sample, the worst
+                    one is used to decide whether the next stage is skipped
+        '''
+        if self.stage_idx is None:
+            return None
+        if torch.is_tensor(loss):
+            loss = loss.detach().float().mean().item()
+        if error is not None:
+            error = error.max().item()
+        record = dict(stage=self.stage_idx, iters=iters,
+                      time=time.time() - self.stage_start, loss=loss,
+                      reproj_px=error, stop=stop)
+        self.records.append(record)
+        self.last_error = error
+        self.stage_idx = None
+        return record
+
+
+def stage_summary(records):
+    ''' Formats the per-stage statistics of several fits as a table '''
+    lines = ['{:>5} {:>5} {:>7} {:>8} {:>8} {:>9}  {}'.format(
+        'stage', 'runs', 'skipped', 'iters', 'time_s', 'reproj_px', 'stops')]
+    for stage_idx in sorted(set(record['stage'] for record in records)):
+        stage = [record for record in records if record['stage'] == stage_idx]
+        run = [record for record in stage if record['stop'] != 'skipped']
+        errors = [record['reproj_px'] for record in stage
+                  if record['reproj_px'] is not None]
+        stops = {}
+        for record in run:
+            stops[record['stop']] = stops.get(record['stop'], 0) + 1
+        lines.append('{:>5} {:>5} {:>7} {:>8.1f} {:>8.3f} {:>9.2f}  {}'.format(
+            stage_idx, len(stage), len(stage) - len(run),
+            np.mean([record['iters'] for record in run]) if run else 0.0,
+            np.mean([record['time'] for record in run]) if run else 0.0,
+            np.mean(errors) if errors else float('nan'),
+            ', '.join('{}: {}'.format(key, val)
+                      for key, val in sorted(stops.items()))))
+    return '\n'.join(lines)
+
+
 class FittingMonitor(object):
     def __init__(self, summary_steps=1, visualize=False,
                  maxiters=100, ftol=2e-09, gtol=1e-05,
@@ -126,6 +353,8 @@ class FittingMonitor(object):
         self.summary_steps = summary_steps
         self.body_color = body_color
         self.model_type = model_type
+        self.controller = StageController(maxiters=maxiters, **kwargs)
+        self.last_eval = None
 
     def __enter__(self):
         self.steps = 0
@@ -148,6 +377,10 @@ class FittingMonitor(object):
                     use_vposer=True, pose_embedding=None, vposer=None,
                     **kwargs):
         ''' Helper function for running an optimization process
+
+            The iteration budget, the frequency of the convergence checks and
+            the plateau detection come from the stage controller.
+
             Parameters
             ----------
                 optimizer: torch.optim.Optimizer
@@ -170,32 +403,62 @@ class FittingMonitor(object):
                 The final loss value
         '''
         append_wrists = self.model_type == 'smpl' and use_vposer
+        controller = self.controller
+        maxiters = controller.budget()
         prev_loss = None
-        for n in range(self.maxiters):
+        stop = 'maxiters'
+        n = -1
+        for n in range(maxiters):
             loss = optimizer.step(closure)
 
-            if torch.isnan(loss).sum() > 0:
+            if not controller.check_now(n, maxiters):
+                continue
+
+            # A single synchronization with the device per check
+            values = [loss.detach().reshape(1)]
+            values += [torch.abs(var.grad.view(-1).max()).reshape(1)
+                       for var in params if var.grad is not None]
+            error = None
+            if controller.plateau_px > 0 and controller.stage_idx is not None:
+                error = self.reprojection_error()
+                values.append(error.to(dtype=values[0].dtype))
+            num_errors = 0 if error is None else error.numel()
+            values = torch.cat(values).tolist()
+            loss_val = values[0]
+            grad_vals = values[1:len(values) - num_errors]
+            if error is not None:
+                error = torch.tensor(values[len(values) - num_errors:])
+
+            if np.isnan(loss_val):
                 print('NaN loss value, stopping!')
+                stop = 'nan'
                 break
 
-            if torch.isinf(loss).sum() > 0:
+            if np.isinf(loss_val):
                 print('Infinite loss value, stopping!')
+                stop = 'nan'
                 break
 
-            if n > 0 and prev_loss is not None and self.ftol > 0:
-                loss_rel_change = utils.rel_change(prev_loss, loss.item())
+            if prev_loss is not None and self.ftol > 0:
+                loss_rel_change = utils.rel_change(prev_loss, loss_val)
 
                 if loss_rel_change <= self.ftol:
+                    prev_loss, stop = loss_val, 'ftol'
                     break
 
-            if all([torch.abs(var.grad.view(-1).max()).item() < self.gtol
-                    for var in params if var.grad is not None]):
+            if all([grad_val < self.gtol for grad_val in grad_vals]):
+                prev_loss, stop = loss_val, 'gtol'
+                break
+
+            plateau = controller.plateaued(n, error)
+            if plateau is not None and plateau.all():
+                prev_loss, stop = loss_val, 'plateau'
                 break
 
             if self.visualize and n % self.summary_steps == 0:
                 body_pose = vposer.decode(
                     pose_embedding, output_type='aa').view(
-                        1, -1) if use_vposer else None
+                        pose_embedding.shape[0], -1) if use_vposer else None
 
                 if append_wrists:
                     wrist_pose = torch.zeros([body_pose.shape[0], 6],
@@ -209,10 +472,142 @@ class FittingMonitor(object):
                 self.mv.update_mesh(vertices.squeeze(),
                                     body_model.faces)
 
-            prev_loss = loss.item()
+            prev_loss = loss_val
+
+        if controller.stage_idx is not None:
+            controller.finish_stage(n + 1, stop, prev_loss,
+                                    self.reprojection_error())
+        return prev_loss
+
+    def run_batch_fitting(self, optimizer, closure, params, body_model,
+                          use_vposer=True, pose_embedding=None, vposer=None,
+                          active=None, **kwargs):
+        ''' Runs an optimization process over B independent samples
+
+            Same as `run_fitting`, but the closure returns one loss per
+            sample and the ftol/gtol criteria are checked for every sample
+            separately. Converged samples are masked out of the following
+            optimizer steps, while the others keep going. The plateau
+            criterion of the stage controller is also applied per sample.
+
+            Parameters
+            ----------
+                optimizer: BatchLBFGS
+                    An optimizer whose `step` accepts an `active` mask
+                closure: function
+                    The function used to calculate the gradients, returns
+                    the B per-sample losses
+                params: list
+                    List containing the parameters that will be optimized,
+                    with the batch on the first dimension
+                body_model: nn.Module
+                    The body model PyTorch module
+                use_vposer: bool
+                    Flag on whether to use VPoser (default=True).
+                pose_embedding: torch.tensor, BxN
+                    The tensor that contains the latent pose variable.
+                vposer: nn.Module
+                    The VPoser module
+                active: torch.tensor, B, optional
+                    Boolean mask of the samples to optimize. Defaults to all
+            Returns
+            -------
+                loss: torch.tensor, B
+                The final loss value of every sample
+        '''
+        append_wrists = self.model_type == 'smpl' and use_vposer
+        controller = self.controller
+        maxiters = controller.budget()
+        prev_loss = None
+        stop = 'maxiters'
+        n = -1
+        for n in range(maxiters):
+            loss = optimizer.step(closure, active=active)
+            if active is None:
+                active = torch.ones_like(loss, dtype=torch.bool)
+
+            if not controller.check_now(n, maxiters):
+                continue
+
+            finite = torch.isfinite(loss)
+            stopped = active & ~finite
+            # Keep the last finite value of the stopped samples
+            if prev_loss is not None:
+                loss = torch.where(finite, loss, prev_loss)
+            active = active & finite
+
+            if prev_loss is not None and self.ftol > 0:
+                loss_rel_change = (prev_loss - loss) / torch.stack(
+                    [prev_loss.abs(), loss.abs(),
+                     torch.ones_like(loss)]).max(dim=0)[0]
+                active = active & (loss_rel_change > self.ftol)
+
+            grads = [var.grad.reshape(var.shape[0], -1).abs().max(dim=1)[0]
+                     for var in params if var.grad is not None]
+            if len(grads) > 0:
+                max_grad = torch.stack(grads).max(dim=0)[0]
+                active = active & (max_grad >= self.gtol)
+
+            error = None
+            if controller.plateau_px > 0 and controller.stage_idx is not None:
+                error = self.reprojection_error()
+            plateau = controller.plateaued(n, error)
+            if plateau is not None:
+                active = active & ~plateau
+
+            prev_loss = loss
+            # A single synchronization with the device per check
+            stopped, still_active = torch.stack([stopped, active]).tolist()
+            if any(stopped):
+                print('NaN or infinite loss value for samples {}, '
+                      'stopping them!'.format(
+                          [idx for idx, val in enumerate(stopped) if val]))
+            if not any(still_active):
+                stop = 'converged'
+                break
 
+            if self.visualize and n % self.summary_steps == 0:
+                body_pose = vposer.decode(
+                    pose_embedding, output_type='aa').view(
+                        pose_embedding.shape[0], -1) if use_vposer else None
+
+                if append_wrists:
+                    wrist_pose = torch.zeros([body_pose.shape[0], 6],
+                                             dtype=body_pose.dtype,
+                                             device=body_pose.device)
+                    body_pose = torch.cat([body_pose, wrist_pose], dim=1)
+                model_output = body_model(
+                    return_verts=True, body_pose=body_pose)
+                vertices = model_output.vertices.detach().cpu().numpy()
+
+                self.mv.update_mesh(vertices[0], body_model.faces)
+
+        if controller.stage_idx is not None:
+            controller.finish_stage(n + 1, stop, prev_loss,
+                                    self.reprojection_error())
         return prev_loss
 
+    def reprojection_error(self):
+        ''' The 2D reprojection error, in pixels, of the last evaluation of
+            a fitting closure
+
+            Returns
+            -------
+                error: torch.tensor, B or None
+                    The error of every sample, None before the first
+                    evaluation
+        '''
+        if self.last_eval is None:
+            return None
+        joints, camera, gt_joints, joints_conf, joint_weights = self.last_eval
+        with torch.no_grad():
+            weights = torch.ones_like(gt_joints[..., 0])
+            if joints_conf is not None:
+                weights = weights * joints_conf
+            if joint_weights is not None:
+                weights = weights * joint_weights
+            return reprojection_error(camera(joints), gt_joints, weights)
+
     def create_fitting_closure(self,
                                optimizer, body_model, camera=None,
                                gt_joints=None, loss=None,
@@ -226,13 +621,18 @@ class FittingMonitor(object):
         faces_tensor = body_model.faces_tensor.view(-1)
         append_wrists = self.model_type == 'smpl' and use_vposer
 
+        # Without a vertex-based loss term only the joints are evaluated
+        model_forward = body_model
+        if not return_verts:
+            model_forward = registry.joint_model(body_model)
+
         def fitting_func(backward=True):
             if backward:
                 optimizer.zero_grad()
 
             body_pose = vposer.decode(
                 pose_embedding, output_type='aa').view(
-                    1, -1) if use_vposer else None
+                    pose_embedding.shape[0], -1) if use_vposer else None
 
             if append_wrists:
                 wrist_pose = torch.zeros([body_pose.shape[0], 6],
@@ -240,9 +640,11 @@ class FittingMonitor(object):
                                          device=body_pose.device)
                 body_pose = torch.cat([body_pose, wrist_pose], dim=1)
 
-            body_model_output = body_model(return_verts=return_verts,
-                                           body_pose=body_pose,
-                                           return_full_pose=return_full_pose)
+            body_model_output = model_forward(
+                return_verts=return_verts, body_pose=body_pose,
+                return_full_pose=return_full_pose)
+            self.last_eval = (body_model_output.joints.detach(), camera,
+                              gt_joints, joints_conf, joint_weights)
             total_loss = loss(body_model_output, camera=camera,
                               gt_joints=gt_joints,
                               body_model_faces=faces_tensor,
@@ -253,7 +655,9 @@ class FittingMonitor(object):
                               **kwargs)
 
             if backward:
-                total_loss.backward(create_graph=create_graph)
+                # Per-sample losses (reduction='none') are independent, so
+                # the gradient of their sum is the per-sample gradient
+                torch.sum(total_loss).backward(create_graph=create_graph)
 
             self.steps += 1
             if self.visualize and self.steps % self.summary_steps == 0:
@@ -269,6 +673,18 @@ class FittingMonitor(object):
         return fitting_func
 
 
+def per_sample_sum(loss_term, batch_size):
+    ''' Sums a loss term over everything but the batch dimension
+
+        Priors return either one value per sample or a plain number (e.g. the
+        `none` prior), the latter is returned as is and broadcasts over the
+        batch.
+    '''
+    if not torch.is_tensor(loss_term) or loss_term.dim() == 0:
+        return loss_term
+    return loss_term.reshape(batch_size, -1).sum(dim=-1)
+
+
 def create_loss(loss_type='smplify', **kwargs):
     if loss_type == 'smplify':
         return SMPLifyLoss(**kwargs)
@@ -306,6 +722,7 @@ class SMPLifyLoss(nn.Module):
 
         self.use_joints_conf = use_joints_conf
         self.angle_prior = angle_prior
+        self.reduction = reduction
 
         self.robustifier = utils.GMoF(rho=rho)
         self.rho = rho
@@ -362,11 +779,18 @@ class SMPLifyLoss(nn.Module):
                                                  device=weight_tensor.device)
                 setattr(self, key, weight_tensor)
 
+    def uses_vertices(self):
+        ''' Whether the current loss weights enable a term that reads the
+            vertices of the body model
+        '''
+        return self.interpenetration and self.coll_loss_weight.item() > 0
+
     def forward(self, body_model_output, camera, gt_joints, joints_conf,
                 body_model_faces, joint_weights,
                 use_vposer=False, pose_embedding=None,
                 **kwargs):
         projected_joints = camera(body_model_output.joints)
+        batch_size = projected_joints.shape[0]
         # Calculate the weights for each joints
         weights = (joint_weights * joints_conf
                    if self.use_joints_conf else
@@ -375,57 +799,58 @@ class SMPLifyLoss(nn.Module):
         # Calculate the distance of the projected joints from
         # the ground truth 2D detections
         joint_diff = self.robustifier(gt_joints - projected_joints)
-        joint_loss = (torch.sum(weights ** 2 * joint_diff) *
+        joint_loss = (per_sample_sum(weights ** 2 * joint_diff, batch_size) *
                       self.data_weight ** 2)
 
         # Calculate the loss from the Pose prior
         if use_vposer:
-            pprior_loss = (pose_embedding.pow(2).sum() *
+            pprior_loss = (per_sample_sum(pose_embedding.pow(2), batch_size) *
                            self.body_pose_weight ** 2)
         else:
-            pprior_loss = torch.sum(self.body_pose_prior(
+            pprior_loss = per_sample_sum(self.body_pose_prior(
                 body_model_output.body_pose,
-                body_model_output.betas)) * self.body_pose_weight ** 2
+                body_model_output.betas),
+                batch_size) * self.body_pose_weight ** 2
 
-        shape_loss = torch.sum(self.shape_prior(
-            body_model_output.betas)) * self.shape_weight ** 2
+        shape_loss = per_sample_sum(self.shape_prior(
+            body_model_output.betas), batch_size) * self.shape_weight ** 2
         # Calculate the prior over the joint rotations. This a heuristic used
         # to prevent extreme rotation of the elbows and knees
         body_pose = body_model_output.full_pose[:, 3:66]
-        angle_prior_loss = torch.sum(
-            self.angle_prior(body_pose)) * self.bending_prior_weight
+        angle_prior_loss = per_sample_sum(
+            self.angle_prior(body_pose),
+            batch_size) * self.bending_prior_weight
 
         # Apply the prior on the pose space of the hand
         left_hand_prior_loss, right_hand_prior_loss = 0.0, 0.0
         if self.use_hands and self.left_hand_prior is not None:
-            left_hand_prior_loss = torch.sum(
+            left_hand_prior_loss = per_sample_sum(
                 self.left_hand_prior(
-                    body_model_output.left_hand_pose)) * \
+                    body_model_output.left_hand_pose), batch_size) * \
                 self.hand_prior_weight ** 2
 
         if self.use_hands and self.right_hand_prior is not None:
-            right_hand_prior_loss = torch.sum(
+            right_hand_prior_loss = per_sample_sum(
                 self.right_hand_prior(
-                    body_model_output.right_hand_pose)) * \
+                    body_model_output.right_hand_pose), batch_size) * \
                 self.hand_prior_weight ** 2
 
         expression_loss = 0.0
         jaw_prior_loss = 0.0
         if self.use_face:
-            expression_loss = torch.sum(self.expr_prior(
-                body_model_output.expression)) * \
+            expression_loss = per_sample_sum(self.expr_prior(
+                body_model_output.expression), batch_size) * \
                 self.expr_prior_weight ** 2
 
             if hasattr(self, 'jaw_prior'):
-                jaw_prior_loss = torch.sum(
+                jaw_prior_loss = per_sample_sum(
                     self.jaw_prior(
                         body_model_output.jaw_pose.mul(
-                            self.jaw_prior_weight)))
+                            self.jaw_prior_weight)), batch_size)
 
         pen_loss = 0.0
         # Calculate the loss due to interpenetration
-        if (self.interpenetration and self.coll_loss_weight.item() > 0):
-            batch_size = projected_joints.shape[0]
+        if self.uses_vertices():
             triangles = torch.index_select(
                 body_model_output.vertices, 1,
                 body_model_faces).view(batch_size, -1, 3, 3)
@@ -438,15 +863,18 @@ class SMPLifyLoss(nn.Module):
                 collision_idxs = self.tri_filtering_module(collision_idxs)
 
             if collision_idxs.ge(0).sum().item() > 0:
-                pen_loss = torch.sum(
+                pen_loss = per_sample_sum(
                     self.coll_loss_weight *
-                    self.pen_distance(triangles, collision_idxs))
+                    self.pen_distance(triangles, collision_idxs),
+                    batch_size)
 
         total_loss = (joint_loss + pprior_loss + shape_loss +
                       angle_prior_loss + pen_loss +
                       jaw_prior_loss + expression_loss +
                       left_hand_prior_loss + right_hand_prior_loss)
-        return total_loss
+        if self.reduction == 'none':
+            return total_loss
+        return torch.sum(total_loss)
 
 
 class SMPLifyCameraInitLoss(nn.Module):
@@ -458,6 +886,7 @@ class SMPLifyCameraInitLoss(nn.Module):
                  **kwargs):
         super(SMPLifyCameraInitLoss, self).__init__()
         self.dtype = dtype
+        self.reduction = reduction
 
         if trans_estimation is not None:
             self.register_buffer(
@@ -478,26 +907,34 @@ class SMPLifyCameraInitLoss(nn.Module):
         for key in loss_weight_dict:
             if hasattr(self, key):
                 weight_tensor = getattr(self, key)
-                weight_tensor = torch.tensor(loss_weight_dict[key],
-                                             dtype=weight_tensor.dtype,
-                                             device=weight_tensor.device)
+                if torch.is_tensor(loss_weight_dict[key]):
+                    weight_tensor = loss_weight_dict[key].clone().detach()
+                else:
+                    weight_tensor = torch.tensor(loss_weight_dict[key],
+                                                 dtype=weight_tensor.dtype,
+                                                 device=weight_tensor.device)
                 setattr(self, key, weight_tensor)
 
     def forward(self, body_model_output, camera, gt_joints,
                 **kwargs):
 
         projected_joints = camera(body_model_output.joints)
+        batch_size = projected_joints.shape[0]
 
         joint_error = torch.pow(
             torch.index_select(gt_joints, 1, self.init_joints_idxs) -
             torch.index_select(projected_joints, 1, self.init_joints_idxs),
             2)
-        joint_loss = torch.sum(joint_error) * self.data_weight ** 2
+        joint_loss = per_sample_sum(joint_error, batch_size) * \
+            self.data_weight ** 2
 
         depth_loss = 0.0
         if (self.depth_loss_weight.item() > 0 and self.trans_estimation is not
                 None):
-            depth_loss = self.depth_loss_weight ** 2 * torch.sum((
-                camera.translation[:, 2] - self.trans_estimation[:, 2]).pow(2))
+            depth_loss = self.depth_loss_weight ** 2 * (
+                camera.translation[:, 2] - self.trans_estimation[:, 2]).pow(2)
 
-        return joint_loss + depth_loss
+        total_loss = joint_loss + depth_loss
+        if self.reduction == 'none':
+            return total_loss
+        return torch.sum(total_loss)
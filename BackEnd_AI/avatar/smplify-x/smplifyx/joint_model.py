@@ -0,0 +1,210 @@
+# -*- coding: utf-8 -*-
+
+# Joint-only evaluation of the SMPL family body models.
+#
+# Without a vertex-based loss term the fitting closures only read the joints,
+# the pose and the shape of the model output. The skeleton joints are a linear
+# function of the shaped template, so they are regressed from precomputed
+# joint shape directions. The only vertices that are posed and skinned are
+# the ones read by the extra joints (nose, eyes, ears, feet, finger tips) and
+# by the face landmarks, a few hundred instead of the whole mesh.
+
+from __future__ import absolute_import
+from __future__ import print_function
+from __future__ import division
+
+from collections import namedtuple
+import weakref
+
+import torch
+
+from smplx.lbs import (batch_rodrigues, batch_rigid_transform, blend_shapes,
+                       vertices2landmarks, find_dynamic_lmk_idx_and_bcoords)
+
+JointModelOutput = namedtuple('JointModelOutput',
+                              ['vertices', 'joints', 'full_pose', 'betas',
+                               'expression', 'global_orient', 'body_pose',
+                               'left_hand_pose', 'right_hand_pose',
+                               'jaw_pose'])
+JointModelOutput.__new__.__defaults__ = (None,) * len(JointModelOutput._fields)
+
+
+class JointModel(object):
+    ''' Wraps a SMPL, SMPL+H or SMPL-X module and returns the same joints as
+        its forward pass, without computing the mesh
+
+        The parameters are read from the wrapped module on every call, so the
+        optimizers keep updating the body model itself. The module is only
+        weakly referenced, the joint model does not keep it alive.
+    '''
+
+    def __init__(self, body_model):
+        self._body_model = weakref.ref(body_model)
+        self.is_smplx = hasattr(body_model, 'expr_dirs')
+        self.is_smplh = hasattr(body_model, 'left_hand_pose')
+        self.use_face_contour = getattr(body_model, 'use_face_contour', False)
+
+        shapedirs = body_model.shapedirs
+        if self.is_smplx:
+            shapedirs = torch.cat([shapedirs, body_model.expr_dirs], dim=-1)
+        num_verts = body_model.v_template.shape[0]
+
+        with torch.no_grad():
+            J_regressor = body_model.J_regressor
+            self.J_template = torch.matmul(J_regressor,
+                                           body_model.v_template)
+            self.J_shapedirs = torch.einsum('jv,vkl->jkl',
+                                            [J_regressor, shapedirs])
+
+            # The vertices read by the extra joints and the landmarks
+            extra_joints_idxs = \
+                body_model.vertex_joint_selector.extra_joints_idxs
+            used = [extra_joints_idxs]
+            faces_tensor = body_model.faces_tensor.view(-1, 3)
+            if self.is_smplx:
+                used.append(faces_tensor[body_model.lmk_faces_idx].view(-1))
+                if self.use_face_contour:
+                    used.append(faces_tensor[
+                        body_model.dynamic_lmk_faces_idx].view(-1))
+            verts_idxs = torch.unique(torch.cat(used))
+
+            # Maps the mesh indices to the indices of the vertex subset. Faces
+            # outside of the subset are never selected by the landmarks.
+            subset_idxs = torch.full([num_verts], -1, dtype=torch.long,
+                                     device=verts_idxs.device)
+            subset_idxs[verts_idxs] = torch.arange(
+                len(verts_idxs), dtype=torch.long, device=verts_idxs.device)
+            self.extra_joints_idxs = subset_idxs[extra_joints_idxs]
+            self.faces_tensor = subset_idxs[faces_tensor]
+
+            self.v_template = body_model.v_template[verts_idxs]
+            self.shapedirs = shapedirs[verts_idxs]
+            num_pose_basis = body_model.posedirs.shape[0]
+            self.posedirs = body_model.posedirs.view(
+                num_pose_basis, num_verts, 3)[:, verts_idxs].reshape(
+                    num_pose_basis, -1)
+            self.lbs_weights = body_model.lbs_weights[verts_idxs]
+
+    @property
+    def body_model(self):
+        return self._body_model()
+
+    def full_pose(self, global_orient, body_pose):
+        ''' Concatenates the pose of every joint, same as the forward pass of
+            the wrapped model
+
+            Returns
+            -------
+                full_pose: torch.tensor, BxJ*3
+                    The axis-angle rotations of all the joints
+                parts: dict
+                    The per-part poses, hand poses decoded from the PCA
+                    coefficients if needed
+        '''
+        model = self.body_model
+        parts = {}
+        if not self.is_smplh:
+            return torch.cat([global_orient, body_pose], dim=1), parts
+
+        left_hand_pose = model.left_hand_pose
+        right_hand_pose = model.right_hand_pose
+        if model.use_pca:
+            left_hand_pose = torch.einsum(
+                'bi,ij->bj', [left_hand_pose, model.left_hand_components])
+            right_hand_pose = torch.einsum(
+                'bi,ij->bj', [right_hand_pose, model.right_hand_components])
+        parts.update(left_hand_pose=left_hand_pose,
+                     right_hand_pose=right_hand_pose)
+
+        if self.is_smplx:
+            batch_size = global_orient.shape[0]
+            parts['jaw_pose'] = model.jaw_pose
+            full_pose = torch.cat(
+                [global_orient.reshape(batch_size, -1),
+                 body_pose.reshape(batch_size, -1),
+                 model.jaw_pose.reshape(batch_size, -1),
+                 model.leye_pose.reshape(batch_size, -1),
+                 model.reye_pose.reshape(batch_size, -1),
+                 left_hand_pose.reshape(batch_size, -1),
+                 right_hand_pose.reshape(batch_size, -1)], dim=1)
+        else:
+            full_pose = torch.cat([global_orient, body_pose,
+                                   left_hand_pose, right_hand_pose], dim=1)
+        return full_pose + model.pose_mean, parts
+
+    def __call__(self, body_pose=None, return_full_pose=False, **kwargs):
+        ''' Same interface as the forward pass of the wrapped model, the
+            `vertices` of the output are always None
+        '''
+        model = self.body_model
+        global_orient = model.global_orient
+        body_pose = body_pose if body_pose is not None else model.body_pose
+        betas = model.betas
+
+        full_pose, parts = self.full_pose(global_orient, body_pose)
+        batch_size = full_pose.shape[0]
+        if betas.shape[0] != batch_size:
+            betas = betas.expand(batch_size // betas.shape[0], -1)
+
+        shape_components = betas
+        if self.is_smplx:
+            parts['expression'] = model.expression
+            shape_components = torch.cat([betas, model.expression], dim=-1)
+
+        dtype, device = shape_components.dtype, shape_components.device
+        rot_mats = batch_rodrigues(full_pose.view(-1, 3)).view(
+            [batch_size, -1, 3, 3])
+
+        # Skeleton joints, regressed from the shaped template
+        J = self.J_template + blend_shapes(shape_components, self.J_shapedirs)
+        joints, A = batch_rigid_transform(rot_mats, J, model.parents,
+                                          dtype=dtype)
+
+        # Linear blend skinning of the vertex subset
+        ident = torch.eye(3, dtype=dtype, device=device)
+        pose_feature = (rot_mats[:, 1:, :, :] - ident).view([batch_size, -1])
+        v_posed = (self.v_template +
+                   blend_shapes(shape_components, self.shapedirs) +
+                   torch.matmul(pose_feature, self.posedirs).view(
+                       batch_size, -1, 3))
+        T = torch.matmul(self.lbs_weights,
+                         A.view(batch_size, -1, 16)).view(
+                             batch_size, -1, 4, 4)
+        vertices = (torch.matmul(T[:, :, :3, :3], v_posed.unsqueeze(-1))
+                    .squeeze(-1) + T[:, :, :3, 3])
+
+        joints = torch.cat(
+            [joints, torch.index_select(vertices, 1, self.extra_joints_idxs)],
+            dim=1)
+
+        if self.is_smplx:
+            lmk_faces_idx = model.lmk_faces_idx.unsqueeze(
+                dim=0).expand(batch_size, -1)
+            lmk_bary_coords = model.lmk_bary_coords.unsqueeze(
+                dim=0).expand(batch_size, -1, -1)
+            if self.use_face_contour:
+                dyn_lmk_faces_idx, dyn_lmk_bary_coords = \
+                    find_dynamic_lmk_idx_and_bcoords(
+                        vertices, full_pose, model.dynamic_lmk_faces_idx,
+                        model.dynamic_lmk_bary_coords, model.neck_kin_chain)
+                lmk_faces_idx = torch.cat([lmk_faces_idx,
+                                           dyn_lmk_faces_idx], 1)
+                lmk_bary_coords = torch.cat([lmk_bary_coords,
+                                             dyn_lmk_bary_coords], 1)
+            landmarks = vertices2landmarks(vertices, self.faces_tensor,
+                                           lmk_faces_idx.contiguous(),
+                                           lmk_bary_coords)
+            joints = torch.cat([joints, landmarks], dim=1)
+
+        if model.joint_mapper is not None:
+            joints = model.joint_mapper(joints=joints)
+
+        if hasattr(model, 'transl'):
+            joints = joints + model.transl.unsqueeze(dim=1)
+
+        return JointModelOutput(joints=joints, betas=betas,
+                                global_orient=global_orient,
+                                body_pose=body_pose,
+                                full_pose=(full_pose if return_full_pose
+                                           else None),
+                                **parts)
@@ -30,241 +30,378 @@ import torch
 
 import smplx
 
-from utils import JointMapper
+from utils import JointMapper, smpl_to_openpose
 from cmd_parser import parse_config
-from data_parser import create_dataset
+from data_parser import create_dataset, create_joint_weights
 from fit_single_frame import fit_single_frame
+from fit_multi_frame import fit_multi_frame
+from fitting import stage_summary
 
 from camera import create_camera
-from prior import create_prior
+import registry
 
 torch.backends.cudnn.enabled = False
 
 
-def main(**args):
-    output_folder = args.pop('output_folder')
-    output_folder = osp.expandvars(output_folder)
-    if not osp.exists(output_folder):
-        os.makedirs(output_folder)
-
-    # Store the arguments for the current experiment
-    conf_fn = osp.join(output_folder, 'conf.yaml')
-    with open(conf_fn, 'w') as conf_file:
-        yaml.dump(args, conf_file)
-
-    result_folder = args.pop('result_folder', 'results')
-    result_folder = osp.join(output_folder, result_folder)
-    if not osp.exists(result_folder):
-        os.makedirs(result_folder)
-
-    mesh_folder = args.pop('mesh_folder', 'meshes')
-    mesh_folder = osp.join(output_folder, mesh_folder)
-    if not osp.exists(mesh_folder):
-        os.makedirs(mesh_folder)
-
-    out_img_folder = osp.join(output_folder, 'images')
-    if not osp.exists(out_img_folder):
-        os.makedirs(out_img_folder)
-
-    float_dtype = args['float_dtype']
-    if float_dtype == 'float64':
-        dtype = torch.float64
-    elif float_dtype == 'float32':
-        dtype = torch.float64
-    else:
-        print('Unknown float type {}, exiting!'.format(float_dtype))
-        sys.exit(-1)
-
-    use_cuda = args.get('use_cuda', True)
-    if use_cuda and not torch.cuda.is_available():
-        print('CUDA is not available, exiting!')
-        sys.exit(-1)
-
-    img_folder = args.pop('img_folder', 'images')
-    dataset_obj = create_dataset(img_folder=img_folder, **args)
-
-    start = time.time()
-
-    input_gender = args.pop('gender', 'neutral')
-    gender_lbl_type = args.pop('gender_lbl_type', 'none')
-    max_persons = args.pop('max_persons', -1)
-
-    float_dtype = args.get('float_dtype', 'float32')
-    if float_dtype == 'float64':
-        dtype = torch.float64
-    elif float_dtype == 'float32':
-        dtype = torch.float32
-    else:
-        raise ValueError('Unknown float type {}, exiting!'.format(float_dtype))
-
-    joint_mapper = JointMapper(dataset_obj.get_model2data())
-
-    model_params = dict(model_path=args.get('model_folder'),
-                        joint_mapper=joint_mapper,
-                        create_global_orient=True,
-                        create_body_pose=not args.get('use_vposer'),
-                        create_betas=True,
-                        create_left_hand_pose=True,
-                        create_right_hand_pose=True,
-                        create_expression=True,
-                        create_jaw_pose=True,
-                        create_leye_pose=True,
-                        create_reye_pose=True,
-                        create_transl=False,
-                        dtype=dtype,
-                        **args)
+class SMPLifyXRunner(object):
+    ''' Keeps the body models, the camera and the priors of a SMPLify-X
+        configuration resident, so that a long-lived process can fit many
+        data folders without rebuilding them for every call.
+
+        Parameters
+        ----------
+        args: dict
+            The parsed configuration, as returned by `parse_config`. The
+            per-call folders (output, data, images and keypoints) are passed
+            to `run` and override the values stored here.
+    '''
+
+    # Arguments that are consumed by the runner itself and must not be
+    # forwarded to the model, prior or fitting constructors
+    CALL_ARGS = ('output_folder', 'result_folder', 'mesh_folder',
+                 'img_folder', 'gender', 'gender_lbl_type', 'max_persons',
+                 'batch_fitting', 'fit_batch_size', 'parallel_orient',
+                 'warm_start')
+
+    def __init__(self, **args):
+        self.args = args
+
+        float_dtype = args.get('float_dtype', 'float32')
+        if float_dtype == 'float64':
+            dtype = torch.float64
+        elif float_dtype == 'float32':
+            dtype = torch.float32
+        else:
+            raise ValueError('Unknown float type {}, exiting!'.format(
+                float_dtype))
+        self.dtype = dtype
+
+        use_cuda = args.get('use_cuda', True)
+        if use_cuda and not torch.cuda.is_available():
+            print('CUDA is not available, exiting!')
+            sys.exit(-1)
+        if use_cuda and torch.cuda.is_available():
+            device = torch.device('cuda')
+        else:
+            device = torch.device('cpu')
+        self.device = device
+
+        # The mapping and the joint weights only depend on the configuration
+        # flags, not on the folder that is being fitted.
+        model_type = args.get('model_type', 'smplx')
+        use_hands = args.get('use_hands', True)
+        use_face = args.get('use_face', True)
+        use_face_contour = args.get('use_face_contour', False)
+        joint_mapper = JointMapper(smpl_to_openpose(
+            model_type, use_hands=use_hands, use_face=use_face,
+            use_face_contour=use_face_contour))
+
+        model_args = {key: val for key, val in args.items()
+                      if key not in self.CALL_ARGS}
+        model_params = dict(model_path=args.get('model_folder'),
+                            joint_mapper=joint_mapper,
+                            create_global_orient=True,
+                            create_body_pose=not args.get('use_vposer'),
+                            create_betas=True,
+                            create_left_hand_pose=True,
+                            create_right_hand_pose=True,
+                            create_expression=True,
+                            create_jaw_pose=True,
+                            create_leye_pose=True,
+                            create_reye_pose=True,
+                            create_transl=False,
+                            dtype=dtype,
+                            **model_args)
+
+        # The body model of a gender is only created the first time a
+        # person of that gender is fitted, see `get_body_model`
+        self.model_type = model_type
+        self.body_models = {}
+        # The per-stage statistics of the last call to `run`
+        self.stage_stats = []
+
+        # Create the camera object
+        focal_length = args.get('focal_length')
+        camera_params = dict(focal_length_x=focal_length,
+                             focal_length_y=focal_length,
+                             dtype=dtype,
+                             **model_args)
+        camera = create_camera(**camera_params)
 
-    male_model = smplx.create(gender='male', **model_params)
-    # SMPL-H has no gender-neutral model
-    if args.get('model_type') != 'smplh':
-        neutral_model = smplx.create(gender='neutral', **model_params)
-    female_model = smplx.create(gender='female', **model_params)
-
-    # Create the camera object
-    focal_length = args.get('focal_length')
-    camera = create_camera(focal_length_x=focal_length,
-                           focal_length_y=focal_length,
-                           dtype=dtype,
-                           **args)
-
-    if hasattr(camera, 'rotation'):
-        camera.rotation.requires_grad = False
-
-    use_hands = args.get('use_hands', True)
-    use_face = args.get('use_face', True)
-
-    body_pose_prior = create_prior(
-        prior_type=args.get('body_prior_type'),
-        dtype=dtype,
-        **args)
-
-    jaw_prior, expr_prior = None, None
-    if use_face:
-        jaw_prior = create_prior(
-            prior_type=args.get('jaw_prior_type'),
-            dtype=dtype,
-            **args)
-        expr_prior = create_prior(
-            prior_type=args.get('expr_prior_type', 'l2'),
-            dtype=dtype, **args)
-
-    left_hand_prior, right_hand_prior = None, None
-    if use_hands:
-        lhand_args = args.copy()
-        lhand_args['num_gaussians'] = args.get('num_pca_comps')
-        left_hand_prior = create_prior(
-            prior_type=args.get('left_hand_prior_type'),
-            dtype=dtype,
-            use_left_hand=True,
-            **lhand_args)
+        if hasattr(camera, 'rotation'):
+            camera.rotation.requires_grad = False
+        camera = camera.to(device=device)
 
-        rhand_args = args.copy()
-        rhand_args['num_gaussians'] = args.get('num_pca_comps')
-        right_hand_prior = create_prior(
-            prior_type=args.get('right_hand_prior_type'),
+        # The mixture priors are shared by every runner of the process
+        priors = {}
+        priors['body_pose_prior'] = registry.create_prior(
+            prior_type=args.get('body_prior_type'),
+            device=device,
             dtype=dtype,
-            use_right_hand=True,
-            **rhand_args)
-
-    shape_prior = create_prior(
-        prior_type=args.get('shape_prior_type', 'l2'),
-        dtype=dtype, **args)
-
-    angle_prior = create_prior(prior_type='angle', dtype=dtype)
+            **model_args)
 
-    if use_cuda and torch.cuda.is_available():
-        device = torch.device('cuda')
-
-        camera = camera.to(device=device)
-        female_model = female_model.to(device=device)
-        male_model = male_model.to(device=device)
-        if args.get('model_type') != 'smplh':
-            neutral_model = neutral_model.to(device=device)
-        body_pose_prior = body_pose_prior.to(device=device)
-        angle_prior = angle_prior.to(device=device)
-        shape_prior = shape_prior.to(device=device)
+        priors['jaw_prior'], priors['expr_prior'] = None, None
         if use_face:
-            expr_prior = expr_prior.to(device=device)
-            jaw_prior = jaw_prior.to(device=device)
+            priors['jaw_prior'] = registry.create_prior(
+                prior_type=args.get('jaw_prior_type'),
+                device=device,
+                dtype=dtype,
+                **model_args)
+            priors['expr_prior'] = registry.create_prior(
+                prior_type=args.get('expr_prior_type', 'l2'),
+                device=device,
+                dtype=dtype, **model_args)
+
+        priors['left_hand_prior'], priors['right_hand_prior'] = None, None
         if use_hands:
-            left_hand_prior = left_hand_prior.to(device=device)
-            right_hand_prior = right_hand_prior.to(device=device)
-    else:
-        device = torch.device('cpu')
-
-    # A weight for every joint of the model
-    joint_weights = dataset_obj.get_joint_weights().to(device=device,
-                                                       dtype=dtype)
-    # Add a fake batch dimension for broadcasting
-    joint_weights.unsqueeze_(dim=0)
-
-    for idx, data in enumerate(dataset_obj):
-
-        img = data['img']
-        fn = data['fn']
-        keypoints = data['keypoints']
-        print('Processing: {}'.format(data['img_path']))
-
-        curr_result_folder = osp.join(result_folder)
-        if not osp.exists(curr_result_folder):
-            os.makedirs(curr_result_folder)
-        curr_mesh_folder = osp.join(mesh_folder)
-        if not osp.exists(curr_mesh_folder):
-            os.makedirs(curr_mesh_folder)
-        for person_id in range(keypoints.shape[0]):
-            if person_id >= max_persons and max_persons > 0:
+            lhand_args = model_args.copy()
+            lhand_args['num_gaussians'] = args.get('num_pca_comps')
+            priors['left_hand_prior'] = registry.create_prior(
+                prior_type=args.get('left_hand_prior_type'),
+                device=device,
+                dtype=dtype,
+                use_left_hand=True,
+                **lhand_args)
+
+            rhand_args = model_args.copy()
+            rhand_args['num_gaussians'] = args.get('num_pca_comps')
+            priors['right_hand_prior'] = registry.create_prior(
+                prior_type=args.get('right_hand_prior_type'),
+                device=device,
+                dtype=dtype,
+                use_right_hand=True,
+                **rhand_args)
+
+        priors['shape_prior'] = registry.create_prior(
+            prior_type=args.get('shape_prior_type', 'l2'),
+            device=device,
+            dtype=dtype, **model_args)
+
+        priors['angle_prior'] = registry.create_prior(
+            prior_type='angle', device=device, dtype=dtype)
+
+        self.camera = camera
+        self.priors = priors
+
+        # Batched body models and cameras, created on first use for every
+        # (gender, number of rows) pair when fitting in batch mode
+        self.model_params = model_params
+        self.camera_params = camera_params
+        self.batch_models = {}
+
+        # A weight for every joint of the model
+        joint_weights = create_joint_weights(
+            use_hands=use_hands, use_face=use_face,
+            use_face_contour=use_face_contour,
+            joints_to_ign=args.get('joints_to_ign'),
+            dtype=dtype).to(device=device, dtype=dtype)
+        # Add a fake batch dimension for broadcasting
+        joint_weights.unsqueeze_(dim=0)
+        self.joint_weights = joint_weights
+
+    def get_body_model(self, gender):
+        ''' Returns the body model of a gender, created on first use '''
+        if gender not in self.body_models:
+            # SMPL-H has no gender-neutral model
+            if gender == 'neutral' and self.model_type == 'smplh':
+                raise ValueError('SMPL-H has no gender-neutral model')
+            self.body_models[gender] = smplx.create(
+                gender=gender, **self.model_params).to(device=self.device)
+        return self.body_models[gender]
+
+    def create_batch_models(self, gender, batch_size):
+        ''' Returns a body model and a camera with `batch_size` rows '''
+        key = (gender, batch_size)
+        if key not in self.batch_models:
+            model_params = dict(self.model_params, batch_size=batch_size)
+            body_model = smplx.create(gender=gender, **model_params)
+
+            camera_params = dict(self.camera_params, batch_size=batch_size)
+            camera = create_camera(**camera_params)
+            if hasattr(camera, 'rotation'):
+                camera.rotation.requires_grad = False
+
+            self.batch_models[key] = (body_model.to(device=self.device),
+                                      camera.to(device=self.device))
+        return self.batch_models[key]
+
+    def fit_batch(self, gender, items, args):
+        ''' Fits a list of queued persons of the same gender at once '''
+        if not items:
+            return
+
+        def create_models(batch_size):
+            return self.create_batch_models(gender, batch_size)
+
+        fit_multi_frame([item['img'] for item in items],
+                        [item['keypoints'] for item in items],
+                        create_models=create_models,
+                        joint_weights=self.joint_weights,
+                        result_fns=[item['result_fn'] for item in items],
+                        mesh_fns=[item['mesh_fn'] for item in items],
+                        init_params=[item['init_params'] for item in items],
+                        dtype=self.dtype,
+                        **self.priors,
+                        **args)
+        del items[:]
+
+    def run(self, **overrides):
+        ''' Fits every image of a data folder
+
+            Parameters
+            ----------
+            overrides: dict
+                Per-call values (e.g. `output_folder`, `data_folder`,
+                `img_folder`, `keyp_folder`) that replace the ones given to
+                the constructor. `keypoints` hands the detections over in
+                memory instead of through the JSON files of `keyp_folder`.
+        '''
+        args = dict(self.args)
+        args.update(overrides)
+        # In-memory keypoints ({image name: OpenPose person entries}) are
+        # not part of the stored configuration
+        keypoints = args.pop('keypoints', None)
+
+        output_folder = args.pop('output_folder')
+        output_folder = osp.expandvars(output_folder)
+        if not osp.exists(output_folder):
+            os.makedirs(output_folder)
+
+        # Store the arguments for the current experiment
+        conf_fn = osp.join(output_folder, 'conf.yaml')
+        with open(conf_fn, 'w') as conf_file:
+            yaml.dump(args, conf_file)
+
+        result_folder = args.pop('result_folder', 'results')
+        result_folder = osp.join(output_folder, result_folder)
+        if not osp.exists(result_folder):
+            os.makedirs(result_folder)
+
+        mesh_folder = args.pop('mesh_folder', 'meshes')
+        mesh_folder = osp.join(output_folder, mesh_folder)
+        if not osp.exists(mesh_folder):
+            os.makedirs(mesh_folder)
+
+        out_img_folder = osp.join(output_folder, 'images')
+        if not osp.exists(out_img_folder):
+            os.makedirs(out_img_folder)
+
+        img_folder = args.pop('img_folder', 'images')
+        dataset_obj = create_dataset(img_folder=img_folder,
+                                     keypoints=keypoints, **args)
+
+        start = time.time()
+
+        input_gender = args.pop('gender', 'neutral')
+        gender_lbl_type = args.pop('gender_lbl_type', 'none')
+        max_persons = args.pop('max_persons', -1)
+        batch_fitting = args.pop('batch_fitting', False)
+        fit_batch_size = max(args.pop('fit_batch_size', 8), 1)
+        # Fitting the orientations of a single person in parallel is a batch
+        # of one person with two rows
+        parallel_orient = args.pop('parallel_orient', False)
+        if parallel_orient and not batch_fitting:
+            batch_fitting, fit_batch_size = True, 1
+        warm_start = args.pop('warm_start', False)
+        # Per-stage iterations/time/error of every fit of this call
+        stage_stats = []
+        args['stage_stats'] = stage_stats
+
+        dtype = self.dtype
+        camera = self.camera
+        joint_weights = self.joint_weights
+
+        # Persons waiting to be fitted in batch mode, grouped by gender
+        # since every batch shares one body model
+        pending = {}
+
+        for idx, data in enumerate(dataset_obj):
+            # Images without detections (no keypoint file) are not fitted
+            if not data:
                 continue
 
-            curr_result_fn = osp.join(curr_result_folder,
-                                      '{:03d}.pkl'.format(person_id))
-            curr_mesh_fn = osp.join(curr_mesh_folder,
-                                    '{:03d}.obj'.format(person_id))
-
-            curr_img_folder = osp.join(output_folder, 'images'
-                                       .format(person_id))
-            if not osp.exists(curr_img_folder):
-                os.makedirs(curr_img_folder)
-
-            if gender_lbl_type != 'none':
-                if gender_lbl_type == 'pd' and 'gender_pd' in data:
-                    gender = data['gender_pd'][person_id]
-                if gender_lbl_type == 'gt' and 'gender_gt' in data:
-                    gender = data['gender_gt'][person_id]
-            else:
-                gender = input_gender
-
-            if gender == 'neutral':
-                body_model = neutral_model
-            elif gender == 'female':
-                body_model = female_model
-            elif gender == 'male':
-                body_model = male_model
-
-            out_img_fn = osp.join(curr_img_folder, 'output.png')
-
-            fit_single_frame(img, keypoints[[person_id]],
-                             body_model=body_model,
-                             camera=camera,
-                             joint_weights=joint_weights,
-                             dtype=dtype,
-                             output_folder=output_folder,
-                             result_folder=curr_result_folder,
-                             out_img_fn=out_img_fn,
-                             result_fn=curr_result_fn,
-                             mesh_fn=curr_mesh_fn,
-                             shape_prior=shape_prior,
-                             expr_prior=expr_prior,
-                             body_pose_prior=body_pose_prior,
-                             left_hand_prior=left_hand_prior,
-                             right_hand_prior=right_hand_prior,
-                             jaw_prior=jaw_prior,
-                             angle_prior=angle_prior,
-                             **args)
-
-    elapsed = time.time() - start
-    time_msg = time.strftime('%H hours, %M minutes, %S seconds',
-                             time.gmtime(elapsed))
-    print('Processing the data took: {}'.format(time_msg))
+            img = data['img']
+            fn = data['fn']
+            keypoints = data['keypoints']
+            print('Processing: {}'.format(data['img_path']))
+
+            # Every image is fitted exactly once and its results are keyed by
+            # the image name, e.g. results/<fn>/000.pkl
+            curr_result_folder = osp.join(result_folder, fn)
+            if not osp.exists(curr_result_folder):
+                os.makedirs(curr_result_folder)
+            curr_mesh_folder = osp.join(mesh_folder, fn)
+            if not osp.exists(curr_mesh_folder):
+                os.makedirs(curr_mesh_folder)
+            for person_id in range(keypoints.shape[0]):
+                if person_id >= max_persons and max_persons > 0:
+                    continue
+
+                curr_result_fn = osp.join(curr_result_folder,
+                                          '{:03d}.pkl'.format(person_id))
+                curr_mesh_fn = osp.join(curr_mesh_folder,
+                                        '{:03d}.obj'.format(person_id))
+
+                curr_img_folder = osp.join(output_folder, 'images', fn,
+                                           '{:03d}'.format(person_id))
+                if not osp.exists(curr_img_folder):
+                    os.makedirs(curr_img_folder)
+
+                if gender_lbl_type != 'none':
+                    if gender_lbl_type == 'pd' and 'gender_pd' in data:
+                        gender = data['gender_pd'][person_id]
+                    if gender_lbl_type == 'gt' and 'gender_gt' in data:
+                        gender = data['gender_gt'][person_id]
+                else:
+                    gender = input_gender
+
+                init_params = None
+                if warm_start and 'init' in data:
+                    init_params = data['init'][person_id]
+
+                if batch_fitting:
+                    queue = pending.setdefault(gender, [])
+                    queue.append(dict(img=img,
+                                      keypoints=keypoints[[person_id]],
+                                      result_fn=curr_result_fn,
+                                      mesh_fn=curr_mesh_fn,
+                                      init_params=init_params))
+                    if len(queue) >= fit_batch_size:
+                        self.fit_batch(gender, queue, args)
+                    continue
+
+                body_model = self.get_body_model(gender)
+
+                out_img_fn = osp.join(curr_img_folder, 'output.png')
+
+                fit_single_frame(img, keypoints[[person_id]],
+                                 body_model=body_model,
+                                 camera=camera,
+                                 joint_weights=joint_weights,
+                                 dtype=dtype,
+                                 output_folder=output_folder,
+                                 result_folder=curr_result_folder,
+                                 out_img_fn=out_img_fn,
+                                 result_fn=curr_result_fn,
+                                 mesh_fn=curr_mesh_fn,
+                                 init_params=init_params,
+                                 **self.priors,
+                                 **args)
+
+        for gender, queue in pending.items():
+            self.fit_batch(gender, queue, args)
+
+        elapsed = time.time() - start
+        time_msg = time.strftime('%H hours, %M minutes, %S seconds',
+                                 time.gmtime(elapsed))
+        print('Processing the data took: {}'.format(time_msg))
+        if stage_stats:
+            print(stage_summary(stage_stats))
+        self.stage_stats = stage_stats
+
+
+def main(**args):
+    SMPLifyXRunner(**args).run()
 
 
 if __name__ == "__main__":
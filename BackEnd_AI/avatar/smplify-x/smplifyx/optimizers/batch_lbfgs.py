@@ -0,0 +1,276 @@
+# -*- coding: utf-8 -*-
+
+# L-BFGS over a batch of independent problems.
+#
+# Every parameter is expected to hold B independent samples along its first
+# dimension (e.g. the B x 10 betas of a body model created with
+# batch_size=B) and the closure must return the B per-sample losses. Each
+# sample keeps its own curvature history, initial Hessian scale, step
+# length and convergence flag, so the samples are optimized exactly as if
+# they were run one by one, while sharing a single forward/backward pass per
+# function evaluation.
+
+import torch
+
+from torch.optim import Optimizer
+
+
+class BatchLBFGS(Optimizer):
+    """Implements L-BFGS for B independent problems packed along dim 0.
+
+    The line search is a per-sample backtracking search on the Armijo
+    condition: samples whose trial step is accepted are frozen while the
+    step of the others keeps being halved.
+
+    Arguments:
+        params (iterable): iterable of parameters to optimize. The first
+            dimension of every parameter must be the batch dimension.
+        lr (float): initial step length (default: 1)
+        max_iter (int): maximal number of iterations per optimization step
+            (default: 20)
+        tolerance_grad (float): per-sample termination tolerance on first
+            order optimality (default: 1e-5).
+        tolerance_change (float): per-sample termination tolerance on
+            function value/parameter changes (default: 1e-9).
+        history_size (int): update history size (default: 100).
+        max_ls (int): maximal number of halvings in the line search
+            (default: 25).
+        c1 (float): sufficient decrease constant (default: 1e-4).
+    """
+
+    def __init__(self, params, lr=1, max_iter=20, tolerance_grad=1e-5,
+                 tolerance_change=1e-9, history_size=100, max_ls=25,
+                 c1=1e-4):
+        defaults = dict(lr=lr, max_iter=max_iter,
+                        tolerance_grad=tolerance_grad,
+                        tolerance_change=tolerance_change,
+                        history_size=history_size, max_ls=max_ls, c1=c1)
+        super(BatchLBFGS, self).__init__(params, defaults)
+
+        if len(self.param_groups) != 1:
+            raise ValueError("BatchLBFGS doesn't support per-parameter "
+                             "options (parameter groups)")
+
+        self._params = self.param_groups[0]['params']
+        batch_sizes = set(p.shape[0] for p in self._params)
+        if len(batch_sizes) != 1:
+            raise ValueError('All parameters must share the same batch '
+                             'dimension, got {}'.format(sorted(batch_sizes)))
+        self.batch_size = batch_sizes.pop()
+
+    def _gather_flat_grad(self):
+        views = []
+        for p in self._params:
+            if p.grad is None:
+                view = p.new_zeros(self.batch_size, p[0].numel())
+            else:
+                view = p.grad.reshape(self.batch_size, -1)
+            views.append(view)
+        return torch.cat(views, 1)
+
+    def _set_flat_grad(self, flat_grad):
+        # Keep .grad consistent with the point each sample ended up at, so
+        # that callers can check per-sample gradient tolerances
+        offset = 0
+        for p in self._params:
+            numel = p[0].numel()
+            if p.grad is not None:
+                p.grad.copy_(flat_grad[:, offset:offset + numel].view_as(p))
+            offset += numel
+
+    def _clone_param(self):
+        return [p.detach().clone() for p in self._params]
+
+    def _add_step(self, x, t, d):
+        # x + t * d, with a separate step length t for every sample
+        offset = 0
+        for p, p_init in zip(self._params, x):
+            numel = p[0].numel()
+            step = (t.unsqueeze(dim=-1) * d[:, offset:offset + numel])
+            p.data.copy_(p_init + step.view_as(p))
+            offset += numel
+
+    @staticmethod
+    def _rowdot(a, b):
+        return (a * b).sum(dim=-1)
+
+    @torch.no_grad()
+    def step(self, closure, active=None):
+        """Performs a single optimization step.
+
+        Arguments:
+            closure (callable): A closure that reevaluates the model, calls
+                backward on the sum of the per-sample losses and returns the
+                B per-sample losses.
+            active (torch.BoolTensor, optional): B flags; samples that are
+                not active are left untouched.
+
+        Returns:
+            The B per-sample losses at the end of the step (detached).
+        """
+        group = self.param_groups[0]
+        lr = group['lr']
+        max_iter = group['max_iter']
+        tolerance_grad = group['tolerance_grad']
+        tolerance_change = group['tolerance_change']
+        history_size = group['history_size']
+        max_ls = group['max_ls']
+        c1 = group['c1']
+
+        def evaluate():
+            with torch.enable_grad():
+                loss = closure()
+            return loss.detach(), self._gather_flat_grad()
+
+        state = self.state[self._params[0]]
+        state.setdefault('n_iter', 0)
+
+        loss, flat_grad = evaluate()
+        batch_size = loss.shape[0]
+        if active is None:
+            active = torch.ones(batch_size, dtype=torch.bool,
+                                device=loss.device)
+        else:
+            active = active.to(device=loss.device).clone()
+        active &= flat_grad.abs().max(dim=1)[0] > tolerance_grad
+        if not active.any():
+            return loss
+
+        # tensors cached in state. The curvature pairs are kept in per-sample
+        # buffers, newest last: a sample that skips an update (or idles while
+        # the others iterate) keeps its own last `history_size` pairs.
+        old_dirs = state.get('old_dirs')
+        old_stps = state.get('old_stps')
+        ro = state.get('ro')
+        num_old = state.get('num_old')
+        H_diag = state.get('H_diag')
+        d = state.get('d')
+        t = state.get('t')
+        prev_flat_grad = state.get('prev_flat_grad')
+        if old_dirs is None:
+            old_dirs = flat_grad.new_zeros(
+                batch_size, history_size, flat_grad.shape[1])
+            old_stps = torch.zeros_like(old_dirs)
+            ro = flat_grad.new_zeros(batch_size, history_size)
+            num_old = torch.zeros(batch_size, dtype=torch.long,
+                                  device=loss.device)
+
+        n_iter = 0
+        while n_iter < max_iter and active.any():
+            n_iter += 1
+            state['n_iter'] += 1
+
+            ############################################################
+            # compute gradient descent direction
+            ############################################################
+            if prev_flat_grad is None:
+                d = flat_grad.neg()
+                H_diag = torch.ones_like(loss)
+            else:
+                y = flat_grad.sub(prev_flat_grad)
+                s = d.mul(t.unsqueeze(dim=-1))
+                ys = self._rowdot(y, s)
+                # Only the samples that satisfy the curvature condition
+                # update their memory
+                valid = ys > 1e-10
+                if valid.any():
+                    shift = valid.view(-1, 1, 1)
+                    old_dirs = torch.where(shift, torch.cat(
+                        [old_dirs[:, 1:], y.unsqueeze(dim=1)], dim=1),
+                        old_dirs)
+                    old_stps = torch.where(shift, torch.cat(
+                        [old_stps[:, 1:], s.unsqueeze(dim=1)], dim=1),
+                        old_stps)
+                    ro = torch.where(valid.unsqueeze(dim=-1), torch.cat(
+                        [ro[:, 1:], (1. / ys.clamp(min=1e-10)).unsqueeze(
+                            dim=-1)], dim=1), ro)
+                    num_old = torch.where(
+                        valid, (num_old + 1).clamp(max=history_size),
+                        num_old)
+
+                    yy = self._rowdot(y, y).clamp(min=1e-20)
+                    H_diag = torch.where(valid, ys / yy, H_diag)
+
+                # Slots that a sample has not filled yet have a zero weight
+                # and leave its direction unchanged
+                first = history_size - int(num_old.max())
+                al = [None] * history_size
+                q = flat_grad.neg()
+                for i in range(history_size - 1, first - 1, -1):
+                    al[i] = self._rowdot(old_stps[:, i], q) * ro[:, i]
+                    q.sub_(al[i].unsqueeze(dim=-1) * old_dirs[:, i])
+
+                d = r = q * H_diag.unsqueeze(dim=-1)
+                for i in range(first, history_size):
+                    be_i = self._rowdot(old_dirs[:, i], r) * ro[:, i]
+                    r.add_((al[i] - be_i).unsqueeze(dim=-1) * old_stps[:, i])
+
+            # Inactive samples do not move
+            d = d * active.unsqueeze(dim=-1)
+
+            if prev_flat_grad is None:
+                prev_flat_grad = flat_grad.clone()
+            else:
+                prev_flat_grad.copy_(flat_grad)
+            prev_loss = loss
+
+            ############################################################
+            # compute step length
+            ############################################################
+            if state['n_iter'] == 1:
+                t = (1. / flat_grad.abs().sum(dim=1)).clamp(max=1.) * lr
+            else:
+                t = torch.full_like(loss, lr)
+
+            # directional derivative
+            gtd = self._rowdot(flat_grad, d)
+            # directional derivative is below tolerance
+            active &= gtd <= -tolerance_change
+            if not active.any():
+                break
+            t = torch.where(active, t, torch.zeros_like(t))
+
+            # per-sample backtracking line search (Armijo)
+            x_init = self._clone_param()
+            searching = active.clone()
+            new_loss, new_grad = loss.clone(), flat_grad.clone()
+            for _ in range(max_ls):
+                # Samples accepted earlier stay at their accepted point
+                self._add_step(x_init, t, d)
+                trial_loss, trial_grad = evaluate()
+                accepted = searching & (
+                    trial_loss <= loss + c1 * t * gtd)
+                new_loss = torch.where(accepted, trial_loss, new_loss)
+                new_grad = torch.where(accepted.unsqueeze(dim=-1),
+                                       trial_grad, new_grad)
+                searching &= ~accepted
+                if not searching.any():
+                    break
+                t = torch.where(searching, t * 0.5, t)
+
+            # Samples without an acceptable step stay where they were
+            t = torch.where(searching, torch.zeros_like(t), t)
+            active &= ~searching
+            self._add_step(x_init, t, d)
+
+            loss, flat_grad = new_loss, new_grad
+            self._set_flat_grad(flat_grad)
+
+            ############################################################
+            # check conditions
+            ############################################################
+            active &= flat_grad.abs().max(dim=1)[0] > tolerance_grad
+            active &= d.mul(t.unsqueeze(dim=-1)).abs().max(dim=1)[0] > \
+                tolerance_change
+            active &= (loss - prev_loss).abs() >= tolerance_change
+
+        state['d'] = d
+        state['t'] = t
+        state['old_dirs'] = old_dirs
+        state['old_stps'] = old_stps
+        state['ro'] = ro
+        state['num_old'] = num_old
+        state['H_diag'] = H_diag
+        state['prev_flat_grad'] = prev_flat_grad
+
+        return loss
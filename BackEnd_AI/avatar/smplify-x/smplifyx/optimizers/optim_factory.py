@@ -22,6 +22,7 @@ from __future__ import division
 
 import torch.optim as optim
 from .lbfgs_ls import LBFGS as LBFGSLs
+from .batch_lbfgs import BatchLBFGS
 
 
 def create_optimizer(parameters, optim_type='lbfgs',
@@ -50,6 +51,8 @@ def create_optimizer(parameters, optim_type='lbfgs',
     elif optim_type == 'lbfgsls':
         return LBFGSLs(parameters, lr=lr, max_iter=maxiters,
                        line_search_fn='strong_Wolfe'), False
+    elif optim_type == 'batch_lbfgs':
+        return BatchLBFGS(parameters, lr=lr, max_iter=maxiters), False
     elif optim_type == 'rmsprop':
         return (optim.RMSprop(parameters, lr=lr, epsilon=epsilon,
                               alpha=rmsprop_alpha,
@@ -94,7 +94,9 @@ class L2Prior(nn.Module):
         super(L2Prior, self).__init__()
 
     def forward(self, module_input, *args):
-        return torch.sum(module_input.pow(2))
+        # One value per sample; the callers reduce over the batch
+        return module_input.pow(2).reshape(module_input.shape[0], -1).sum(
+            dim=-1)
 
 
 class MaxMixturePrior(nn.Module):
@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+
+# Process-wide registry of the read-only artifacts of a fit.
+#
+# VPoser and the mixture priors never change during an optimization: only
+# the pose embedding and the body model parameters are optimized. They are
+# loaded once per (checkpoint, device) pair and shared by every fit that
+# runs in the process, instead of being read from disk and moved to the
+# device for every person. The joint models hold the precomputed joint
+# regressors of a body model and are kept for as long as that body model.
+
+from __future__ import absolute_import
+from __future__ import print_function
+from __future__ import division
+
+import os.path as osp
+import threading
+import weakref
+
+import torch
+import torch.nn as nn
+
+import prior as prior_module
+from joint_model import JointModel
+
+_lock = threading.Lock()
+_entries = {}
+_joint_models = weakref.WeakKeyDictionary()
+
+
+def cached(key, create):
+    ''' Returns the entry stored under `key`, calling `create` the first
+        time it is requested
+    '''
+    with _lock:
+        if key not in _entries:
+            _entries[key] = create()
+        return _entries[key]
+
+
+def clear():
+    ''' Drops every entry, e.g. to free the device memory '''
+    with _lock:
+        _entries.clear()
+        _joint_models.clear()
+
+
+def load_vposer(vposer_ckpt, device=None):
+    ''' Returns the V-Poser snapshot of `vposer_ckpt`, in evaluation mode on
+        `device`
+
+        The weights are frozen: the gradients of the fit only flow to the
+        pose embedding, so they are not accumulated in the decoder.
+    '''
+    vposer_ckpt = osp.abspath(osp.expandvars(vposer_ckpt))
+
+    def create():
+        from human_body_prior.tools.model_loader import load_vposer as load
+        vposer, _ = load(vposer_ckpt, vp_model='snapshot')
+        vposer = vposer.to(device=device)
+        vposer.eval()
+        for param in vposer.parameters():
+            param.requires_grad_(False)
+        return vposer
+
+    return cached(('vposer', vposer_ckpt, str(device)), create)
+
+
+def create_prior(prior_type, device=None, **kwargs):
+    ''' Same as `prior.create_prior`, followed by a move to `device`
+
+        The mixture priors, which read a pickle and invert every covariance
+        matrix when they are built, only hold buffers and are shared. The
+        other priors are cheap to build and are created on every call.
+    '''
+    if prior_type != 'gmm':
+        prior = prior_module.create_prior(prior_type=prior_type, **kwargs)
+        if isinstance(prior, nn.Module):
+            prior = prior.to(device=device)
+        return prior
+
+    key = ('gmm',
+           osp.abspath(osp.expandvars(kwargs.get('prior_folder', 'prior'))),
+           kwargs.get('num_gaussians', 6), kwargs.get('epsilon', 1e-16),
+           kwargs.get('use_merged', True),
+           str(kwargs.get('dtype', torch.float32)), str(device))
+    return cached(key, lambda: prior_module.create_prior(
+        prior_type=prior_type, **kwargs).to(device=device))
+
+
+def joint_model(body_model):
+    ''' Returns the `JointModel` of `body_model`, built on its first use
+
+        The body models of a resident runner are reused by every fit, so
+        their joint regressors are only precomputed once. The joint model is
+        rebuilt if the body model has been moved to another device.
+    '''
+    with _lock:
+        model = _joint_models.get(body_model)
+        if (model is None or
+                model.J_template.device != body_model.v_template.device):
+            model = _joint_models[body_model] = JointModel(body_model)
+        return model
@@ -25,7 +25,14 @@ import torch
 import torch.nn as nn
 import torch.autograd as autograd
 
-import bvh_cuda
+try:
+    import bvh_cuda
+except ImportError:
+    bvh_cuda = None
+try:
+    import bvh_cpu
+except ImportError:
+    bvh_cpu = None
 
 
 class BVHFunction(autograd.Function):
@@ -35,8 +42,15 @@ class BVHFunction(autograd.Function):
     @staticmethod
     @torch.no_grad()
     def forward(ctx, triangles):
-        outputs = bvh_cuda.forward(triangles,
-                                   max_collisions=BVHFunction.max_collisions)
+        # The backend follows the device of the triangles
+        backend = bvh_cuda if triangles.is_cuda else bvh_cpu
+        if backend is None:
+            raise RuntimeError(
+                'The {} BVH extension is not built, reinstall '
+                'mesh_intersection'.format(
+                    'CUDA' if triangles.is_cuda else 'CPU'))
+        outputs = backend.forward(triangles.contiguous(),
+                                  max_collisions=BVHFunction.max_collisions)
         ctx.save_for_backward(outputs, triangles)
         return outputs
 
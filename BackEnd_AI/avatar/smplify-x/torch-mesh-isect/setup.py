@@ -22,7 +22,8 @@ import os.path as osp
 from setuptools import find_packages, setup
 
 import torch
-from torch.utils.cpp_extension import BuildExtension, CUDAExtension
+from torch.utils.cpp_extension import (BuildExtension, CppExtension,
+                                       CUDAExtension, CUDA_HOME)
 
 # Package meta-data.
 NAME = 'mesh_intersection'
@@ -64,9 +65,17 @@ bvh_extra_compile_args = {'nvcc': ['-DPRINT_TIMINGS=0', '-DDEBUG_PRINT=0',
                                    '-DERROR_CHECKING=1',
                                    '-DCOLLISION_ORDERING=1'],
                           'cxx': []}
-bvh_extension = CUDAExtension('bvh_cuda', bvh_src_files,
-                              include_dirs=bvh_include_dirs,
-                              extra_compile_args=bvh_extra_compile_args)
+# The CPU backend is always built, the CUDA one only when the toolkit is found
+bvh_cpu_extension = CppExtension('bvh_cpu', ['src/bvh_cpu.cpp'],
+                                 extra_compile_args={'cxx': ['-O3',
+                                                             '-fopenmp']},
+                                 extra_link_args=['-fopenmp'])
+ext_modules = [bvh_cpu_extension]
+if CUDA_HOME is not None:
+    bvh_extension = CUDAExtension('bvh_cuda', bvh_src_files,
+                                  include_dirs=bvh_include_dirs,
+                                  extra_compile_args=bvh_extra_compile_args)
+    ext_modules.append(bvh_extension)
 
 render_reqs = ['pyrender>=0.1.23', 'trimesh>=2.37.6', 'shapely']
 
@@ -80,7 +89,7 @@ setup(name=NAME,
       python_requires=REQUIRES_PYTHON,
       url=URL,
       packages=find_packages(),
-      ext_modules=[bvh_extension],
+      ext_modules=ext_modules,
       classifiers=[
           "License :: OSI Approved :: GNU General Public License v3 (GPLv3)",
           "Environment :: Console",
@@ -0,0 +1,358 @@
+/*
+   CPU backend of the BVH collision detection.
+
+   Same method and output as the CUDA kernel: for every mesh of the batch a
+   linear BVH is built over the Morton codes of the triangle centroids, every
+   triangle queries the tree with its bounding box, and the candidate pairs
+   are checked with the separating axis test. Each triangle reports at most
+   max_collisions pairs, in its own slots of the output. Triangles are
+   processed in parallel with OpenMP.
+*/
+#include <torch/extension.h>
+
+#include <algorithm>
+#include <cmath>
+#include <vector>
+
+#ifdef _OPENMP
+#include <omp.h>
+#endif
+
+#define CHECK_CPU(x) TORCH_CHECK(!x.is_cuda(), #x " must be a CPU tensor")
+#define CHECK_CONTIGUOUS(x) TORCH_CHECK(x.is_contiguous(), #x " must be contiguous")
+#define CHECK_INPUT(x) CHECK_CPU(x); CHECK_CONTIGUOUS(x)
+
+typedef unsigned int MortonCode;
+
+template <typename T> struct vec3 {
+  T x, y, z;
+};
+
+template <typename T> inline vec3<T> operator-(const vec3<T> &a, const vec3<T> &b) {
+  return {a.x - b.x, a.y - b.y, a.z - b.z};
+}
+
+template <typename T> inline T dot(const vec3<T> &a, const vec3<T> &b) {
+  return a.x * b.x + a.y * b.y + a.z * b.z;
+}
+
+template <typename T> inline vec3<T> cross(const vec3<T> &a, const vec3<T> &b) {
+  return {a.y * b.z - a.z * b.y, a.z * b.x - a.x * b.z, a.x * b.y - a.y * b.x};
+}
+
+template <typename T> inline bool operator==(const vec3<T> &a, const vec3<T> &b) {
+  return a.x == b.x && a.y == b.y && a.z == b.z;
+}
+
+template <typename T> struct Triangle {
+  vec3<T> v0, v1, v2;
+};
+
+template <typename T> struct AABB {
+  T min_t[3];
+  T max_t[3];
+
+  void set(const Triangle<T> &tri) {
+    const T *v[3] = {&tri.v0.x, &tri.v1.x, &tri.v2.x};
+    for (int d = 0; d < 3; ++d) {
+      min_t[d] = std::min(v[0][d], std::min(v[1][d], v[2][d]));
+      max_t[d] = std::max(v[0][d], std::max(v[1][d], v[2][d]));
+    }
+  }
+
+  void merge(const AABB<T> &other) {
+    for (int d = 0; d < 3; ++d) {
+      min_t[d] = std::min(min_t[d], other.min_t[d]);
+      max_t[d] = std::max(max_t[d], other.max_t[d]);
+    }
+  }
+
+  bool overlaps(const AABB<T> &other) const {
+    return (min_t[0] <= other.max_t[0]) && (max_t[0] >= other.min_t[0]) &&
+           (min_t[1] <= other.max_t[1]) && (max_t[1] >= other.min_t[1]) &&
+           (min_t[2] <= other.max_t[2]) && (max_t[2] >= other.min_t[2]);
+  }
+};
+
+template <typename T> struct BVHNode {
+  AABB<T> bbox;
+  // Children, -1 for the leaves
+  int left;
+  int right;
+  // The triangle of a leaf
+  int idx;
+  // The last position, in Morton order, of the leaves below the node
+  int rightmost;
+};
+
+template <typename T>
+inline bool TriangleTriangleOverlap(const Triangle<T> &tri1,
+                                    const Triangle<T> &tri2,
+                                    const vec3<T> &sep_axis) {
+  T p0 = dot(sep_axis, tri1.v0), p1 = dot(sep_axis, tri1.v1),
+    p2 = dot(sep_axis, tri1.v2);
+  T q0 = dot(sep_axis, tri2.v0), q1 = dot(sep_axis, tri2.v1),
+    q2 = dot(sep_axis, tri2.v2);
+  T tri1_min = std::min(p0, std::min(p1, p2));
+  T tri1_max = std::max(p0, std::max(p1, p2));
+  T tri2_min = std::min(q0, std::min(q1, q2));
+  T tri2_max = std::max(q0, std::max(q1, q2));
+  return (tri1_min <= tri2_max) && (tri1_max >= tri2_min);
+}
+
+template <typename T>
+bool TriangleTriangleIsectSepAxis(const Triangle<T> &tri1,
+                                  const Triangle<T> &tri2) {
+  vec3<T> tri1_edge0 = tri1.v1 - tri1.v0;
+  vec3<T> tri1_edge1 = tri1.v2 - tri1.v0;
+  vec3<T> tri1_edge2 = tri1.v2 - tri1.v1;
+  vec3<T> tri1_normal = cross(tri1_edge1, tri1_edge2);
+
+  vec3<T> tri2_edge0 = tri2.v1 - tri2.v0;
+  vec3<T> tri2_edge1 = tri2.v2 - tri2.v0;
+  vec3<T> tri2_edge2 = tri2.v2 - tri2.v1;
+  vec3<T> tri2_normal = cross(tri2_edge1, tri2_edge2);
+
+  // Same axes as the CUDA kernel, the last six handle coplanar triangles
+  const vec3<T> axes[17] = {
+      tri1_normal,
+      tri2_normal,
+      cross(tri1_edge0, tri2_edge0),
+      cross(tri1_edge0, tri2_edge1),
+      cross(tri1_edge0, tri2_edge2),
+      cross(tri1_edge1, tri2_edge0),
+      cross(tri1_edge1, tri2_edge1),
+      cross(tri1_edge1, tri2_edge2),
+      cross(tri1_edge2, tri2_edge0),
+      cross(tri1_edge2, tri2_edge1),
+      cross(tri1_edge2, tri2_edge2),
+      cross(tri1_normal, tri1_edge0),
+      cross(tri1_normal, tri1_edge1),
+      cross(tri1_normal, tri1_edge2),
+      cross(tri1_normal, tri2_edge0),
+      cross(tri1_normal, tri2_edge1),
+      cross(tri1_normal, tri2_edge2),
+  };
+
+  for (int i = 0; i < 17; ++i) {
+    if (!TriangleTriangleOverlap(tri1, tri2, axes[i])) {
+      return false;
+    }
+  }
+  return true;
+}
+
+// Returns true if the triangles share one or multiple vertices
+template <typename T>
+inline bool shareVertex(const Triangle<T> &tri1, const Triangle<T> &tri2) {
+  return tri1.v0 == tri2.v0 || tri1.v0 == tri2.v1 || tri1.v0 == tri2.v2 ||
+         tri1.v1 == tri2.v0 || tri1.v1 == tri2.v1 || tri1.v1 == tri2.v2 ||
+         tri1.v2 == tri2.v0 || tri1.v2 == tri2.v1 || tri1.v2 == tri2.v2;
+}
+
+// Expands a 10-bit integer into 30 bits
+// by inserting 2 zeros after each bit.
+inline MortonCode expandBits(MortonCode v) {
+  v = (v * 0x00010001u) & 0xFF0000FFu;
+  v = (v * 0x00000101u) & 0x0F00F00Fu;
+  v = (v * 0x00000011u) & 0xC30C30C3u;
+  v = (v * 0x00000005u) & 0x49249249u;
+  return v;
+}
+
+// Calculates a 30-bit Morton code for the
+// given 3D point located within the unit cube [0,1].
+template <typename T> inline MortonCode morton3D(T x, T y, T z) {
+  x = std::min(std::max(x * T(1024), T(0)), T(1023));
+  y = std::min(std::max(y * T(1024), T(0)), T(1023));
+  z = std::min(std::max(z * T(1024), T(0)), T(1023));
+  return expandBits((MortonCode)x) * 4 + expandBits((MortonCode)y) * 2 +
+         expandBits((MortonCode)z);
+}
+
+// Splits the sorted range [first, last] at the highest bit that differs
+// between its Morton codes, or in the middle if they are all the same
+inline int findSplit(const std::vector<MortonCode> &codes, int first,
+                     int last) {
+  MortonCode first_code = codes[first];
+  MortonCode last_code = codes[last];
+  if (first_code == last_code) {
+    return (first + last) >> 1;
+  }
+  int common_prefix = __builtin_clz(first_code ^ last_code);
+
+  // Binary search for the last code that shares more than common_prefix
+  // bits with the first one
+  int split = first;
+  int step = last - first;
+  do {
+    step = (step + 1) >> 1;
+    int new_split = split + step;
+    if (new_split < last) {
+      int split_prefix = __builtin_clz(first_code ^ codes[new_split]);
+      if (split_prefix > common_prefix) {
+        split = new_split;
+      }
+    }
+  } while (step > 1);
+  return split;
+}
+
+template <typename T>
+int buildTree(std::vector<BVHNode<T>> &nodes, const std::vector<int> &order,
+              const std::vector<MortonCode> &codes,
+              const std::vector<AABB<T>> &boxes, int first, int last) {
+  int node_idx = (int)nodes.size();
+  nodes.emplace_back();
+  if (first == last) {
+    BVHNode<T> &leaf = nodes[node_idx];
+    leaf.bbox = boxes[order[first]];
+    leaf.left = leaf.right = -1;
+    leaf.idx = order[first];
+    leaf.rightmost = first;
+    return node_idx;
+  }
+
+  int split = findSplit(codes, first, last);
+  int left = buildTree(nodes, order, codes, boxes, first, split);
+  int right = buildTree(nodes, order, codes, boxes, split + 1, last);
+
+  BVHNode<T> &node = nodes[node_idx];
+  node.left = left;
+  node.right = right;
+  node.idx = -1;
+  node.bbox = nodes[left].bbox;
+  node.bbox.merge(nodes[right].bbox);
+  node.rightmost = last;
+  return node_idx;
+}
+
+template <typename T>
+void bvh_cpu_forward_mesh(const Triangle<T> *triangles, int num_triangles,
+                          int64_t *collisions, int max_collisions) {
+  if (num_triangles < 2) {
+    return;
+  }
+
+  std::vector<AABB<T>> boxes(num_triangles);
+  for (int i = 0; i < num_triangles; ++i) {
+    boxes[i].set(triangles[i]);
+  }
+  AABB<T> scene_bb = boxes[0];
+  for (int i = 1; i < num_triangles; ++i) {
+    scene_bb.merge(boxes[i]);
+  }
+
+  // Sort the triangles by the Morton codes of their centroids
+  std::vector<MortonCode> morton_codes(num_triangles);
+  for (int i = 0; i < num_triangles; ++i) {
+    T centroid[3];
+    T normalized[3];
+    const Triangle<T> &tri = triangles[i];
+    centroid[0] = (tri.v0.x + tri.v1.x + tri.v2.x) / T(3);
+    centroid[1] = (tri.v0.y + tri.v1.y + tri.v2.y) / T(3);
+    centroid[2] = (tri.v0.z + tri.v1.z + tri.v2.z) / T(3);
+    for (int d = 0; d < 3; ++d) {
+      T extent = scene_bb.max_t[d] - scene_bb.min_t[d];
+      normalized[d] =
+          extent > T(0) ? (centroid[d] - scene_bb.min_t[d]) / extent : T(0);
+    }
+    morton_codes[i] = morton3D(normalized[0], normalized[1], normalized[2]);
+  }
+  std::vector<int> order(num_triangles);
+  for (int i = 0; i < num_triangles; ++i) {
+    order[i] = i;
+  }
+  std::sort(order.begin(), order.end(), [&morton_codes](int a, int b) {
+    return morton_codes[a] < morton_codes[b] ||
+           (morton_codes[a] == morton_codes[b] && a < b);
+  });
+  std::vector<MortonCode> sorted_codes(num_triangles);
+  for (int i = 0; i < num_triangles; ++i) {
+    sorted_codes[i] = morton_codes[order[i]];
+  }
+
+  std::vector<BVHNode<T>> nodes;
+  nodes.reserve(2 * num_triangles - 1);
+  buildTree(nodes, order, sorted_codes, boxes, 0, num_triangles - 1);
+
+  // Like the CUDA kernel, every query triangle owns max_collisions output
+  // slots: [query_idx * max_collisions, (query_idx + 1) * max_collisions)
+#pragma omp parallel
+  {
+    std::vector<int> found;
+    std::vector<int> stack;
+
+#pragma omp for schedule(dynamic, 256) nowait
+    for (int pos = 0; pos < num_triangles; ++pos) {
+      int query_idx = order[pos];
+      const AABB<T> &query_bbox = boxes[query_idx];
+      const Triangle<T> &query_tri = triangles[query_idx];
+
+      // Every pair is reported once: only the leaves that come after the
+      // query in Morton order are checked
+      found.clear();
+      stack.assign(1, 0);
+      while (!stack.empty()) {
+        const BVHNode<T> &node = nodes[stack.back()];
+        stack.pop_back();
+        if (node.rightmost <= pos || !node.bbox.overlaps(query_bbox)) {
+          continue;
+        }
+        if (node.left < 0) {
+          const Triangle<T> &other_tri = triangles[node.idx];
+          if (TriangleTriangleIsectSepAxis(query_tri, other_tri) &&
+              !shareVertex(query_tri, other_tri)) {
+            found.push_back(node.idx);
+          }
+          continue;
+        }
+        stack.push_back(node.right);
+        stack.push_back(node.left);
+      }
+
+      // Keep the max_collisions partners with the lowest indices
+      std::sort(found.begin(), found.end());
+      int num_found = std::min((int)found.size(), max_collisions);
+      int64_t *out = collisions + 2 * (int64_t)query_idx * max_collisions;
+      for (int i = 0; i < num_found; ++i) {
+        out[2 * i] = std::min(query_idx, found[i]);
+        out[2 * i + 1] = std::max(query_idx, found[i]);
+      }
+    }
+  }
+}
+
+at::Tensor bvh_forward(at::Tensor triangles, int max_collisions = 16) {
+  CHECK_INPUT(triangles);
+  TORCH_CHECK(triangles.dim() == 4 && triangles.size(2) == 3 &&
+                  triangles.size(3) == 3,
+              "triangles must be a BxFx3x3 tensor");
+
+  const auto batch_size = triangles.size(0);
+  const auto num_triangles = triangles.size(1);
+  const int64_t max_total = num_triangles * max_collisions;
+
+  at::Tensor collisionTensor = -1 * at::ones({batch_size, max_total, 2},
+          at::device(triangles.device()).dtype(at::kLong));
+  int64_t *collisions_ptr = collisionTensor.data_ptr<int64_t>();
+
+  AT_DISPATCH_FLOATING_TYPES(
+      triangles.scalar_type(), "bvh_cpu_forward", ([&] {
+        const Triangle<scalar_t> *triangles_ptr =
+            reinterpret_cast<const Triangle<scalar_t> *>(
+                triangles.data_ptr<scalar_t>());
+        for (int bidx = 0; bidx < batch_size; ++bidx) {
+          bvh_cpu_forward_mesh<scalar_t>(
+              triangles_ptr + num_triangles * bidx, num_triangles,
+              collisions_ptr + bidx * max_total * 2, max_collisions);
+        }
+      }));
+
+  return collisionTensor;
+}
+
+PYBIND11_MODULE(TORCH_EXTENSION_NAME, m) {
+  m.def("forward", &bvh_forward, "BVH collision forward (CPU)",
+        py::arg("triangles"), py::arg("max_collisions") = 16);
+}